@@ -0,0 +1,306 @@
+# active_sampler.py
+"""
+Pick the next batch of images to label by diversity and model uncertainty.
+
+1. Embeddings: every image under dataset/images is pushed once through the
+   MoistureVSRegressor backbone (batched, no_grad) and the pooled 1280-d
+   feature is stored as float16 in dataset/embeddings/. Later runs only embed
+   new or changed files; a new model version triggers a full re-embed.
+2. Uncertainty: MC-dropout on the regression head, evaluated on the cached
+   embeddings (the backbone is not re-run), std of moisture/100 and VS.
+3. Selection: the most uncertain `--pool-factor * batch` candidates are
+   reduced with k-center greedy (random projection to --proj-dim first), using
+   already labeled / already seeded images as existing centers.
+
+Selected images are copied into dataset/seed_images for the labeler.
+
+    python active_sampler.py --batch 100                # embed + select + copy
+    python active_sampler.py --batch 100 --dry-run --out next_batch.csv
+"""
+
+import argparse
+import json
+import os
+import shutil
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import torch
+from PIL import Image
+from torch.utils.data import Dataset, DataLoader
+
+PROJECT = Path(".").resolve()
+sys.path.append(str(Path(__file__).resolve().parent / "backend"))
+
+ALL_DIR = PROJECT / "dataset" / "images"
+SEED_DIR = PROJECT / "dataset" / "seed_images"
+SEED_CSV = PROJECT / "dataset" / "seed_labels.csv"
+EMB_DIR = PROJECT / "dataset" / "embeddings"
+EMB_PATH = EMB_DIR / "embeddings.f16.npy"
+INDEX_PATH = EMB_DIR / "index.json"
+
+IMG_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp"}
+EMB_DIM = 1280
+
+
+# --------------------------
+# Embedding store
+# --------------------------
+class EmbeddingStore:
+    """float16 (N, 1280) matrix plus a JSON index of path -> (row, mtime_ns, size)."""
+
+    def __init__(self, model_version):
+        self.model_version = model_version
+        self.rows = {}
+        self.emb = np.zeros((0, EMB_DIM), dtype=np.float16)
+        if INDEX_PATH.exists() and EMB_PATH.exists():
+            idx = json.loads(INDEX_PATH.read_text(encoding="utf-8"))
+            if idx.get("model_version") == model_version:
+                self.rows = {p: tuple(v) for p, v in idx["rows"].items()}
+                self.emb = np.load(EMB_PATH)
+            else:
+                print(f"Model changed ({idx.get('model_version')} -> {model_version}); re-embedding everything.")
+
+    def stale(self, paths):
+        out = []
+        for p in paths:
+            st = os.stat(p)
+            hit = self.rows.get(p)
+            if hit is None or hit[1] != st.st_mtime_ns or hit[2] != st.st_size:
+                out.append(p)
+        return out
+
+    def add(self, paths, feats):
+        feats = np.asarray(feats, dtype=np.float16)
+        new_rows = []
+        for p, f in zip(paths, feats):
+            st = os.stat(p)
+            if p in self.rows:
+                self.emb[self.rows[p][0]] = f
+                self.rows[p] = (self.rows[p][0], st.st_mtime_ns, st.st_size)
+            else:
+                self.rows[p] = (len(self.emb) + len(new_rows), st.st_mtime_ns, st.st_size)
+                new_rows.append(f)
+        if new_rows:
+            self.emb = np.concatenate([self.emb, np.stack(new_rows)])
+
+    def get(self, paths):
+        return self.emb[[self.rows[p][0] for p in paths]]
+
+    def save(self):
+        EMB_DIR.mkdir(parents=True, exist_ok=True)
+        tmp = EMB_PATH.with_suffix(".tmp.npy")
+        np.save(tmp, self.emb)
+        os.replace(tmp, EMB_PATH)
+        tmp_idx = INDEX_PATH.with_suffix(".tmp")
+        tmp_idx.write_text(json.dumps({"model_version": self.model_version, "rows": self.rows}), encoding="utf-8")
+        os.replace(tmp_idx, INDEX_PATH)
+
+
+class ImageFiles(Dataset):
+    def __init__(self, paths, tf, size):
+        self.paths = paths
+        self.tf = tf
+        self.size = size
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, i):
+        try:
+            with Image.open(self.paths[i]) as im:
+                im.draft("RGB", (self.size, self.size))     # reduced JPEG decode; TF resizes anyway
+                img = im.convert("RGB")
+            return self.tf(img), True
+        except Exception:
+            return torch.zeros(3, self.size, self.size), False
+
+
+@torch.no_grad()
+def embed(model, paths, tf, size, batch, workers, device):
+    """Pooled backbone features for `paths`; unreadable files are returned in `failed`."""
+    loader = DataLoader(ImageFiles(paths, tf, size), batch_size=batch, num_workers=workers)
+    feats, ok_all = [], []
+    done = 0
+    for x, ok in loader:
+        f = model.pool(model.backbone(x.to(device))).flatten(1)
+        feats.append(f.float().cpu().numpy())
+        ok_all.append(ok.numpy())
+        done += len(x)
+        print(f"  embedded {done}/{len(paths)}", end="\r")
+    print()
+    feats = np.concatenate(feats) if feats else np.zeros((0, EMB_DIM), np.float32)
+    ok_all = np.concatenate(ok_all) if ok_all else np.zeros(0, bool)
+    good = [p for p, k in zip(paths, ok_all) if k]
+    failed = [p for p, k in zip(paths, ok_all) if not k]
+    return good, feats[ok_all], failed
+
+
+# --------------------------
+# Uncertainty + diversity
+# --------------------------
+@torch.no_grad()
+def mc_dropout_uncertainty(head, emb, passes=20, batch=4096, device="cpu"):
+    """Std over `passes` stochastic head evaluations, summed over (moisture/100, vs)."""
+    head.train()          # enables Dropout; the head has no BatchNorm
+    out = np.empty(len(emb), dtype=np.float32)
+    scale = torch.tensor([0.01, 1.0], device=device)
+    for i in range(0, len(emb), batch):
+        x = torch.from_numpy(emb[i:i + batch].astype(np.float32)).to(device)
+        preds = torch.stack([head(x) * scale for _ in range(passes)])
+        out[i:i + batch] = preds.std(dim=0).sum(dim=1).cpu().numpy()
+    head.eval()
+    return out
+
+
+def random_projection(x, dim, seed):
+    if dim <= 0 or dim >= x.shape[1]:
+        return x.astype(np.float32)
+    rng = np.random.default_rng(seed)
+    R = rng.standard_normal((x.shape[1], dim)).astype(np.float32) / np.sqrt(dim)
+    return x.astype(np.float32) @ R
+
+
+def _sq_dists(a, b):
+    """Squared euclidean distances (len(a),) from every row of a to vector b."""
+    d = a - b
+    return np.einsum("ij,ij->i", d, d)
+
+
+def k_center_greedy(cand, centers, k, chunk=4096):
+    """
+    Greedy k-center: repeatedly pick the candidate farthest from all centers.
+    `centers` may be empty. Returns indices into `cand` in pick order.
+    """
+    n = len(cand)
+    min_d = np.full(n, np.inf, dtype=np.float32)
+    if len(centers):
+        cand_sq = np.einsum("ij,ij->i", cand, cand)
+        for i in range(0, len(centers), chunk):
+            c = centers[i:i + chunk]
+            d = cand_sq[:, None] - 2 * cand @ c.T + np.einsum("ij,ij->i", c, c)[None, :]
+            np.minimum(min_d, d.min(axis=1), out=min_d)
+    picks = []
+    for _ in range(min(k, n)):
+        j = int(np.argmax(min_d))
+        picks.append(j)
+        np.minimum(min_d, _sq_dists(cand, cand[j]), out=min_d)
+        min_d[j] = -1.0
+    return picks
+
+
+# --------------------------
+# Main
+# --------------------------
+def list_images(root):
+    return sorted(os.path.join(d, f) for d, _, files in os.walk(root)
+                  for f in files if os.path.splitext(f)[1].lower() in IMG_EXTS)
+
+
+def labeled_names():
+    names = set()
+    if SEED_CSV.exists():
+        df = pd.read_csv(SEED_CSV)
+        if "image" in df.columns:
+            names |= set(df["image"].dropna().astype(str).map(lambda s: Path(s).name))
+    if SEED_DIR.exists():
+        names |= {p.name for p in SEED_DIR.iterdir() if p.is_file()}
+    return names
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Select the next labeling batch by diversity + uncertainty")
+    ap.add_argument("--batch", type=int, default=100, help="Images to select")
+    ap.add_argument("--pool-factor", type=float, default=5.0,
+                    help="k-center runs over the top batch*pool_factor most uncertain candidates (0 = all)")
+    ap.add_argument("--proj-dim", type=int, default=128, help="Random projection size for k-center (0 = off)")
+    ap.add_argument("--mc-passes", type=int, default=20)
+    ap.add_argument("--embed-batch", type=int, default=32)
+    ap.add_argument("--img-size", type=int, default=320)
+    ap.add_argument("--num-workers", type=int, default=4)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--dry-run", action="store_true", help="Do not copy into seed_images")
+    ap.add_argument("--out", type=str, default=None, help="Write the selection to this CSV")
+    args = ap.parse_args()
+
+    if not ALL_DIR.is_dir():
+        print("ERROR: dataset/images directory not found:", ALL_DIR)
+        sys.exit(1)
+
+    import infer
+    device = torch.device("cpu")
+    if infer.MODEL is not None:
+        model, version, use_uncertainty = infer.MODEL, infer.MODEL_VERSION, True
+    else:
+        # without trained weights the head is noise: embed with the untrained
+        # backbone and select by diversity only
+        print(f"⚠️ No trained model ({infer.LOAD_ERR}); selecting by diversity only.")
+        torch.manual_seed(args.seed)
+        model, version, use_uncertainty = infer.MoistureVSRegressor(), "untrained", False
+    model = model.to(device).eval()
+    tf = infer.TF if args.img_size == 320 else infer.T.Compose(
+        [infer.T.Resize((args.img_size, args.img_size))] + list(infer.TF.transforms[1:]))
+
+    paths = list_images(ALL_DIR)
+    store = EmbeddingStore(version)
+    todo = store.stale(paths)
+    failed = set()
+    if todo:
+        print(f"Embedding {len(todo)} new/changed images ({len(paths) - len(todo)} cached)")
+        good, feats, bad = embed(model, todo, tf, args.img_size, args.embed_batch, args.num_workers, device)
+        store.add(good, feats)
+        store.save()
+        failed = set(bad)
+        if bad:
+            print(f"Skipped {len(bad)} unreadable images")
+    paths = [p for p in paths if p in store.rows and p not in failed]
+
+    done = labeled_names()
+    cand_paths = [p for p in paths if Path(p).name not in done]
+    center_paths = [p for p in paths if Path(p).name in done]
+    if not cand_paths:
+        print("No unlabeled candidates left.")
+        return
+    print(f"{len(cand_paths)} candidates, {len(center_paths)} labeled/seeded images as existing centers")
+
+    cand_emb = store.get(cand_paths)
+    unc = np.zeros(len(cand_paths), dtype=np.float32)
+    pool = np.arange(len(cand_paths))
+    if use_uncertainty:
+        unc = mc_dropout_uncertainty(model.head, cand_emb, passes=args.mc_passes, device=device)
+        if args.pool_factor > 0:
+            m = min(len(pool), int(args.batch * args.pool_factor))
+            pool = np.argpartition(-unc, m - 1)[:m] if m < len(pool) else pool
+
+    cand_p = random_projection(cand_emb[pool], args.proj_dim, args.seed)
+    cent_p = random_projection(store.get(center_paths), args.proj_dim, args.seed) if center_paths \
+        else np.zeros((0, cand_p.shape[1]), np.float32)
+    picks = pool[k_center_greedy(cand_p, cent_p, args.batch)]
+
+    sel = pd.DataFrame({"image_path": [cand_paths[i] for i in picks],
+                        "uncertainty": np.round(unc[picks], 5),
+                        "rank": np.arange(1, len(picks) + 1)})
+    print(sel.head(10).to_string(index=False))
+    if args.out:
+        sel.to_csv(args.out, index=False)
+        print("Wrote", args.out)
+
+    if args.dry_run:
+        print(f"Dry run: {len(sel)} images selected, nothing copied.")
+        return
+    SEED_DIR.mkdir(parents=True, exist_ok=True)
+    copied = 0
+    for p in sel["image_path"]:
+        try:
+            shutil.copy2(p, SEED_DIR / Path(p).name)
+            copied += 1
+        except Exception as e:
+            print("Failed to copy", p, ":", e)
+    print(f"Copied {copied} images to {SEED_DIR}.")
+    print("Restart the Streamlit seed labeler and label the new images.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+# backend/allocation.py
+"""
+Fill bulk buyer demand ("500 kg of residue with VS >= 0.7 in my district")
+from open records in one call.
+
+  1. Candidates: one query over the indexed filters (location, geohash cells
+     around the buyer, crop, price ceiling), reading only the columns ranking
+     needs, at most CANDIDATE_LIMIT lots per page. Pages are fetched until the demand
+     is covered:
+       - "cheapest": pages come cheapest first (ORDER BY unit price). Paging
+         stops once the next unseen lot's unit price is no lower than the
+         landed price of the last lot the fill needs; freight only adds to
+         a price, so no unseen lot could displace it.
+       - "score": pages come newest first until the lots seen can cover the
+         demand.
+  2. Ranking (NumPy, all candidates fetched):
+       - "cheapest": by unit price, plus freight when the buyer gave
+         coordinates. Lots are divisible, so taking the cheapest first is the
+         minimum-cost fill (fractional knapsack); no solver needed.
+       - "score": weighted blend of price, VS and freshness, each scaled to
+         [0, 1] over the candidates (lower is better).
+  3. Fill: walk the ranking taking min(still needed, lot's stock). Lots are
+     reserved with ordering.reserve(partial=True) inside the caller's
+     transaction. A lot another buyer drained since step 1 yields what it has
+     and the walk moves on to the next lot. The order is recorded through
+     ordering.record_order, exactly like POST /api/v1/orders.
+
+    result, order, recs = allocation.allocate(db, 500, min_vs=0.7, location="Rampur", buyer_name="Plant A")
+    db.commit()
+"""
+import os
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import case, or_, select
+from sqlalchemy.orm import Session
+
+from database import Order, Record
+import geo
+import ordering
+import yield_engine
+
+CANDIDATE_LIMIT = int(os.getenv("ALLOCATE_CANDIDATE_LIMIT", "5000"))
+STRATEGIES = ("score", "cheapest")
+DEFAULT_WEIGHTS = {"price": 0.6, "vs": 0.25, "freshness": 0.15}
+EPS_KG = 1e-6
+_LOAD_BATCH = 50            # records loaded per query while filling
+_FIRST_PRICE_PAGE = 250
+
+# same as ordering.unit_price: revenue spread over mass, 0 when unknown
+UNIT_PRICE = case(((Record.mass_kg > 0) & Record.revenue_estimate.isnot(None),
+                   Record.revenue_estimate / Record.mass_kg), else_=0.0)
+_COLUMNS = (Record.id, ordering.AVAILABLE, UNIT_PRICE, Record.vs_fraction,
+            Record.timestamp, Record.latitude, Record.longitude)
+
+
+class Unfillable(ValueError):
+    def __init__(self, requested: float, available: float):
+        super().__init__(f"Only {round(available, 3)} kg match this demand (requested {requested} kg)")
+        self.requested = requested
+        self.available = available
+
+
+# --------------------------
+# Candidates
+# --------------------------
+def candidates(db: Session, min_vs: float = 0.0, crop: Optional[str] = None, location: Optional[str] = None,
+               lat: Optional[float] = None, lon: Optional[float] = None, max_km: Optional[float] = None,
+               min_lot_kg: float = 0.0, max_unit_price: Optional[float] = None, by_price: bool = False,
+               after: Optional[Tuple[float, int]] = None,
+               limit: int = CANDIDATE_LIMIT) -> Tuple[Dict[str, np.ndarray], Optional[Tuple[float, int]]]:
+    """
+    One page of matching open lots as column arrays: cheapest first with
+    by_price, else newest first. Returns (columns, key to pass as `after` for
+    the next page, or None when this was the last page).
+    """
+    q = select(*_COLUMNS).where(ordering.AVAILABLE > max(min_lot_kg, EPS_KG))
+    if min_vs > 0:
+        q = q.where(Record.vs_fraction >= min_vs)
+    if max_unit_price is not None:
+        q = q.where(UNIT_PRICE <= max_unit_price)
+    if crop:
+        key = yield_engine.normalize_crop(crop)
+        tbl = yield_engine.table()
+        if key not in tbl.crop_index:
+            raise ValueError(f"Unknown crop '{crop}'. Use one of: {', '.join(tbl.crops)}")
+        # NULL crop = saved before crops existed = the default crop
+        q = q.where(or_(Record.crop == key, Record.crop.is_(None)) if key == tbl.default_crop else Record.crop == key)
+    newest = Record.id
+    if location:
+        q = q.where(Record.location == location.strip())
+    cells = geo.within(lat, lon, max_km) if lat is not None and max_km is not None else None
+    if cells is not None:
+        q = q.where(cells)
+    if location or cells is not None:
+        # id + 0: use the location / geohash index and sort the few matches, rather
+        # than let SQLite walk the primary key past every non-matching lot
+        newest = Record.id + 0
+    if by_price:
+        if after is not None:
+            q = q.where((UNIT_PRICE > after[0]) | ((UNIT_PRICE == after[0]) & (Record.id > after[1])))
+        q = q.order_by(UNIT_PRICE, Record.id)
+    else:
+        if after is not None:
+            q = q.where(Record.id < after[1])
+        q = q.order_by(newest.desc())
+    rows = db.execute(q.limit(limit)).all()
+    next_key = (rows[-1][2], rows[-1][0]) if len(rows) == limit else None
+
+    cols = list(zip(*rows)) or [()] * len(_COLUMNS)
+    c = {name: np.array(cols[i], dtype=np.float64) for name, i in
+         (("available", 1), ("unit_price", 2), ("vs", 3), ("lat", 5), ("lon", 6))}     # None -> NaN
+    c["id"] = np.array(cols[0], dtype=np.int64)
+    c["timestamp"] = np.array(cols[4], dtype="datetime64[s]")
+    if lat is not None:
+        c["distance_km"] = geo.distances_km(lat, lon, c["lat"], c["lon"])
+        if max_km is not None:
+            keep = c["distance_km"] <= max_km         # NaN (no coordinates) drops out too
+            c = {k: v[keep] for k, v in c.items()}
+    return c, next_key
+
+
+def _concat(a: Optional[Dict[str, np.ndarray]], b: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    return b if a is None else {k: np.concatenate([a[k], b[k]]) for k in b}
+
+
+# --------------------------
+# Ranking
+# --------------------------
+def _scaled(x: np.ndarray) -> np.ndarray:
+    """Min-max to [0, 1]; unknown values count as the worst (1)."""
+    finite = np.isfinite(x)
+    if not finite.any():
+        return np.ones_like(x)
+    lo, hi = x[finite].min(), x[finite].max()
+    out = (x - lo) / (hi - lo) if hi > lo else np.zeros_like(x)
+    return np.where(finite, out, 1.0)
+
+
+def rank(c: Dict[str, np.ndarray], strategy: str = "score", weights: Optional[Dict[str, float]] = None,
+         freight: float = geo.FREIGHT_PER_KG_KM, now: Optional[datetime] = None) -> np.ndarray:
+    """Candidate indices, best first; also stores landed_price / age_days / score in c."""
+    now = np.datetime64(now or datetime.utcnow(), "s")
+    landed = c["unit_price"].copy()
+    if "distance_km" in c:
+        dist = c["distance_km"]
+        # lots without coordinates are charged the farthest known haul
+        worst = np.nanmax(dist) if np.isfinite(dist).any() else 0.0
+        landed += freight * np.where(np.isfinite(dist), dist, worst)
+    age = (now - c["timestamp"]).astype("timedelta64[s]").astype(np.float64) / 86400.0
+    age = np.where(np.isnat(c["timestamp"]), np.nan, age)
+    c["landed_price"], c["age_days"] = landed, age
+
+    if strategy == "cheapest":
+        c["score"] = landed
+        # ties: higher VS, then fresher
+        return np.lexsort((np.nan_to_num(age, nan=np.inf), -np.nan_to_num(c["vs"], nan=-1.0), landed))
+    w = dict(DEFAULT_WEIGHTS, **(weights or {}))
+    score = (w["price"] * _scaled(landed) + w["vs"] * _scaled(-c["vs"]) + w["freshness"] * _scaled(age))
+    c["score"] = score
+    return np.lexsort((c["id"], score))
+
+
+# --------------------------
+# Fill
+# --------------------------
+def _lot(c: Dict[str, np.ndarray], i: int, qty: float, rec: Optional[Record] = None) -> Dict:
+    price = float(c["unit_price"][i])
+    out = {
+        "record_id": int(c["id"][i]),
+        "qty_kg": round(qty, 3),
+        "unit_price": round(price, 4),
+        "line_total": round(price * qty, 2),
+        "vs_fraction": None if np.isnan(c["vs"][i]) else float(c["vs"][i]),
+        "age_days": None if np.isnan(c["age_days"][i]) else round(float(c["age_days"][i]), 1),
+        "score": round(float(c["score"][i]), 4),
+    }
+    if "distance_km" in c:
+        d = c["distance_km"][i]
+        out["distance_km"] = None if np.isnan(d) else round(float(d), 3)
+        out["landed_price"] = round(float(c["landed_price"][i]), 4)
+    if rec is not None:
+        out.update(farmer_name=rec.farmer_name, location=rec.location, phone=rec.phone, crop=rec.crop)
+    return out
+
+
+def _plan(c: Dict[str, np.ndarray], order_idx: np.ndarray, qty_kg: float,
+          max_lots: Optional[int]) -> Tuple[List[Tuple[int, float]], float]:
+    """Greedy fill over current stock levels: ([(candidate index, kg)], kg still missing)."""
+    plan, left = [], float(qty_kg)
+    for i in order_idx:
+        if left <= EPS_KG or (max_lots is not None and len(plan) >= max_lots):
+            break
+        want = min(left, float(c["available"][i]))
+        plan.append((i, want))
+        left -= want
+    return plan, left
+
+
+def allocate(db: Session, qty_kg: float, min_vs: float = 0.0, crop: Optional[str] = None,
+             location: Optional[str] = None, lat: Optional[float] = None, lon: Optional[float] = None,
+             max_km: Optional[float] = None, min_lot_kg: float = 0.0, max_unit_price: Optional[float] = None,
+             max_lots: Optional[int] = None, strategy: str = "score", weights: Optional[Dict[str, float]] = None,
+             freight: float = geo.FREIGHT_PER_KG_KM, allow_partial: bool = False, dry_run: bool = False,
+             buyer_name: str = "", buyer_phone: Optional[str] = None,
+             buyer_location: Optional[str] = None) -> Tuple[Dict, Optional[Order], List[Record]]:
+    """
+    Rank matching lots and fill qty_kg from the best down. Unless dry_run, the
+    lots are reserved and an order recorded in the caller's transaction (the
+    caller commits). Raises Unfillable when less than qty_kg can be had and
+    allow_partial is off; the caller rolls back.
+    """
+    t0 = time.perf_counter()
+    by_price = strategy == "cheapest"
+    c, after, pages = None, None, 0
+    # cheapest-first pages usually cover the demand early: start small, then double
+    size = min(_FIRST_PRICE_PAGE, CANDIDATE_LIMIT) if by_price else CANDIDATE_LIMIT
+    while True:
+        page, after = candidates(db, min_vs, crop, location, lat, lon, max_km, min_lot_kg, max_unit_price,
+                                 by_price=by_price, after=after, limit=size)
+        c, pages, size = _concat(c, page), pages + 1, min(size * 2, CANDIDATE_LIMIT)
+        order_idx = rank(c, strategy, weights, freight)
+        if after is None:
+            break               # every matching lot seen
+        plan, left = _plan(c, order_idx, qty_kg, max_lots)
+        if left <= EPS_KG and (not by_price or after[0] >= c["landed_price"][plan[-1][0]]):
+            break
+    t_rank = time.perf_counter()
+
+    lots: List[Tuple[int, float, Optional[Record]]] = []
+    taken: List[Tuple[Record, float]] = []
+    loaded: Dict[int, Record] = {}
+    left = float(qty_kg)
+    for pos, i in enumerate(order_idx):
+        if left <= EPS_KG or (max_lots is not None and len(lots) >= max_lots):
+            break
+        want = min(left, float(c["available"][i]))
+        if dry_run:
+            lots.append((i, want, None))
+            left -= want
+            continue
+        rid = int(c["id"][i])
+        if rid not in loaded:
+            batch = [int(x) for x in c["id"][order_idx[pos:pos + _LOAD_BATCH]]]
+            loaded.update((r.id, r) for r in db.query(Record).filter(Record.id.in_(batch)))
+        rec = loaded.get(rid)
+        if rec is None:
+            continue            # deleted since the candidate query
+        got = ordering.reserve(db, rec, want, partial=True)
+        if got > EPS_KG:
+            lots.append((i, got, rec))
+            taken.append((rec, got))
+            left -= got
+
+    if dry_run and lots:
+        # names / places for the preview: one query for the chosen lots only
+        loaded = {r.id: r for r in db.query(Record).filter(Record.id.in_([int(c["id"][i]) for i, _, _ in lots]))}
+        lots = [(i, q, loaded.get(int(c["id"][i]))) for i, q, _ in lots]
+
+    filled = float(qty_kg) - max(left, 0.0)
+    if left > EPS_KG and not allow_partial:
+        raise Unfillable(qty_kg, filled)
+
+    order = None
+    if taken:
+        order = ordering.record_order(db, buyer_name, buyer_phone, buyer_location, taken)
+    result = {
+        "order_id": order.id if order is not None else None,
+        "dry_run": dry_run,
+        "strategy": strategy,
+        "requested_kg": qty_kg,
+        "filled_kg": round(filled, 3),
+        "fully_filled": left <= EPS_KG,
+        "total_price": round(sum(ordering.unit_price(r) * q for r, q in taken), 2) if taken
+        else round(sum(float(c["unit_price"][i]) * q for i, q, _ in lots), 2),
+        "lots": [_lot(c, i, q, rec) for i, q, rec in lots],
+        "candidates": int(len(c["id"])),
+        "candidate_pages": pages,
+        "timing_ms": {"select_and_rank": round((t_rank - t0) * 1000, 2), "total": round((time.perf_counter() - t0) * 1000, 2)},
+    }
+    return result, order, [rec for rec, _ in taken]
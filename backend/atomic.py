@@ -0,0 +1,57 @@
+# backend/atomic.py
+"""
+Atomic file replacement shared by the API and the offline scripts.
+
+    with atomic_write(path, "w", encoding="utf-8") as f:
+        json.dump(cfg, f)
+
+writes to a temp file in the same directory and os.replace()s it over `path`
+only if the block finishes, so readers see the old file or the new one, never
+a partial one; on error the temp file is removed. mkstemp creates files 0600,
+so before the rename the file gets the mode a plain open() would have given it
+(0o666 & ~umask): a checkpoint or config written by one user stays readable
+by the API running as another, and a restrictive umask is still honoured.
+"""
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Union
+
+_UMASK_LOCK = threading.Lock()
+
+
+def current_umask() -> int:
+    """The process umask, read without a window where it is changed (Linux), else via a locked swap."""
+    try:
+        with open("/proc/self/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("Umask:"):
+                    return int(line.split()[1], 8)
+    except (OSError, ValueError):
+        pass
+    with _UMASK_LOCK:
+        mask = os.umask(0o022)
+        os.umask(mask)
+    return mask
+
+
+@contextmanager
+def atomic_write(path: Union[str, Path], mode: str = "wb", fsync: bool = False, **open_kwargs):
+    """Yield a file object for a temp file next to `path`; replace `path` with it on success."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=path.name + ".", suffix=".tmp", dir=str(path.parent))
+    try:
+        with os.fdopen(fd, mode, **open_kwargs) as f:
+            yield f
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.chmod(tmp, 0o666 & ~current_umask())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
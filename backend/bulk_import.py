@@ -0,0 +1,277 @@
+# backend/bulk_import.py
+"""
+Bulk loading of weighed residue lots (cooperative spreadsheets) into records.
+
+Rows are read one at a time from a CSV or NDJSON stream and validated with
+the same rules as POST /api/v1/records. Valid rows are buffered up to CHUNK,
+priced together with the vectorized yield_engine.compute, and written with one
+executemany INSERT. The chunk's market_stats deltas and the rows commit in the
+same transaction, so memory stays at one chunk whatever the file size. A bad
+row is reported with its line number and skipped; it never aborts the file.
+Full-text search needs nothing extra: the FTS5 triggers / FULLTEXT index
+follow the base table.
+
+    with open("lots.csv", "rb") as f:
+        summary = bulk_import.import_stream(db, f, "csv")
+
+CSV columns (header row, case-insensitive; a few spreadsheet aliases are
+accepted, see ALIASES): farmer_name, location, phone, mass_kg, and optionally
+crop, vs_fraction, moisture_percent, latitude, longitude, image_id, timestamp
+(ISO 8601). NDJSON: one object per line with the same keys.
+"""
+import csv
+import io
+import json
+import os
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import IO, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+from database import Record
+import events
+import geo
+import image_store
+import search
+import stats
+import yield_engine
+
+CHUNK = int(os.getenv("IMPORT_CHUNK", "1000"))
+MAX_ERRORS = int(os.getenv("IMPORT_MAX_ERRORS", "1000"))    # errors listed in the summary (all are counted)
+FORMATS = ("csv", "ndjson")
+
+REQUIRED = ("farmer_name", "location", "phone", "mass_kg")
+ALIASES = {
+    "name": "farmer_name", "farmer": "farmer_name",
+    "village": "location", "district": "location",
+    "mobile": "phone", "phone_number": "phone",
+    "mass": "mass_kg", "weight_kg": "mass_kg", "weight": "mass_kg",
+    "moisture": "moisture_percent", "vs": "vs_fraction",
+    "lat": "latitude", "lon": "longitude", "lng": "longitude",
+    "date": "timestamp",
+}
+_R = Record.__table__
+
+
+def detect_format(filename: Optional[str], content_type: Optional[str] = None) -> str:
+    name = (filename or "").lower()
+    if name.endswith((".ndjson", ".jsonl", ".json")) or "ndjson" in (content_type or "") or "jsonl" in (content_type or ""):
+        return "ndjson"
+    return "csv"
+
+
+# --------------------------
+# Parsing
+# --------------------------
+def _column(name: str) -> str:
+    key = "_".join((name or "").strip().lower().split())
+    return ALIASES.get(key, key)
+
+
+def iter_rows(stream: IO[bytes], fmt: str) -> Iterator[Tuple[int, object]]:
+    """(line number, dict) per row, or (line number, ValueError) for a line that does not parse."""
+    if fmt not in FORMATS:
+        raise ValueError(f"format must be one of {', '.join(FORMATS)}")
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", newline="", errors="replace")
+    try:
+        yield from (_csv_rows(text) if fmt == "csv" else _ndjson_rows(text))
+    finally:
+        text.detach()           # leave the caller's stream open
+
+
+def _csv_rows(text: IO[str]) -> Iterator[Tuple[int, object]]:
+    reader = csv.reader(text)
+    header = next(reader, None)
+    if header is None:
+        return
+    cols = [_column(h) for h in header]
+    for values in reader:
+        if not any(v.strip() for v in values):
+            continue
+        if len(values) > len(cols):
+            yield reader.line_num, ValueError(f"{len(values)} fields, header has {len(cols)}")
+            continue
+        yield reader.line_num, dict(zip(cols, values))
+
+
+def _ndjson_rows(text: IO[str]) -> Iterator[Tuple[int, object]]:
+    for n, line in enumerate(text, 1):
+        if not line.strip():
+            continue
+        try:
+            obj = json.loads(line)
+        except ValueError as e:
+            yield n, ValueError(f"invalid JSON: {e}")
+            continue
+        if not isinstance(obj, dict):
+            yield n, ValueError("each line must be a JSON object")
+            continue
+        yield n, {_column(k): v for k, v in obj.items()}
+
+
+# --------------------------
+# Validation
+# --------------------------
+def _text(row: Dict, field: str, max_len: int) -> Optional[str]:
+    v = row.get(field)
+    v = "" if v is None else str(v).strip()
+    if len(v) > max_len:
+        raise ValueError(f"{field} is longer than {max_len} characters")
+    return v or None
+
+
+def _number(row: Dict, field: str) -> Optional[float]:
+    v = row.get(field)
+    if v is None or (isinstance(v, str) and not v.strip()):
+        return None
+    try:
+        f = float(v)
+    except (TypeError, ValueError):
+        raise ValueError(f"{field} must be a number (got {v!r})")
+    if not np.isfinite(f):
+        raise ValueError(f"{field} must be finite")
+    return f
+
+
+def validate(row: Dict, tbl: yield_engine.YieldTable, now: datetime) -> Dict:
+    """Column values for one row (derived fields excluded); ValueError says what is wrong."""
+    for field in REQUIRED:
+        if row.get(field) in (None, ""):
+            raise ValueError(f"Missing: {field}")
+    mass_kg = _number(row, "mass_kg")
+    vs = _number(row, "vs_fraction")
+    moisture = _number(row, "moisture_percent")
+    if not mass_kg > 0:
+        raise ValueError("mass_kg must be greater than 0")
+    if vs is not None and not 0.0 <= vs <= 1.0:
+        raise ValueError("vs_fraction must be between 0 and 1")
+    if moisture is not None and not 0.0 <= moisture <= 100.0:
+        raise ValueError("moisture_percent must be between 0 and 100")
+    crop = yield_engine.normalize_crop(_text(row, "crop", 40)) or tbl.default_crop
+    if crop not in tbl.crop_index:
+        raise ValueError(f"Unknown crop '{row.get('crop')}'. Use one of: {', '.join(tbl.crops)}")
+    coords = geo.parse_coords(_number(row, "latitude"), _number(row, "longitude"))
+    ts_text, ts = _text(row, "timestamp", 40), now
+    if ts_text:
+        try:
+            ts = datetime.fromisoformat(ts_text.replace("Z", "+00:00"))
+        except ValueError:
+            raise ValueError(f"timestamp must be ISO 8601 (got {ts_text!r})")
+        if ts.tzinfo is not None:
+            ts = ts.astimezone(timezone.utc).replace(tzinfo=None)      # stored as naive UTC
+    image_id = _text(row, "image_id", 64)
+    return {
+        "farmer_name": _text(row, "farmer_name", 100),
+        "location": _text(row, "location", 100),
+        "phone": _text(row, "phone", 20),
+        "mass_kg": mass_kg,
+        "available_kg": mass_kg,
+        "mass_source": "measured",
+        "crop": crop,
+        "moisture_percent": moisture,
+        "vs_fraction": vs,
+        "image_id": image_id if image_store.is_valid_id(image_id) else None,
+        "latitude": coords[0] if coords else None,
+        "longitude": coords[1] if coords else None,
+        "geohash": geo.encode(*coords) if coords else None,
+        "timestamp": ts,
+    }
+
+
+# --------------------------
+# Import
+# --------------------------
+def _price(rows: List[Dict], tbl: yield_engine.YieldTable, cfg: Dict[str, float]):
+    est = yield_engine.compute(
+        np.array([r["mass_kg"] for r in rows], dtype=np.float64),
+        np.array([np.nan if r["vs_fraction"] is None else r["vs_fraction"] for r in rows], dtype=np.float64),
+        np.array([np.nan if r["moisture_percent"] is None else r["moisture_percent"] for r in rows], dtype=np.float64),
+        [r["crop"] for r in rows], cfg=cfg, tbl=tbl)
+    for r, biogas, revenue in zip(rows, est["biogas_m3"].tolist(), est["revenue"].tolist()):
+        r["predicted_m3_biogas"] = biogas
+        r["revenue_estimate"] = revenue
+        r["yield_version"] = tbl.version
+
+
+def _flush(db: Session, rows: List[Dict], dry_run: bool):
+    """Insert one priced chunk with its stats in one transaction."""
+    if dry_run:
+        return
+    try:
+        db.execute(insert(_R), rows)
+        stats.records_added_many(db, [SimpleNamespace(**r) for r in rows])
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    for r in rows:
+        search.note(r["phone"], r["location"])
+
+
+def import_stream(db: Session, stream: IO[bytes], fmt: str = "csv", dry_run: bool = False,
+                  chunk: int = CHUNK) -> Dict:
+    """Validate and insert every row of `stream`; returns counts and the first MAX_ERRORS row errors."""
+    t0 = time.perf_counter()
+    tbl, cfg = yield_engine.table(), yield_engine.load_config()
+    now = datetime.utcnow()
+    rows: List[Dict] = []
+    lines: List[int] = []
+    errors: List[Dict] = []
+    seen = ok = failed = 0
+
+    def fail(line: int, msg: str):
+        nonlocal failed
+        failed += 1
+        if len(errors) < MAX_ERRORS:
+            errors.append({"line": line, "error": msg})
+
+    def flush():
+        nonlocal ok
+        if not rows:
+            return
+        _price(rows, tbl, cfg)
+        try:
+            _flush(db, rows, dry_run)
+            ok += len(rows)
+        except Exception as e:
+            # the chunk is rolled back as a whole; say which lines it held and keep going
+            for line in lines:
+                fail(line, f"database error: {e}"[:300])
+        rows.clear()
+        lines.clear()
+
+    for line, row in iter_rows(stream, fmt):
+        seen += 1
+        if isinstance(row, Exception):
+            fail(line, str(row))
+            continue
+        try:
+            rows.append(validate(row, tbl, now))
+            lines.append(line)
+        except (TypeError, ValueError) as e:
+            fail(line, str(e))
+            continue
+        if len(rows) >= chunk:
+            flush()
+    flush()
+
+    if ok and not dry_run:
+        events.publish("resync", {"reason": "import"})      # one refetch instead of thousands of "record" events
+    elapsed = time.perf_counter() - t0
+    return {
+        "format": fmt,
+        "dry_run": dry_run,
+        "rows": seen,
+        "valid": ok,
+        "inserted": 0 if dry_run else ok,
+        "failed": failed,
+        "errors": errors,
+        "errors_truncated": failed > len(errors),
+        "seconds": round(elapsed, 3),
+        "rows_per_s": round(seen / elapsed, 1) if elapsed > 0 else None,
+        "yield_params_version": tbl.version,
+    }
@@ -6,13 +6,17 @@ from sqlalchemy import (
     Column,
     Integer,
     String,
+    Text,
     Float,
     DateTime,
     ForeignKey,
     func,
+    inspect,
+    text,
 )
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session, relationship
+from sqlalchemy.pool import StaticPool
 from datetime import datetime
 
 # -------------------------------
@@ -24,10 +28,20 @@ DB_HOST = os.getenv("DB_HOST", "localhost")
 DB_PORT = os.getenv("DB_PORT", "3306")
 DB_NAME = os.getenv("DB_NAME", "agrogas_db")
 
-DATABASE_URL = f"mysql+mysqlconnector://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+# DATABASE_URL overrides the MySQL settings above, e.g. "sqlite:///agrogas.db"
+# for local benchmarks and load tests without a MySQL server.
+DATABASE_URL = os.getenv("DATABASE_URL") or f"mysql+mysqlconnector://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+_engine_kwargs = {}
+if DATABASE_URL.startswith("sqlite"):
+    # SQLite connections are shared with FastAPI's threadpool
+    _engine_kwargs["connect_args"] = {"check_same_thread": False}
+    if DATABASE_URL in ("sqlite://", "sqlite:///:memory:"):
+        # one in-memory database only exists per connection; share a single one
+        _engine_kwargs["poolclass"] = StaticPool
 
 # Create engine; pool_pre_ping helps avoid stale connections
-engine = create_engine(DATABASE_URL, echo=False, pool_pre_ping=True)
+engine = create_engine(DATABASE_URL, echo=False, pool_pre_ping=True, **_engine_kwargs)
 
 # Session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
@@ -49,6 +63,8 @@ class User(Base):
     password_hash = Column(String(255))
     reset_code = Column(String(6), nullable=True)
     reset_expiry = Column(DateTime, nullable=True)
+    latitude = Column(Float, nullable=True)
+    longitude = Column(Float, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
 
 
@@ -61,20 +77,29 @@ class Record(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     farmer_name = Column(String(100), nullable=True)
-    location = Column(String(100), nullable=True)
+    location = Column(String(100), nullable=True, index=True)
     phone = Column(String(20), nullable=True)
 
     mass_kg = Column(Float, nullable=True)
     available_kg = Column(Float, nullable=True)        # available stock for orders
     mass_source = Column(String(20), nullable=True)    # "measured" or "predicted"
 
+    crop = Column(String(40), nullable=True)           # yield_params.json key; NULL = default crop
     moisture_percent = Column(Float, nullable=True)
     vs_fraction = Column(Float, nullable=True)
 
+    # derived server-side by yield_engine (never taken from the client)
     predicted_m3_biogas = Column(Float, nullable=True)
     revenue_estimate = Column(Float, nullable=True)
+    yield_version = Column(String(40), nullable=True)  # yield params version that priced this record
+
+    image_id = Column(String(64), nullable=True, index=True)   # sha256 in image_store (uploaded photo)
 
-    timestamp = Column(DateTime, server_default=func.now())
+    latitude = Column(Float, nullable=True)
+    longitude = Column(Float, nullable=True)
+    geohash = Column(String(12), nullable=True, index=True)   # geo.encode(lat, lon); prefix = cell
+
+    timestamp = Column(DateTime, server_default=func.now(), index=True)
 
     # relationship to OrderItem (optional convenience)
     order_items = relationship("OrderItem", back_populates="record", cascade="none")
@@ -89,6 +114,72 @@ class Config(Base):
     default_methane_fraction = Column(Float, default=0.55)
 
 
+class MarketStat(Base):
+    """
+    Running marketplace totals, updated in the same transaction as the record /
+    order that changes them (see stats.py). scope is "all", "location", "day"
+    or "farmer"; bucket is the normalized location, ISO date or farmer phone.
+    """
+    __tablename__ = "market_stats"
+
+    scope = Column(String(10), primary_key=True)
+    bucket = Column(String(120), primary_key=True)
+
+    records = Column(Integer, nullable=False, default=0)
+    farmers = Column(Integer, nullable=False, default=0)      # distinct farmers, "all" row only
+    orders = Column(Integer, nullable=False, default=0)       # "all" row only
+
+    mass_kg = Column(Float, nullable=False, default=0.0)
+    available_kg = Column(Float, nullable=False, default=0.0)
+    biogas_m3 = Column(Float, nullable=False, default=0.0)
+    revenue = Column(Float, nullable=False, default=0.0)
+    sold_kg = Column(Float, nullable=False, default=0.0)
+    sales_value = Column(Float, nullable=False, default=0.0)
+
+    last_record_at = Column(DateTime, nullable=True)
+
+
+class RepriceJob(Base):
+    """
+    Background recomputation of records' biogas / revenue after a config change
+    (see repricing.py). last_record_id is the resume cursor: every chunk commits
+    its record updates together with the cursor, so a restarted job continues
+    where it stopped and never applies a chunk twice.
+    """
+    __tablename__ = "reprice_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    status = Column(String(20), nullable=False, default="queued")   # queued/running/done/failed/cancelled/superseded
+    price_per_m3 = Column(Float, nullable=False)
+    yield_per_kgvs = Column(Float, nullable=False)
+
+    total = Column(Integer, nullable=False, default=0)       # open records when the job started
+    processed = Column(Integer, nullable=False, default=0)
+    changed = Column(Integer, nullable=False, default=0)
+    last_record_id = Column(Integer, nullable=False, default=0)
+
+    error = Column(String(500), nullable=True)
+    created_at = Column(DateTime, server_default=func.now())
+    started_at = Column(DateTime, nullable=True)
+    heartbeat_at = Column(DateTime, nullable=True)          # stale heartbeat = runner died; safe to resume
+    finished_at = Column(DateTime, nullable=True)
+
+
+class IdempotencyKey(Base):
+    """
+    Stored response for a POST sent with an Idempotency-Key header (see
+    idempotency.py). Inserted in the same transaction as the record / order it
+    describes, so a key exists exactly when its write committed.
+    """
+    __tablename__ = "idempotency_keys"
+
+    scope = Column(String(20), primary_key=True)            # "records" | "orders"
+    key = Column(String(64), primary_key=True)
+    request_hash = Column(String(64), nullable=False)       # sha256 of the canonical JSON body
+    response = Column(Text, nullable=False)                 # compact JSON
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
 class Order(Base):
     """
     Orders placed by buyers. Orders have items in OrderItem.
@@ -102,7 +193,7 @@ class Order(Base):
 
     total_price = Column(Float, nullable=False, default=0.0)
     status = Column(String(30), nullable=False, default="placed")
-    created_at = Column(DateTime, server_default=func.now())
+    created_at = Column(DateTime, server_default=func.now(), index=True)
 
     items = relationship("OrderItem", back_populates="order", cascade="all, delete-orphan")
 
@@ -143,6 +234,32 @@ def get_db() -> Generator[Session, None, None]:
         db.close()
 
 
+def _add_missing_columns():
+    """
+    create_all() never alters existing tables; add nullable columns (and their
+    indexes) that were introduced after a table was created so older databases
+    keep working.
+    """
+    insp = inspect(engine)
+    existing_tables = set(insp.get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in existing_tables:
+            continue
+        have = {c["name"] for c in insp.get_columns(table.name)}
+        for col in table.columns:
+            if col.name in have or not col.nullable:
+                continue
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {col.name} {col.type.compile(dialect=engine.dialect)}"
+            with engine.begin() as conn:
+                conn.execute(text(ddl))
+            print(f"✅ Added column {table.name}.{col.name}")
+        have_idx = {i["name"] for i in insp.get_indexes(table.name)}
+        for idx in table.indexes:
+            if idx.name not in have_idx:
+                idx.create(bind=engine)
+                print(f"✅ Added index {idx.name}")
+
+
 def init_db():
     """
     Create tables (if not exist) and ensure a default config row exists.
@@ -154,6 +271,7 @@ def init_db():
     """
     # Create tables
     Base.metadata.create_all(bind=engine)
+    _add_missing_columns()
     print("✅ Database tables created (if they did not exist).")
 
     # Ensure default config row exists
@@ -0,0 +1,276 @@
+# backend/dedup.py
+"""
+Perceptual hashes and a Hamming-distance index for near-duplicate images.
+
+  - dhash / phash: 64-bit ints from a tiny grayscale version of the image.
+    JPEGs are decoded in draft mode, so hashing a phone photo costs a few ms.
+  - HammingIndex: multi-index hashing. The 64 bits are cut into radius+1
+    blocks; by pigeonhole any hash within `radius` bits of the query matches
+    at least one block exactly, so a lookup only verifies the few entries
+    sharing a block instead of scanning everything.
+  - UploadIndex: the index used by /api/v1/predict. Seeded from the dataset
+    hash file written by dedupe_dataset.py and extended with each new upload
+    (persisted to outputs/upload_hashes.jsonl). Exact repeats are not added
+    again, and uploads are kept in two generations of at most
+    MAX_UPLOADS / 2 entries each: when the current one fills up or gets older
+    than UPLOAD_TTL_DAYS / 2, it becomes the previous one (its log renamed to
+    upload_hashes.1.jsonl) and the old previous one is dropped. Memory and
+    disk stay bounded; uploads older than UPLOAD_TTL_DAYS are never reported.
+"""
+import io
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image
+
+ROOT = Path(__file__).resolve().parent
+DATASET_HASHES = ROOT.parent / "dataset" / "image_hashes.csv"
+UPLOAD_HASHES = ROOT / "outputs" / "upload_hashes.jsonl"
+
+HASH_BITS = 64
+DEFAULT_RADIUS = int(os.getenv("DEDUP_RADIUS", "6"))
+MAX_UPLOADS = int(os.getenv("DEDUP_MAX_UPLOADS", "200000"))
+UPLOAD_TTL_DAYS = float(os.getenv("DEDUP_UPLOAD_TTL_DAYS", "180"))
+
+
+# --------------------------
+# Hashes
+# --------------------------
+def _gray(img: Image.Image, size: Tuple[int, int]) -> np.ndarray:
+    return np.asarray(img.convert("L").resize(size, Image.LANCZOS), dtype=np.float32)
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    return int("".join("1" if b else "0" for b in bits.ravel()), 2)
+
+
+def dhash(img: Image.Image) -> int:
+    """Difference hash: sign of horizontal gradients on a 9x8 thumbnail."""
+    g = _gray(img, (9, 8))
+    return _bits_to_int(g[:, 1:] > g[:, :-1])
+
+
+def _dct_matrix(n: int) -> np.ndarray:
+    k = np.arange(n)[:, None]
+    m = np.cos(np.pi * (2 * np.arange(n)[None, :] + 1) * k / (2 * n)) * np.sqrt(2.0 / n)
+    m[0] /= np.sqrt(2.0)
+    return m.astype(np.float32)
+
+
+_DCT32 = _dct_matrix(32)
+
+
+def phash(img: Image.Image) -> int:
+    """DCT hash: low 8x8 frequencies of a 32x32 thumbnail compared against their median."""
+    g = _gray(img, (32, 32))
+    low = (_DCT32 @ g @ _DCT32.T)[:8, :8].ravel()
+    med = np.median(low[1:])            # DC term would dominate the median
+    return _bits_to_int(low > med)
+
+
+def open_small(src, size: int = 64) -> Image.Image:
+    """Open a path or bytes with a reduced JPEG decode; enough for 32x32 hashes."""
+    im = Image.open(io.BytesIO(src) if isinstance(src, (bytes, bytearray)) else src)
+    im.draft("L", (size, size))
+    return im
+
+
+def hash_image(src) -> Tuple[int, int]:
+    """(dhash, phash) for a path or raw bytes."""
+    with open_small(src) as im:
+        im.load()
+        return dhash(im), phash(im)
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def to_hex(h: int) -> str:
+    return f"{h:016x}"
+
+
+# --------------------------
+# Multi-index hashing
+# --------------------------
+class HammingIndex:
+    """Exact radius search over 64-bit hashes for radius <= self.radius."""
+
+    def __init__(self, radius: int = DEFAULT_RADIUS, bits: int = HASH_BITS):
+        self.radius = radius
+        n_blocks = radius + 1
+        edges = np.linspace(0, bits, n_blocks + 1).astype(int)
+        # (shift, mask) per block, lowest bits first
+        self._blocks = [(int(lo), (1 << int(hi - lo)) - 1) for lo, hi in zip(edges[:-1], edges[1:])]
+        self._tables = [defaultdict(list) for _ in self._blocks]
+        self.hashes: List[int] = []
+        self.items: List = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def add(self, h: int, item=None):
+        with self._lock:
+            i = len(self.hashes)
+            self.hashes.append(h)
+            self.items.append(item)
+            for (shift, mask), table in zip(self._blocks, self._tables):
+                table[(h >> shift) & mask].append(i)
+
+    def query(self, h: int, radius: Optional[int] = None) -> List[Tuple[int, object]]:
+        """[(distance, item), ...] within `radius`, nearest first."""
+        radius = self.radius if radius is None else radius
+        if radius > self.radius:
+            ids = range(len(self.hashes))          # pigeonhole no longer holds
+        else:
+            ids = set()
+            for (shift, mask), table in zip(self._blocks, self._tables):
+                ids.update(table.get((h >> shift) & mask, ()))
+        out = []
+        for i in ids:
+            d = hamming(h, self.hashes[i])
+            if d <= radius:
+                out.append((d, self.items[i]))
+        out.sort(key=lambda x: x[0])
+        return out
+
+    def nearest(self, h: int, radius: Optional[int] = None):
+        hits = self.query(h, radius)
+        return hits[0] if hits else None
+
+
+# --------------------------
+# Live upload index
+# --------------------------
+class _Generation:
+    """One generation of uploads: its index and when it was started."""
+
+    def __init__(self, radius: int):
+        self.index = HammingIndex(radius)
+        self.started: Optional[float] = None        # ts of the first entry
+
+
+class UploadIndex:
+    """phash index of dataset images + recent uploads, lazily loaded on first use."""
+
+    def __init__(self, radius: int = DEFAULT_RADIUS, dataset_hashes: Path = DATASET_HASHES,
+                 upload_log: Path = UPLOAD_HASHES, max_uploads: int = MAX_UPLOADS,
+                 ttl_days: float = UPLOAD_TTL_DAYS):
+        self.radius = radius
+        self.dataset_hashes = dataset_hashes
+        self.upload_log = upload_log
+        self.previous_log = upload_log.with_name(upload_log.stem + ".1" + upload_log.suffix)
+        self.generation_size = max(1, max_uploads // 2)
+        self.ttl_s = ttl_days * 86400
+        self._dataset: Optional[HammingIndex] = None
+        self._current: Optional[_Generation] = None
+        self._previous: Optional[_Generation] = None
+        self._lock = threading.Lock()
+
+    def _load_log(self, log: Path) -> _Generation:
+        gen = _Generation(self.radius)
+        if log.exists():
+            with open(log, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        e = json.loads(line)
+                        ts = float(e.get("ts") or int(e["id"].rsplit("-", 1)[1]) / 1000)
+                        h = int(e["phash"], 16)
+                    except (ValueError, KeyError, IndexError):
+                        continue        # torn last line after a crash
+                    gen.index.add(h, {"source": "upload", "ref": e["id"], "ts": ts})
+                    if gen.started is None:
+                        gen.started = ts
+        return gen
+
+    def _load(self):
+        idx = HammingIndex(self.radius)
+        if self.dataset_hashes.exists():
+            import csv
+            with open(self.dataset_hashes, newline="", encoding="utf-8") as f:
+                for r in csv.DictReader(f):
+                    if r.get("phash"):
+                        idx.add(int(r["phash"], 16), {"source": "dataset", "ref": r["path"]})
+        self._previous = self._load_log(self.previous_log)
+        self._current = self._load_log(self.upload_log)
+        self._dataset = idx
+
+    @property
+    def index(self) -> HammingIndex:
+        """The dataset part of the index."""
+        if self._dataset is None:
+            with self._lock:
+                if self._dataset is None:
+                    self._load()
+        return self._dataset
+
+    def nearest(self, h: int, now: Optional[float] = None):
+        """(distance, item) of the closest dataset image or live upload within radius, or None."""
+        dataset = self.index
+        cutoff = (now or time.time()) - self.ttl_s
+        best = dataset.nearest(h)
+        for gen in (self._current, self._previous):
+            for d, item in gen.index.query(h):
+                if item["ts"] >= cutoff:
+                    if best is None or d < best[0]:
+                        best = (d, item)
+                    break               # nearest first
+        return best
+
+    def _rotate(self):
+        """Current generation becomes the previous one; the old previous one is dropped. Caller holds _lock."""
+        try:
+            if self.upload_log.exists():
+                os.replace(self.upload_log, self.previous_log)
+            elif self.previous_log.exists():
+                self.previous_log.unlink()
+        except OSError:
+            pass
+        self._previous, self._current = self._current, _Generation(self.radius)
+
+    def add(self, ph: int, now: Optional[float] = None) -> str:
+        """Record an upload hash in the index and the log; returns its id."""
+        self.index                      # loaded
+        now = now or time.time()
+        upload_id = f"{to_hex(ph)}-{int(now * 1000)}"
+        with self._lock:
+            cur = self._current
+            if len(cur.index) >= self.generation_size or (
+                    cur.started is not None and now - cur.started > self.ttl_s / 2):
+                self._rotate()
+                cur = self._current
+            cur.index.add(ph, {"source": "upload", "ref": upload_id, "ts": now})
+            if cur.started is None:
+                cur.started = now
+            try:
+                self.upload_log.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.upload_log, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"id": upload_id, "phash": to_hex(ph), "ts": round(now, 3)}) + "\n")
+            except OSError:
+                pass                    # flagging still works for this process
+        return upload_id
+
+    def check_and_add(self, image_bytes: bytes) -> Dict:
+        """
+        Hash an upload, look up its nearest earlier near-duplicate and record it
+        (unless it is an exact repeat, which would only grow the index).
+        Returns {"phash": hex, "near_duplicate": None | {"source", "ref", "distance"}}.
+        """
+        _, ph = hash_image(image_bytes)
+        hit = self.nearest(ph)
+        if hit is None or hit[0] > 0:
+            self.add(ph)
+        dup = None
+        if hit is not None:
+            dup = {"source": hit[1]["source"], "ref": hit[1]["ref"], "distance": hit[0]}
+        return {"phash": to_hex(ph), "near_duplicate": dup}
+
+
+UPLOADS = UploadIndex()
@@ -0,0 +1,185 @@
+# backend/events.py
+"""
+In-process pub/sub for the buyer live stock feed (Server-Sent Events).
+
+Writers call publish() from any thread after their transaction commits:
+
+    events.publish("record", {"id": 7, "available_kg": 120.0, ...})   # new listing
+    events.publish("stock", {"id": 7, "available_kg": 95.0})          # stock changed
+    events.publish("resync", {"reason": "repriced"})                  # refetch everything
+
+Fanout runs on the event loop thread. Each connection is an async generator
+waiting on an asyncio.Event, so an idle connection costs a few KB and no
+thread. Backpressure is per connection: pending events are keyed by
+(type, record id), so a slow client only ever holds the latest state of each
+record; if it still falls MAX_PENDING keys behind, its queue is dropped and it
+gets a single "resync" instead. A short replay ring lets a reconnecting
+client (Last-Event-ID) catch up without refetching.
+
+Event ids are "<BOOT>-<seq>", BOOT being random per process. A Last-Event-ID
+from another process (a restart, or a reconnect that lands on another worker)
+or one this process cannot account for gets a "resync", never a silent gap.
+
+Subscribers only see events published in the same process; with several
+workers, each worker's buyers see that worker's writes plus a resync on
+reconnect.
+"""
+import asyncio
+import json
+import os
+import secrets
+import threading
+from collections import OrderedDict, deque
+from typing import AsyncIterator, Deque, Dict, Iterator, Optional, Tuple
+
+import metrics
+
+MAX_PENDING = int(os.getenv("STREAM_MAX_PENDING", "256"))          # distinct keys queued per connection
+MAX_SUBSCRIBERS = int(os.getenv("STREAM_MAX_SUBSCRIBERS", "5000"))
+HEARTBEAT_S = float(os.getenv("STREAM_HEARTBEAT_S", "15"))
+REPLAY = int(os.getenv("STREAM_REPLAY", "1000"))                  # recent events kept for Last-Event-ID
+BOOT = secrets.token_hex(4)                                         # event id prefix, new every process start
+
+
+def event_id(seq: int) -> str:
+    return f"{BOOT}-{seq}"
+
+
+def parse_event_id(value: Optional[str]) -> Optional[Tuple[str, int]]:
+    """(boot, seq) from "<boot>-<seq>"; None if missing or malformed."""
+    boot, _, seq = (value or "").strip().rpartition("-")
+    if not boot or not seq.isdigit():
+        return None
+    return boot, int(seq)
+
+
+def _frame(seq: int, etype: str, data: Dict) -> str:
+    return f"id: {event_id(seq)}\nevent: {etype}\ndata: {json.dumps(data, separators=(',', ':'), default=str)}\n\n"
+
+
+class Subscriber:
+    __slots__ = ("pending", "wake", "overflow")
+
+    def __init__(self):
+        self.pending: "OrderedDict[Tuple, str]" = OrderedDict()      # key -> rendered frame
+        self.wake = asyncio.Event()
+        self.overflow = False
+
+    def offer(self, key: Tuple, frame: str):
+        """Queue an event (event loop thread only); same-key events replace each other."""
+        if self.overflow:
+            return
+        if key in self.pending:
+            del self.pending[key]
+            metrics.STREAM_EVENTS.inc("coalesced")
+        elif len(self.pending) >= MAX_PENDING:
+            self.pending.clear()
+            self.overflow = True
+            metrics.STREAM_EVENTS.inc("overflow")
+        if not self.overflow:
+            self.pending[key] = frame
+        self.wake.set()
+
+    def drain(self, last_seq: int) -> Iterator[str]:
+        if self.overflow:
+            self.overflow = False
+            yield _frame(last_seq, "resync", {"reason": "lagging"})
+            return
+        while self.pending:
+            yield self.pending.popitem(last=False)[1]
+
+
+class Broker:
+    def __init__(self):
+        self._subs: set = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._seq = 0
+        self._ring: Deque[Tuple[int, Tuple, str]] = deque(maxlen=REPLAY)      # (seq, key, frame)
+        self._lock = threading.Lock()
+
+    @property
+    def last_seq(self) -> int:
+        return self._seq
+
+    def publish(self, etype: str, data: Dict):
+        """Thread-safe; never blocks the caller on slow clients."""
+        with self._lock:
+            self._seq += 1
+            key = (etype, data.get("id")) if data.get("id") is not None else (etype, self._seq)
+            item = (self._seq, key, _frame(self._seq, etype, data))      # rendered once for every subscriber
+            self._ring.append(item)
+            loop = self._loop
+        metrics.STREAM_EVENTS.inc("published")
+        if loop is not None and self._subs:
+            try:
+                loop.call_soon_threadsafe(self._fanout, item)
+            except RuntimeError:
+                pass            # loop closed during shutdown
+
+    def _fanout(self, item):
+        _, key, frame = item
+        for sub in tuple(self._subs):
+            sub.offer(key, frame)
+
+    def subscribe(self, last_event_id: Optional[str] = None) -> Subscriber:
+        """
+        Register a connection (on the event loop). Replays events after
+        last_event_id when still buffered, otherwise starts with a resync.
+        """
+        if len(self._subs) >= MAX_SUBSCRIBERS:
+            raise OverflowError("too many live-feed connections")
+        self._loop = asyncio.get_running_loop()
+        sub = Subscriber()
+        if last_event_id:
+            parsed = parse_event_id(last_event_id)
+            with self._lock:
+                ring, current = list(self._ring), self._seq
+            if parsed is None or parsed[0] != BOOT or parsed[1] > current:
+                sub.overflow = True      # id from another process (restart / other worker): state unknown
+            elif ring and parsed[1] >= ring[0][0] - 1:
+                for seq, key, frame in ring:
+                    if seq > parsed[1]:
+                        sub.offer(key, frame)
+            elif parsed[1] < current:
+                sub.overflow = True      # missed more than the ring holds
+            if sub.overflow:
+                sub.wake.set()
+        self._subs.add(sub)
+        metrics.STREAM_SUBSCRIBERS.set(len(self._subs))
+        return sub
+
+    def unsubscribe(self, sub: Subscriber):
+        self._subs.discard(sub)
+        metrics.STREAM_SUBSCRIBERS.set(len(self._subs))
+
+    async def stream(self, sub: Subscriber, is_disconnected) -> AsyncIterator[str]:
+        """SSE frames for one connection; heartbeats keep proxies from closing idle streams."""
+        try:
+            yield f"retry: 3000\nid: {event_id(self._seq)}\n\n"
+            while True:
+                try:
+                    await asyncio.wait_for(sub.wake.wait(), HEARTBEAT_S)
+                except asyncio.TimeoutError:
+                    if await is_disconnected():
+                        break
+                    yield ": ping\n\n"
+                    continue
+                sub.wake.clear()
+                for frame in sub.drain(self._seq):
+                    yield frame
+        finally:
+            self.unsubscribe(sub)
+
+
+BROKER = Broker()
+publish = BROKER.publish
+
+
+def stock_event(rec) -> Dict:
+    """Payload describing a record's current stock and price."""
+    unit_price = (rec.revenue_estimate / rec.mass_kg) if rec.mass_kg and rec.revenue_estimate else 0.0
+    return {
+        "id": rec.id,
+        "available_kg": rec.available_kg if rec.available_kg is not None else rec.mass_kg,
+        "unit_price": round(unit_price, 4),
+    }
@@ -0,0 +1,248 @@
+# backend/exports.py
+"""
+Streaming CSV / Parquet exports of records and order lines for reporting.
+
+Rows are read CHUNK at a time and encoded chunk by chunk, so memory stays at
+one chunk whatever the table size, and the CSV header goes out before the
+first query runs:
+
+  - SQLite and drivers with server-side cursors: one SELECT read with
+    yield_per (stream_results).
+  - mysql-connector (the default MySQL driver) buffers whole result sets even
+    with stream_results, so there the export pages by primary key instead
+    (WHERE key > last ORDER BY key LIMIT CHUNK), which also keeps memory flat.
+
+Parquet needs pyarrow (optional); each chunk becomes one row group.
+
+    start, end = exports.parse_range("2026-01-01", "2026-03-31")
+    for part in exports.stream(exports.DATASETS["records"], "csv", start, end):
+        ...   # bytes
+"""
+import csv
+import io
+import os
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, Order, OrderItem, Record
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:         # Parquet export is optional
+    pa = pq = None
+
+CHUNK = int(os.getenv("EXPORT_CHUNK", "5000"))
+FORMATS = ("csv", "parquet")
+MEDIA_TYPES = {"csv": "text/csv; charset=utf-8", "parquet": "application/vnd.apache.parquet"}
+
+
+class Dataset:
+    """
+    What one export reads: (name, column, type) triples, the FROM clause, the
+    date column filtered by start / end, and the unique, ordered key columns
+    used for paging.
+    """
+
+    def __init__(self, name: str, columns: List[Tuple[str, object, str]], from_, date_col, keys):
+        self.name = name
+        self.columns = columns
+        self.from_ = from_
+        self.date_col = date_col
+        self.keys = keys
+
+    @property
+    def header(self) -> List[str]:
+        return [c[0] for c in self.columns]
+
+    def select(self, start: Optional[datetime], end: Optional[datetime]):
+        q = (select(*[c[1].label(c[0]) for c in self.columns],
+                    *[k.label(f"_k{i}") for i, k in enumerate(self.keys)])      # paging key, not exported
+             .select_from(self.from_))
+        if start is not None:
+            q = q.where(self.date_col >= start)
+        if end is not None:
+            q = q.where(self.date_col < end)
+        return q.order_by(*self.keys)
+
+
+_ITEM_ID = func.coalesce(OrderItem.id, 0)       # orders without items still export one line
+
+DATASETS: Dict[str, Dataset] = {
+    "records": Dataset(
+        "records",
+        [("id", Record.id, "int"), ("timestamp", Record.timestamp, "datetime"),
+         ("farmer_name", Record.farmer_name, "str"), ("location", Record.location, "str"),
+         ("phone", Record.phone, "str"), ("crop", Record.crop, "str"),
+         ("mass_kg", Record.mass_kg, "float"), ("available_kg", Record.available_kg, "float"),
+         ("mass_source", Record.mass_source, "str"), ("moisture_percent", Record.moisture_percent, "float"),
+         ("vs_fraction", Record.vs_fraction, "float"), ("predicted_m3_biogas", Record.predicted_m3_biogas, "float"),
+         ("revenue_estimate", Record.revenue_estimate, "float"), ("yield_version", Record.yield_version, "str"),
+         ("latitude", Record.latitude, "float"), ("longitude", Record.longitude, "float"),
+         ("image_id", Record.image_id, "str")],
+        Record.__table__, Record.timestamp, [Record.id],
+    ),
+    "orders": Dataset(
+        "orders",
+        [("order_id", Order.id, "int"), ("created_at", Order.created_at, "datetime"),
+         ("buyer_name", Order.buyer_name, "str"), ("buyer_phone", Order.buyer_phone, "str"),
+         ("buyer_location", Order.buyer_location, "str"), ("status", Order.status, "str"),
+         ("order_total", Order.total_price, "float"), ("item_id", OrderItem.id, "int"),
+         ("record_id", OrderItem.record_id, "int"), ("qty_kg", OrderItem.qty_kg, "float"),
+         ("unit_price", OrderItem.unit_price, "float"), ("line_total", OrderItem.line_total, "float")],
+        Order.__table__.outerjoin(OrderItem.__table__, OrderItem.order_id == Order.id),
+        Order.created_at, [Order.id, _ITEM_ID],
+    ),
+}
+
+
+def parse_range(start: Optional[str], end: Optional[str]) -> Tuple[Optional[datetime], Optional[datetime]]:
+    """
+    ISO date / datetime bounds as [start, end). A date-only end includes that
+    whole day. ValueError if malformed or reversed.
+    """
+    def parse(v: Optional[str], is_end: bool) -> Optional[datetime]:
+        if not v:
+            return None
+        try:
+            if len(v) == 10:
+                d = date.fromisoformat(v)
+                return datetime.combine(d + timedelta(days=1) if is_end else d, time.min)
+            dt = datetime.fromisoformat(v.replace("Z", "+00:00"))
+            if dt.tzinfo is not None:
+                dt = dt.astimezone(timezone.utc).replace(tzinfo=None)     # timestamps are stored as naive UTC
+            return dt
+        except ValueError:
+            raise ValueError(f"{'end' if is_end else 'start'} must be an ISO date or datetime (got {v!r})")
+
+    lo, hi = parse(start, False), parse(end, True)
+    if lo is not None and hi is not None and hi <= lo:
+        raise ValueError("end must be after start")
+    return lo, hi
+
+
+# --------------------------
+# Reading
+# --------------------------
+def _streams_natively(db: Session) -> bool:
+    dialect = db.get_bind().dialect
+    # pysqlite cursors fetch lazily; other drivers need real server-side cursors
+    return dialect.name == "sqlite" or dialect.supports_server_side_cursors
+
+
+def chunks(db: Session, ds: Dataset, start: Optional[datetime], end: Optional[datetime],
+           chunk: int = CHUNK) -> Iterator[List[tuple]]:
+    """Lists of at most `chunk` rows (export columns only) in key order."""
+    q = ds.select(start, end)
+    n = len(ds.columns)
+    if _streams_natively(db):
+        for part in db.execute(q.execution_options(yield_per=chunk)).partitions():
+            yield [r[:n] for r in part]
+        return
+
+    last = None
+    while True:
+        page = q
+        if last is not None:
+            # (k1, k2, ...) > last, spelled out; row-value comparison is not portable
+            after, equal = [], []
+            for col, val in zip(ds.keys, last):
+                after.append(and_(*equal, col > val))
+                equal.append(col == val)
+            page = q.where(or_(*after))
+        rows = db.execute(page.limit(chunk)).all()
+        if not rows:
+            return
+        yield [r[:n] for r in rows]
+        if len(rows) < chunk:
+            return
+        last = tuple(rows[-1][n:])
+
+
+# --------------------------
+# Encoding
+# --------------------------
+def _csv_value(v):
+    if v is None:
+        return ""
+    if isinstance(v, datetime):
+        return v.isoformat(sep=" ")
+    return v
+
+
+def _csv_parts(ds: Dataset, parts: Iterator[List[tuple]]) -> Iterator[bytes]:
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    w.writerow(ds.header)
+    yield buf.getvalue().encode("utf-8")
+    for rows in parts:
+        buf.seek(0)
+        buf.truncate()
+        w.writerows([_csv_value(v) for v in r] for r in rows)
+        yield buf.getvalue().encode("utf-8")
+
+
+class _Sink(io.RawIOBase):
+    """Write-only file that hands back whatever was written since the last take()."""
+
+    def __init__(self):
+        super().__init__()
+        self._parts: List[bytes] = []
+        self._pos = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        data = bytes(b)
+        self._parts.append(data)
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def take(self) -> bytes:
+        data, self._parts = b"".join(self._parts), []
+        return data
+
+
+def _arrow_schema(ds: Dataset):
+    types = {"int": pa.int64(), "float": pa.float64(), "str": pa.string(), "datetime": pa.timestamp("us")}
+    return pa.schema([(name, types[kind]) for name, _, kind in ds.columns])
+
+
+def _parquet_parts(ds: Dataset, parts: Iterator[List[tuple]]) -> Iterator[bytes]:
+    schema = _arrow_schema(ds)
+    sink = _Sink()
+    writer = pq.ParquetWriter(sink, schema, compression="snappy")
+    try:
+        for rows in parts:
+            cols = list(zip(*rows))
+            writer.write_table(pa.Table.from_arrays(
+                [pa.array(c, type=f.type) for c, f in zip(cols, schema)], schema=schema))   # one row group
+            data = sink.take()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.take()         # footer
+
+
+def stream(ds: Dataset, fmt: str, start: Optional[datetime] = None, end: Optional[datetime] = None,
+           chunk: int = CHUNK) -> Iterator[bytes]:
+    """
+    Encoded export, chunk by chunk. Opens its own session, since the response
+    outlives the request's: it is closed when the stream ends or the client goes away.
+    """
+    if fmt == "parquet" and pa is None:
+        raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)")
+    db = SessionLocal()
+    try:
+        parts = chunks(db, ds, start, end, chunk)
+        yield from (_parquet_parts(ds, parts) if fmt == "parquet" else _csv_parts(ds, parts))
+    finally:
+        db.close()
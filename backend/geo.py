@@ -0,0 +1,195 @@
+# backend/geo.py
+"""
+Geohash bucketing for nearest-supply search.
+
+Records with coordinates store a precision-9 geohash (~5 m cell) in an
+indexed column. A geohash prefix is a rectangular cell, and every point in a
+cell shares the prefix, so "records in these cells" is a handful of index range
+scans (geohash >= prefix AND geohash < prefix + '~') on MySQL and SQLite alike.
+
+nearby() searches the 3x3 block of cells around the buyer, starting small and
+coarsening until the K nearest are provably inside the block, then ranks them.
+"""
+import math
+import os
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Session
+
+from database import Record
+
+STORE_PRECISION = 9
+SEARCH_PRECISIONS = (6, 5, 4, 3, 2, 1)       # ~1 km, 5 km, 40 km, 160 km, 1250 km, 5000 km cells
+EARTH_KM = 6371.0088
+KM_PER_DEG = math.pi * EARTH_KM / 180.0
+
+# ₹ per kg per km of haulage, used to rank by landed cost (price + transport)
+FREIGHT_PER_KG_KM = float(os.getenv("NEARBY_FREIGHT_PER_KG_KM", "0.02"))
+SORTS = ("landed", "distance", "price")
+
+_BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+# --------------------------
+# Geohash
+# --------------------------
+def encode(lat: float, lon: float, precision: int = STORE_PRECISION) -> str:
+    lat_lo, lat_hi, lon_lo, lon_hi = -90.0, 90.0, -180.0, 180.0
+    out, bits, ch, even = [], 0, 0, True
+    while len(out) < precision:
+        if even:
+            mid = (lon_lo + lon_hi) / 2
+            if lon >= mid:
+                ch, lon_lo = (ch << 1) | 1, mid
+            else:
+                ch, lon_hi = ch << 1, mid
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            if lat >= mid:
+                ch, lat_lo = (ch << 1) | 1, mid
+            else:
+                ch, lat_hi = ch << 1, mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            out.append(_BASE32[ch])
+            bits, ch = 0, 0
+    return "".join(out)
+
+
+def cell_size(precision: int) -> Tuple[float, float]:
+    """(height, width) of a cell in degrees."""
+    lon_bits = (5 * precision + 1) // 2
+    lat_bits = 5 * precision // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits)
+
+
+def block(lat: float, lon: float, precision: int) -> List[str]:
+    """The cell containing (lat, lon) and its 8 neighbours (deduplicated near the poles)."""
+    dlat, dlon = cell_size(precision)
+    cells = []
+    for i in (-1, 0, 1):
+        la = lat + i * dlat
+        if not -90.0 <= la <= 90.0:
+            continue
+        for j in (-1, 0, 1):
+            lo = (lon + j * dlon + 180.0) % 360.0 - 180.0
+            h = encode(la, lo, precision)
+            if h not in cells:
+                cells.append(h)
+    return cells
+
+
+def block_radius_km(lat: float, precision: int) -> float:
+    """Every point within this distance of (lat, *) lies inside block(lat, *, precision)."""
+    dlat, dlon = cell_size(precision)
+    # longitude degrees shrink poleward; use the block's poleward edge
+    return min(dlat * KM_PER_DEG, dlon * KM_PER_DEG * math.cos(math.radians(min(abs(lat) + dlat, 89.9))))
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp, dl = p2 - p1, math.radians(lon2 - lon1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def distances_km(lat: float, lon: float, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """haversine_km from one point to many (NaN where coordinates are missing)."""
+    p1, p2 = math.radians(lat), np.radians(lats)
+    dp, dl = p2 - p1, np.radians(lons - lon)
+    a = np.sin(dp / 2) ** 2 + math.cos(p1) * np.cos(p2) * np.sin(dl / 2) ** 2
+    return 2 * EARTH_KM * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+
+def parse_coords(lat, lon) -> Optional[Tuple[float, float]]:
+    """(lat, lon) as floats, None if both are missing; ValueError if invalid or only one is given."""
+    if lat in (None, "") and lon in (None, ""):
+        return None
+    if lat in (None, "") or lon in (None, ""):
+        raise ValueError("Provide both lat and lon")
+    lat, lon = float(lat), float(lon)
+    if not (-90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0) or math.isnan(lat) or math.isnan(lon):
+        raise ValueError("lat must be in [-90, 90] and lon in [-180, 180]")
+    return lat, lon
+
+
+# --------------------------
+# Search
+# --------------------------
+def unit_price(rec: Record) -> Optional[float]:
+    if rec.mass_kg and rec.revenue_estimate is not None:
+        return rec.revenue_estimate / rec.mass_kg
+    return None
+
+
+def _in_cells(cells: List[str]):
+    return or_(*[and_(Record.geohash >= c, Record.geohash < c + "~") for c in cells])
+
+
+def within(lat: float, lon: float, km: float):
+    """
+    Index-friendly filter for records that may lie within km of (lat, lon): the
+    smallest cell block covering that radius (a superset; check distances after).
+    None when the radius is wider than the coarsest block.
+    """
+    for precision in SEARCH_PRECISIONS:
+        if block_radius_km(lat, precision) >= km:
+            return _in_cells(block(lat, lon, precision))
+    return None
+
+
+def nearby(db: Session, lat: float, lon: float, k: int = 10, min_kg: float = 0.0,
+           max_km: Optional[float] = None, sort: str = "landed",
+           freight: float = FREIGHT_PER_KG_KM) -> List[Dict]:
+    """
+    The k nearest records with available_kg > min_kg (within max_km if given),
+    ordered by `sort`: "landed" (unit price + freight * distance), "distance" or "price".
+    """
+    found: Dict[int, Tuple[float, Record]] = {}
+    for precision in SEARCH_PRECISIONS:
+        q = (db.query(Record)
+             .filter(_in_cells(block(lat, lon, precision)))
+             .filter(Record.available_kg > min_kg))
+        if found:
+            q = q.filter(Record.id.notin_(list(found)))
+        for rec in q:
+            found[rec.id] = (haversine_km(lat, lon, rec.latitude, rec.longitude), rec)
+        covered = block_radius_km(lat, precision)
+        if max_km is not None and covered >= max_km:
+            break
+        if sum(1 for d, _ in found.values() if d <= covered) >= k:
+            break
+
+    hits = sorted(found.values(), key=lambda t: t[0])
+    if max_km is not None:
+        hits = [t for t in hits if t[0] <= max_km]
+    hits = hits[:k]
+
+    out = []
+    for dist, rec in hits:
+        price = unit_price(rec)
+        out.append({
+            "id": rec.id,
+            "farmer_name": rec.farmer_name,
+            "location": rec.location,
+            "phone": rec.phone,
+            "latitude": rec.latitude,
+            "longitude": rec.longitude,
+            "distance_km": round(dist, 3),
+            "mass_kg": rec.mass_kg,
+            "available_kg": rec.available_kg,
+            "unit_price": round(price, 4) if price is not None else None,
+            "landed_price": round(price + freight * dist, 4) if price is not None else None,
+            "predicted_m3_biogas": rec.predicted_m3_biogas,
+            "revenue_estimate": rec.revenue_estimate,
+            "image_url": f"/api/v1/images/{rec.image_id}" if rec.image_id else None,
+        })
+    inf = float("inf")
+    if sort == "price":
+        out.sort(key=lambda r: (inf if r["unit_price"] is None else r["unit_price"], r["distance_km"]))
+    elif sort == "landed":
+        out.sort(key=lambda r: (inf if r["landed_price"] is None else r["landed_price"], r["distance_km"]))
+    return out
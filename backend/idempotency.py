@@ -0,0 +1,152 @@
+# backend/idempotency.py
+"""
+Idempotency-Key support for POST /api/v1/records and /api/v1/orders.
+
+farmer.html and buyer.html send a key per logical submission and reuse it when
+they retry, so a request that reached the server but whose response was lost
+does not save a second record or decrement stock twice. The key's row is
+inserted in the same transaction as the write and holds the JSON response:
+
+  - key seen, same body       -> the stored response is returned, nothing runs
+  - key seen, different body  -> ValueError (routes answer 422)
+  - two copies in flight      -> the loser's commit hits the primary key, rolls
+                                 back, and returns the winner's stored response
+
+Rows expire after TTL_S; a write purges expired rows every PURGE_EVERY_S. A
+bounded in-memory LRU in front of the table answers repeats without a query;
+with several workers, a repeat landing on another worker falls through to the
+table.
+
+    idem = idempotency.Request("orders", key_header, payload)
+    stored = idem.lookup(db)          # dict -> return it as the response
+    ... write, flush ...
+    idem.remember(db, body)           # before db.commit()
+    db.commit()
+    idem.committed(db)
+"""
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import delete
+from sqlalchemy.orm import Session
+
+from database import IdempotencyKey
+import metrics
+
+HEADER = "Idempotency-Key"
+REPLAY_HEADER = "Idempotent-Replayed"
+TTL_S = float(os.getenv("IDEMPOTENCY_TTL_S", str(24 * 3600)))
+CACHE_SIZE = int(os.getenv("IDEMPOTENCY_CACHE_SIZE", "20000"))
+PURGE_EVERY_S = float(os.getenv("IDEMPOTENCY_PURGE_EVERY_S", "600"))
+
+_KEY_RE = re.compile(r"^[\x21-\x7e]{1,64}$")      # printable ASCII, no spaces (UUIDs, ULIDs, ...)
+_T = IdempotencyKey.__table__
+
+# (scope, key) -> (request_hash, response JSON, expires_at)
+_CACHE: "OrderedDict[Tuple[str, str], Tuple[str, str, datetime]]" = OrderedDict()
+_CACHE_LOCK = threading.Lock()
+_LAST_PURGE = 0.0
+
+
+def _dumps(obj: Any) -> str:
+    return json.dumps(obj, sort_keys=True, separators=(",", ":"), default=str)
+
+
+def _cache_get(k: Tuple[str, str]):
+    with _CACHE_LOCK:
+        hit = _CACHE.get(k)
+        if hit is not None:
+            _CACHE.move_to_end(k)
+        return hit
+
+
+def _cache_put(k: Tuple[str, str], entry: Tuple[str, str, datetime]):
+    with _CACHE_LOCK:
+        _CACHE[k] = entry
+        _CACHE.move_to_end(k)
+        while len(_CACHE) > CACHE_SIZE:
+            _CACHE.popitem(last=False)
+
+
+class Request:
+    """One POST's key and body fingerprint; every method is a no-op when no key was sent."""
+    __slots__ = ("scope", "key", "request_hash", "_stored")
+
+    def __init__(self, scope: str, key: Optional[str], payload: Any):
+        self.scope = scope
+        self.key = (key or "").strip() or None
+        if self.key is not None and not _KEY_RE.match(self.key):
+            raise ValueError(f"{HEADER} must be 1-64 printable characters without spaces")
+        self.request_hash = hashlib.sha256(_dumps(payload).encode()).hexdigest() if self.key else None
+        self._stored: Optional[Tuple[str, str, datetime]] = None
+
+    def _check(self, request_hash: str, response: str) -> Dict:
+        if request_hash != self.request_hash:
+            metrics.IDEMPOTENCY_REQUESTS.inc(self.scope, "conflict")
+            raise ValueError(f"{HEADER} {self.key!r} was already used for a different request")
+        metrics.IDEMPOTENCY_REQUESTS.inc(self.scope, "replayed")
+        return json.loads(response)
+
+    def lookup(self, db: Session) -> Optional[Dict]:
+        """The stored response for this key, or None if the request should run."""
+        if self.key is None:
+            return None
+        now = datetime.utcnow()
+        hit = _cache_get((self.scope, self.key))
+        if hit is not None and hit[2] > now:
+            metrics.cache_hit("idempotency")
+            return self._check(hit[0], hit[1])
+        metrics.cache_miss("idempotency")
+        row = db.get(IdempotencyKey, (self.scope, self.key))
+        if row is None:
+            return None
+        if row.expires_at <= now:
+            # expired: forget it so this request can take the key over
+            db.execute(delete(_T).where((_T.c.scope == self.scope) & (_T.c.key == self.key)))
+            db.expunge(row)
+            return None
+        _cache_put((self.scope, self.key), (row.request_hash, row.response, row.expires_at))
+        return self._check(row.request_hash, row.response)
+
+    def remember(self, db: Session, response: Dict):
+        """Store the response in the caller's transaction (call just before commit)."""
+        if self.key is None:
+            return
+        body = _dumps(response)
+        expires = datetime.utcnow() + timedelta(seconds=TTL_S)
+        db.add(IdempotencyKey(scope=self.scope, key=self.key, request_hash=self.request_hash,
+                              response=body, expires_at=expires))
+        self._stored = (self.request_hash, body, expires)
+
+    def committed(self, db: Session):
+        """After a successful commit: serve repeats from memory and purge expired keys now and then."""
+        if self.key is None:
+            return
+        metrics.IDEMPOTENCY_REQUESTS.inc(self.scope, "new")
+        if self._stored is not None:
+            _cache_put((self.scope, self.key), self._stored)
+        _maybe_purge(db)
+
+
+def _maybe_purge(db: Session):
+    global _LAST_PURGE
+    now = time.monotonic()
+    if now - _LAST_PURGE < PURGE_EVERY_S:
+        return
+    _LAST_PURGE = now
+    try:
+        res = db.execute(delete(_T).where(_T.c.expires_at < datetime.utcnow()))
+        db.commit()
+        if res.rowcount:
+            print(f"🧹 Purged {res.rowcount} expired idempotency keys", file=sys.stderr)
+    except Exception as e:
+        db.rollback()
+        print("⚠️ Idempotency key purge failed:", e, file=sys.stderr)
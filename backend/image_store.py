@@ -0,0 +1,260 @@
+# backend/image_store.py
+"""
+Content-addressed storage for uploaded prediction images plus a lazily
+filled WebP thumbnail cache.
+
+  outputs/images/originals/ab/<sha256>.<ext>      uploaded bytes, written once
+  outputs/images/thumbs/ab/<sha256>_<size>.webp   made on first request
+
+Identical uploads share one file (the id is the sha256 of the bytes), so an id
+always names the same content and responses can be cached forever. Thumbnails
+are bounded by IMAGE_CACHE_MAX_MB and evicted least-recently-used first.
+Originals referenced by a record (records.image_id) are kept for good; an
+original nobody saved a record for is deleted, with its thumbnails, once it
+is older than IMAGE_ORIGINAL_TTL_DAYS (collect_garbage, run in the background
+at most every IMAGE_GC_EVERY_S by maybe_collect_garbage).
+"""
+import io
+import hashlib
+import os
+import re
+import sys
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Iterable, Optional, Set
+
+from PIL import Image, ImageOps
+
+from atomic import atomic_write
+
+ROOT = Path(__file__).resolve().parent
+STORE_DIR = Path(os.getenv("IMAGE_STORE_DIR", str(ROOT / "outputs" / "images")))
+ORIGINALS_DIR = STORE_DIR / "originals"
+THUMBS_DIR = STORE_DIR / "thumbs"
+
+THUMB_SIZES = (160, 480, 1024)
+MAX_THUMB_BYTES = int(float(os.getenv("IMAGE_CACHE_MAX_MB", "512")) * 1024 * 1024)
+ORIGINAL_TTL_S = float(os.getenv("IMAGE_ORIGINAL_TTL_DAYS", "7")) * 86400    # unreferenced uploads
+GC_EVERY_S = float(os.getenv("IMAGE_GC_EVERY_S", "21600"))
+
+_ID_RE = re.compile(r"^[0-9a-f]{64}$")
+_EXT = {"JPEG": "jpg", "PNG": "png", "WEBP": "webp", "BMP": "bmp", "TIFF": "tif", "MPO": "jpg"}
+
+
+def is_valid_id(image_id: str) -> bool:
+    return bool(_ID_RE.match(image_id or ""))
+
+
+def _shard(base: Path, image_id: str) -> Path:
+    return base / image_id[:2]
+
+
+def _write_atomic(path: Path, data: bytes):
+    with atomic_write(path) as f:
+        f.write(data)
+
+
+# --------------------------
+# Originals
+# --------------------------
+def put(image_bytes: bytes) -> str:
+    """Store an upload (no-op if the same bytes were stored before) and return its id."""
+    image_id = hashlib.sha256(image_bytes).hexdigest()
+    existing = original_path(image_id)
+    if existing is not None:
+        try:
+            os.utime(existing)          # uploaded again: restart its unreferenced-upload clock
+        except OSError:
+            pass
+        return image_id
+    with Image.open(io.BytesIO(image_bytes)) as im:      # header only; rejects non-images
+        ext = _EXT.get(im.format, "img")
+    _write_atomic(_shard(ORIGINALS_DIR, image_id) / f"{image_id}.{ext}", image_bytes)
+    return image_id
+
+
+def original_path(image_id: str) -> Optional[Path]:
+    if not is_valid_id(image_id):
+        return None
+    shard = _shard(ORIGINALS_DIR, image_id)
+    if not shard.exists():
+        return None
+    for p in shard.glob(f"{image_id}.*"):
+        if not p.name.endswith(".tmp"):
+            return p
+    return None
+
+
+def collect_garbage(referenced: Callable[[Iterable[str]], Set[str]], max_age_s: float = ORIGINAL_TTL_S,
+                    now: Optional[float] = None, batch: int = 500) -> int:
+    """
+    Delete originals older than max_age_s that no record refers to, plus their
+    thumbnails. referenced(ids) returns the subset of ids still in use.
+    Returns the number of originals deleted.
+    """
+    if not ORIGINALS_DIR.exists():
+        return 0
+    cutoff = (now or time.time()) - max_age_s
+    removed = 0
+
+    def sweep(old):
+        nonlocal removed
+        keep = referenced([image_id for image_id, _ in old])
+        for image_id, path in old:
+            if image_id in keep:
+                continue
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            removed += 1
+            for thumb in _shard(THUMBS.root, image_id).glob(f"{image_id}_*.webp"):
+                THUMBS.removed(thumb)
+
+    old = []
+    for path in ORIGINALS_DIR.glob("*/*"):
+        image_id = path.stem
+        if not is_valid_id(image_id) or path.name.endswith(".tmp"):
+            continue
+        try:
+            if path.stat().st_mtime >= cutoff:
+                continue
+        except OSError:
+            continue
+        old.append((image_id, path))
+        if len(old) >= batch:
+            sweep(old)
+            old = []
+    if old:
+        sweep(old)
+    return removed
+
+
+_GC_LOCK = threading.Lock()
+_LAST_GC = 0.0
+
+
+def maybe_collect_garbage(referenced: Callable[[Iterable[str]], Set[str]]):
+    """collect_garbage in a background thread, at most once every GC_EVERY_S."""
+    global _LAST_GC
+    now = time.time()
+    if now - _LAST_GC < GC_EVERY_S or not _GC_LOCK.acquire(blocking=False):
+        return
+    _LAST_GC = now
+
+    def run():
+        try:
+            n = collect_garbage(referenced)
+            if n:
+                print(f"🧹 Removed {n} unreferenced uploaded images", file=sys.stderr)
+        except Exception as e:
+            print("⚠️ Image garbage collection failed:", e, file=sys.stderr)
+        finally:
+            _GC_LOCK.release()
+
+    threading.Thread(target=run, name="image-gc", daemon=True).start()
+
+
+# --------------------------
+# Thumbnails (LRU-bounded)
+# --------------------------
+class ThumbCache:
+    """Tracks thumbnail files by last use; mtime is bumped on hits so order survives restarts."""
+
+    def __init__(self, root: Path = THUMBS_DIR, max_bytes: int = MAX_THUMB_BYTES):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lru = None            # OrderedDict[path, size], oldest first
+        self._total = 0
+        self._lock = threading.Lock()
+        self._building = {}         # path -> Lock, so one request renders a given thumb
+
+    def _scan(self):
+        entries = []
+        if self.root.exists():
+            for p in self.root.rglob("*.webp"):
+                st = p.stat()
+                entries.append((st.st_mtime_ns, p, st.st_size))
+        entries.sort()
+        self._lru = OrderedDict((p, size) for _, p, size in entries)
+        self._total = sum(size for _, _, size in entries)
+
+    def touch(self, path: Path):
+        with self._lock:
+            if self._lru is None:
+                self._scan()
+            if path in self._lru:
+                self._lru.move_to_end(path)
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    def added(self, path: Path, size: int):
+        with self._lock:
+            if self._lru is None:
+                self._scan()
+            self._total += size - self._lru.pop(path, 0)
+            self._lru[path] = size
+            while self._total > self.max_bytes and len(self._lru) > 1:
+                old, old_size = self._lru.popitem(last=False)
+                self._total -= old_size
+                try:
+                    old.unlink()
+                except OSError:
+                    pass
+
+    def removed(self, path: Path):
+        """Delete a thumbnail whose original is gone."""
+        with self._lock:
+            if self._lru is not None:
+                self._total -= self._lru.pop(path, 0)
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+    def get(self, image_id: str, size: int) -> Optional[Path]:
+        path = _shard(self.root, image_id) / f"{image_id}_{size}.webp"
+        if path.exists():
+            self.touch(path)
+            return path
+        with self._lock:
+            build_lock = self._building.setdefault(path, threading.Lock())
+        with build_lock:
+            if not path.exists():
+                src = original_path(image_id)
+                if src is None:
+                    return None
+                data = _render(src, size)
+                _write_atomic(path, data)
+                self.added(path, len(data))
+        with self._lock:
+            self._building.pop(path, None)
+        return path
+
+
+def _render(src: Path, size: int) -> bytes:
+    with Image.open(src) as im:
+        im.draft("RGB", (size, size))           # reduced JPEG decode
+        im = ImageOps.exif_transpose(im).convert("RGB")
+        im.thumbnail((size, size), Image.LANCZOS)
+        buf = io.BytesIO()
+        im.save(buf, "WEBP", quality=80, method=4)
+        return buf.getvalue()
+
+
+THUMBS = ThumbCache()
+
+
+def thumbnail(image_id: str, size: int) -> Optional[Path]:
+    """Path to the WebP thumbnail (rendered on first use), or None if the image is unknown."""
+    if not is_valid_id(image_id) or size not in THUMB_SIZES:
+        return None
+    try:
+        return THUMBS.get(image_id, size)
+    except Exception as e:
+        print("⚠️ Thumbnail render failed:", image_id, e, file=sys.stderr)
+        return None
@@ -1,17 +1,29 @@
 # backend/infer.py
+import hashlib
 import io
+import os
+import threading
 from pathlib import Path
+import numpy as np
 import torch
 import torchvision.transforms as T
 from PIL import Image
 import torch.nn as nn
 import torchvision.models as models
 import sys
+import time
 from typing import Dict
 
+from metrics import INFERENCE_STAGE_SECONDS
+
 ROOT = Path(__file__).resolve().parent
 # The training saved file name is best_regressor.pth, so point to it
 MODEL_PATH = ROOT / "outputs" / "best_regressor.pth"
+# seconds between checks for a new best_regressor.pth (0 disables the watcher)
+MODEL_WATCH_INTERVAL = float(os.getenv("MODEL_WATCH_INTERVAL", "10"))
+# extra checkpoints averaged with the active model in the "ensemble" tier
+ENSEMBLE_DIR = ROOT / "outputs" / "ensemble"
+ENSEMBLE_MAX_MODELS = int(os.getenv("ENSEMBLE_MAX_MODELS", "3"))   # including the active model
 
 DEVICE = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
@@ -45,11 +57,19 @@ TF = T.Compose([
 ])
 
 # ---- Load model helper ----
-def load_model():
-    if not MODEL_PATH.exists():
-        raise FileNotFoundError(f"MODEL WEIGHTS NOT FOUND: {MODEL_PATH}. Train model first.")
+def _file_signature(path: Path):
+    st = path.stat()
+    return (st.st_mtime_ns, st.st_size)
+
+
+def load_model(path: Path = MODEL_PATH):
+    """Load weights from `path`; returns (model, version) where version is a short content hash."""
+    if not path.exists():
+        raise FileNotFoundError(f"MODEL WEIGHTS NOT FOUND: {path}. Train model first.")
+    raw = path.read_bytes()
+    version = hashlib.sha256(raw).hexdigest()[:12]
     model = MoistureVSRegressor()
-    ckpt = torch.load(MODEL_PATH, map_location=DEVICE)
+    ckpt = torch.load(io.BytesIO(raw), map_location=DEVICE)
     # ckpt might be state_dict or a dict with model_state
     if isinstance(ckpt, dict) and ("model_state" in ckpt or "state_dict" in ckpt):
         st = ckpt.get("model_state") or ckpt.get("state_dict")
@@ -58,34 +78,125 @@ def load_model():
         model.load_state_dict(ckpt)
     model.to(DEVICE)
     model.eval()
-    print(f"✅ Loaded model weights from: {MODEL_PATH} on device {DEVICE}", file=sys.stderr)
-    return model
+    print(f"✅ Loaded model weights from: {path} (version {version}) on device {DEVICE}", file=sys.stderr)
+    return model, version
 
-# Load once at import time (so server fails fast if file missing)
+
+def warmup(model, batch: int = 1):
+    """Run a dummy batch so the first real request doesn't pay allocator/kernel setup."""
+    with torch.no_grad():
+        model(torch.zeros(batch, 3, 320, 320, device=DEVICE))
+
+
+# Active model and its version are swapped together as one tuple, so a request
+# that grabbed the old tuple finishes on the old model while new ones use the new.
 MODEL = None
+MODEL_VERSION = None
 LOAD_ERR = None
-try:
-    MODEL = load_model()
-except Exception as e:
-    LOAD_ERR = e
-    MODEL = None
-    print("⚠️ Model load error:", e, file=sys.stderr)
+_ACTIVE = None              # (model, version, file signature)
+_RELOAD_LOCK = threading.Lock()
 
-# ---- Inference function used by main.py ----
-def predict_from_bytes(image_bytes: bytes) -> Dict[str, float]:
+
+def set_model(model, version: str, signature=None):
+    global _ACTIVE, MODEL, MODEL_VERSION, LOAD_ERR
+    _ACTIVE = (model, version, signature)
+    MODEL, MODEL_VERSION, LOAD_ERR = model, version, None
+
+
+def reload_model(force: bool = False) -> Dict:
     """
-    Accepts raw image bytes and returns:
-      {"moisture_percent": float, "vs_fraction": float}
+    Load MODEL_PATH if it changed since the active model was loaded, warm it up
+    and swap it in. Loading happens in the caller's thread while the old model
+    keeps serving. A failed load leaves the active model in place.
     """
-    if MODEL is None:
-        raise FileNotFoundError(f"Model not loaded: {LOAD_ERR}")
+    global LOAD_ERR
+    with _RELOAD_LOCK:
+        active = _ACTIVE
+        try:
+            sig = _file_signature(MODEL_PATH)
+        except FileNotFoundError as e:
+            if active is None:
+                LOAD_ERR = FileNotFoundError(f"MODEL WEIGHTS NOT FOUND: {MODEL_PATH}. Train model first.")
+            return {"reloaded": False, "version": MODEL_VERSION, "error": str(e)}
+        if not force and active is not None and active[2] == sig:
+            return {"reloaded": False, "version": active[1]}
+        try:
+            model, version = load_model(MODEL_PATH)
+            warmup(model)
+        except Exception as e:
+            print("⚠️ Model reload failed, keeping current model:", e, file=sys.stderr)
+            if active is None:
+                LOAD_ERR = e
+            return {"reloaded": False, "version": MODEL_VERSION, "error": str(e)}
+        previous = active[1] if active else None
+        set_model(model, version, sig)
+        return {"reloaded": True, "version": version, "previous_version": previous}
+
+
+def model_info() -> Dict:
+    active = _ACTIVE
+    return {
+        "version": active[1] if active else None,
+        "path": str(MODEL_PATH),
+        "loaded": active is not None,
+        "error": None if active else str(LOAD_ERR),
+        "watch_interval_s": MODEL_WATCH_INTERVAL,
+    }
+
+
+# ---- Background watcher for outputs/best_regressor.pth ----
+# train_regression.py replaces the file atomically, so a changed signature
+# always points at a complete checkpoint.
+_WATCHER = None
+
+
+def _watch_loop(stop: threading.Event, interval: float):
+    while not stop.wait(interval):
+        try:
+            reload_model()
+        except Exception as e:
+            print("⚠️ Model watcher error:", e, file=sys.stderr)
+
+
+def start_model_watcher(interval: float = None):
+    """Start the polling thread (no-op if disabled with MODEL_WATCH_INTERVAL=0 or already running)."""
+    global _WATCHER
+    interval = MODEL_WATCH_INTERVAL if interval is None else interval
+    if interval <= 0 or _WATCHER is not None:
+        return
+    stop = threading.Event()
+    t = threading.Thread(target=_watch_loop, args=(stop, interval), name="model-watcher", daemon=True)
+    t.start()
+    _WATCHER = (t, stop)
+
+
+def stop_model_watcher():
+    global _WATCHER
+    if _WATCHER is not None:
+        _WATCHER[1].set()
+        _WATCHER = None
+
+
+# Load once at import time (so server fails fast if file missing)
+if reload_model(force=True).get("error"):
+    print("⚠️ Model load error:", LOAD_ERR, file=sys.stderr)
+
+# ---- Inference stages (split out so they can be timed individually) ----
+def decode_image(image_bytes: bytes) -> Image.Image:
+    return Image.open(io.BytesIO(image_bytes)).convert("RGB")
+
 
-    img = Image.open(io.BytesIO(image_bytes)).convert("RGB")
-    x = TF(img).unsqueeze(0).to(DEVICE)
+def preprocess(img: Image.Image) -> torch.Tensor:
+    return TF(img).unsqueeze(0).to(DEVICE)
 
+
+def forward(x: torch.Tensor, model=None):
+    model = model if model is not None else MODEL
     with torch.no_grad():
-        out = MODEL(x).cpu().numpy()[0]
+        return model(x).cpu().numpy()[0]
+
 
+def postprocess(out) -> Dict[str, float]:
     # training outputs: [moisture, vs]
     moisture = float(out[0])
     vs = float(out[1])
@@ -99,3 +210,133 @@ def predict_from_bytes(image_bytes: bytes) -> Dict[str, float]:
         "moisture_percent": round(moisture, 2),
         "vs_fraction": round(vs, 3)
     }
+
+
+# ---- Test-time augmentation / ensemble tiers ----
+# Each tier is a fixed cost bound: `views` TTA views stacked into one batch,
+# run once per model (the active model, plus ENSEMBLE_DIR checkpoints for "ensemble").
+TIERS = {
+    "fast": {"views": 1, "ensemble": False},
+    "accurate": {"views": 4, "ensemble": False},
+    "ensemble": {"views": 2, "ensemble": True},
+}
+DEFAULT_TIER = "fast"
+
+# prediction spread that maps to confidence 0.5 (moisture in %, VS as fraction)
+_SPREAD_SCALE = (5.0, 0.05)
+_CROP_FRACTION = 0.9
+
+
+def preprocess_views(img: Image.Image, views: int) -> torch.Tensor:
+    """
+    Up to 4 views as one (views, 3, H, W) batch: full image, its mirror,
+    a 90% center crop and that crop's mirror. Flips are done on the tensor,
+    so only two resizes are paid for four views.
+    """
+    full = TF(img)
+    batch = [full]
+    if views > 1:
+        batch.append(full.flip(-1))
+    if views > 2:
+        w, h = img.size
+        dx, dy = int(w * (1 - _CROP_FRACTION) / 2), int(h * (1 - _CROP_FRACTION) / 2)
+        crop = TF(img.crop((dx, dy, w - dx, h - dy)))
+        batch.append(crop)
+        if views > 3:
+            batch.append(crop.flip(-1))
+    return torch.stack(batch[:views]).to(DEVICE)
+
+
+def forward_batch(x: torch.Tensor, models_) -> np.ndarray:
+    """(n_models * n_views, 2) raw outputs, one batched forward per model."""
+    with torch.no_grad():
+        return torch.cat([m(x) for m in models_]).cpu().numpy()
+
+
+def aggregate(outs) -> Dict:
+    """Mean prediction over views/models plus a spread-based confidence in (0, 1]."""
+    result = postprocess(outs.mean(axis=0))
+    if len(outs) < 2:
+        result.update({"confidence": None, "spread": None})
+        return result
+    std = outs.std(axis=0)
+    spread = (float(std[0]) / _SPREAD_SCALE[0] + float(std[1]) / _SPREAD_SCALE[1]) / 2
+    result.update({
+        "confidence": round(1.0 / (1.0 + spread), 3),
+        "spread": {"moisture_percent": round(float(std[0]), 3), "vs_fraction": round(float(std[1]), 4)},
+    })
+    return result
+
+
+_ENSEMBLE = None            # (dir signature, [(model, version), ...])
+_ENSEMBLE_LOCK = threading.Lock()
+
+
+def _ensemble_signature():
+    if not ENSEMBLE_DIR.is_dir():
+        return ()
+    return tuple(sorted((p.name,) + _file_signature(p) for p in ENSEMBLE_DIR.glob("*.pth")))
+
+
+def ensemble_members():
+    """Extra checkpoints from ENSEMBLE_DIR, (re)loaded when the directory contents change."""
+    global _ENSEMBLE
+    sig = _ensemble_signature()
+    cached = _ENSEMBLE
+    if cached is not None and cached[0] == sig:
+        return cached[1]
+    with _ENSEMBLE_LOCK:
+        if _ENSEMBLE is not None and _ENSEMBLE[0] == sig:
+            return _ENSEMBLE[1]
+        members = []
+        for name in sorted(n for n, *_ in sig)[:max(ENSEMBLE_MAX_MODELS - 1, 0)]:
+            try:
+                members.append(load_model(ENSEMBLE_DIR / name))
+            except Exception as e:
+                print("⚠️ Skipping ensemble checkpoint", name, e, file=sys.stderr)
+        _ENSEMBLE = (sig, members)
+        return members
+
+
+# ---- Inference function used by main.py ----
+def predict_from_bytes(image_bytes: bytes, tier: str = DEFAULT_TIER) -> Dict:
+    """
+    Accepts raw image bytes and returns:
+      {"moisture_percent": float, "vs_fraction": float, "model_version": str,
+       "tier": str, "views": int, "models": int, "confidence": float|None, "spread": dict|None}
+    """
+    if tier not in TIERS:
+        raise ValueError(f"Unknown tier {tier!r}; expected one of {sorted(TIERS)}")
+    active = _ACTIVE
+    if active is None:
+        raise FileNotFoundError(f"Model not loaded: {LOAD_ERR}")
+    model, version = active[0], active[1]
+    spec = TIERS[tier]
+
+    t0 = time.perf_counter()
+    img = decode_image(image_bytes)
+    t1 = time.perf_counter()
+    if spec["views"] == 1:
+        x = preprocess(img)
+    else:
+        x = preprocess_views(img, spec["views"])
+    t2 = time.perf_counter()
+    models_ = [model]
+    if spec["ensemble"]:
+        models_ += [m for m, v in ensemble_members() if v != version]
+    if len(models_) == 1 and spec["views"] == 1:
+        result = postprocess(forward(x, model))
+        result.update({"confidence": None, "spread": None})
+        t3 = time.perf_counter()
+    else:
+        outs = forward_batch(x, models_)
+        t3 = time.perf_counter()
+        result = aggregate(outs)
+    result.update({"model_version": version, "tier": tier, "views": spec["views"], "models": len(models_)})
+    t4 = time.perf_counter()
+
+    INFERENCE_STAGE_SECONDS.observe(t1 - t0, "decode")
+    INFERENCE_STAGE_SECONDS.observe(t2 - t1, "transform")
+    INFERENCE_STAGE_SECONDS.observe(t3 - t2, "forward")
+    INFERENCE_STAGE_SECONDS.observe(t4 - t3, "postprocess")
+    return result
@@ -1,11 +1,11 @@
-import json
 import os
 import sys
+import time
 from pathlib import Path
 from fastapi import FastAPI, File, UploadFile, Form
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from typing import Dict
+from starlette.concurrency import run_in_threadpool
 
 # backend root (this file lives in backend/)
 ROOT = Path(__file__).resolve().parent
@@ -14,64 +14,78 @@ ROOT = Path(__file__).resolve().parent
 # Import Database Init
 # --------------------------
 try:
-    from database import init_db
+    from database import init_db, engine, SessionLocal, Record
 except Exception:
     # fallback: ensure backend is on sys.path then retry
     sys.path.append(str(ROOT))
-    from database import init_db
+    from database import init_db, engine, SessionLocal, Record
 
 # --------------------------
-# Import Routers
+# Import Metrics
 # --------------------------
-# Expect routes to exist at backend/routes/{auth.py, farmer.py, admin.py, orders.py}
 try:
-    from routes import farmer, admin, auth, orders
+    import metrics
 except Exception:
     sys.path.append(str(ROOT))
-    from routes import farmer, admin, auth, orders
+    import metrics
 
 # --------------------------
-# Import ML inference
+# Import near-duplicate index
 # --------------------------
 try:
-    from infer import predict_from_bytes
+    import dedup
 except Exception:
     sys.path.append(str(ROOT))
-    from infer import predict_from_bytes
+    import dedup
 
 # --------------------------
-# Configuration (data/config.json)
+# Import input-quality gate
 # --------------------------
-DATA_DIR = ROOT / "data"
-CONFIG_PATH = DATA_DIR / "config.json"
+try:
+    import quality
+except Exception:
+    sys.path.append(str(ROOT))
+    import quality
 
-FALLBACK_CONFIG: Dict[str, float] = {
-    "PRICE_PER_M3": 50.0,
-    "DEFAULT_YIELD_PER_KGVS": 0.20,
-    "DEFAULT_METHANE_FRACTION": 0.55,
-}
+# --------------------------
+# Import upload image store
+# --------------------------
+try:
+    import image_store
+except Exception:
+    sys.path.append(str(ROOT))
+    import image_store
 
+# --------------------------
+# Import Routers
+# --------------------------
+# Expect routes to exist at backend/routes/{auth.py, farmer.py, admin.py, orders.py, images.py, stats.py, search.py, stream.py}
+try:
+    from routes import farmer, admin, auth, orders, images, stats as stats_routes, search as search_routes, stream, exports as export_routes
+except Exception:
+    sys.path.append(str(ROOT))
+    from routes import farmer, admin, auth, orders, images, stats as stats_routes, search as search_routes, stream, exports as export_routes
 
-def load_config() -> Dict[str, float]:
-    """
-    Load JSON config from data/config.json. If missing, create default file.
-    Returns a dict with keys PRICE_PER_M3, DEFAULT_YIELD_PER_KGVS, DEFAULT_METHANE_FRACTION.
-    """
-    try:
-        if not CONFIG_PATH.exists():
-            DATA_DIR.mkdir(parents=True, exist_ok=True)
-            CONFIG_PATH.write_text(json.dumps(FALLBACK_CONFIG, indent=4), encoding="utf-8")
-            return FALLBACK_CONFIG.copy()
+# --------------------------
+# Import ML inference
+# --------------------------
+try:
+    from infer import predict_from_bytes, start_model_watcher, stop_model_watcher, TIERS, DEFAULT_TIER
+except Exception:
+    sys.path.append(str(ROOT))
+    from infer import predict_from_bytes, start_model_watcher, stop_model_watcher, TIERS, DEFAULT_TIER
 
-        raw = CONFIG_PATH.read_text(encoding="utf-8")
-        cfg = json.loads(raw)
-        # ensure keys exist and have sensible defaults
-        for k, v in FALLBACK_CONFIG.items():
-            if k not in cfg:
-                cfg[k] = v
-        return cfg
-    except Exception:
-        return FALLBACK_CONFIG.copy()
+# --------------------------
+# Biogas yield engine (data/config.json + data/yield_params.json)
+# --------------------------
+try:
+    import yield_engine
+except Exception:
+    sys.path.append(str(ROOT))
+    import yield_engine
+
+load_config = yield_engine.load_config
+FALLBACK_CONFIG = yield_engine.FALLBACK_CONFIG
 
 
 # --------------------------
@@ -87,8 +101,16 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Idempotent-Replayed"],
 )
 
+# Per-route latency / status / DB-query metrics, exposed at /metrics
+app.add_middleware(metrics.MetricsMiddleware)
+try:
+    metrics.instrument_engine(engine)
+except Exception as e:
+    print("⚠️ Failed to instrument DB engine:", e, file=sys.stderr)
+
 # Initialize DB/tables and ensure default config row exists
 try:
     init_db()
@@ -96,6 +118,79 @@ except Exception as e:
     # don't crash the process — print error and continue (errors will surface in logs)
     print("⚠️ init_db() error:", e, file=sys.stderr)
 
+# Build marketplace aggregates for databases created before market_stats existed
+try:
+    import stats
+    _db = SessionLocal()
+    try:
+        stats.ensure_built(_db)
+    finally:
+        _db.close()
+except Exception as e:
+    print("⚠️ market_stats build error:", e, file=sys.stderr)
+
+
+# Full-text index for /api/v1/search (FTS5 on SQLite, FULLTEXT on MySQL)
+try:
+    import search
+    search.ensure_index(engine)
+except Exception as e:
+    print("⚠️ Search index error:", e, file=sys.stderr)
+
+# The admin page edits the DB config row; older deployments may have a stale
+# data/config.json, which is what yield_engine prices with. DB wins.
+try:
+    from database import Config
+    _db = SessionLocal()
+    try:
+        _row = _db.query(Config).first()
+        if _row is not None:
+            _db_cfg = {"PRICE_PER_M3": _row.price_per_m3, "DEFAULT_YIELD_PER_KGVS": _row.default_yield_per_kgvs,
+                       "DEFAULT_METHANE_FRACTION": _row.default_methane_fraction}
+            if any(float(load_config()[k]) != float(v) for k, v in _db_cfg.items()):
+                yield_engine.save_config(_db_cfg)
+                print("✅ Synced data/config.json with the DB config row.")
+    finally:
+        _db.close()
+except Exception as e:
+    print("⚠️ Config sync error:", e, file=sys.stderr)
+
+
+# Pick up retrained weights (backend/outputs/best_regressor.pth) without a restart
+@app.on_event("startup")
+def _start_model_watcher():
+    start_model_watcher()
+
+
+# Finish a repricing job that was interrupted by a restart
+@app.on_event("startup")
+def _resume_repricing():
+    try:
+        import repricing
+        repricing.resume_pending()
+    except Exception as e:
+        print("⚠️ Failed to resume repricing:", e, file=sys.stderr)
+
+
+# Originals that no record refers to are deleted after IMAGE_ORIGINAL_TTL_DAYS
+def _referenced_images(ids):
+    db = SessionLocal()
+    try:
+        rows = db.query(Record.image_id).filter(Record.image_id.in_(list(ids))).distinct().all()
+        return {r[0] for r in rows}
+    finally:
+        db.close()
+
+
+@app.on_event("startup")
+def _collect_images():
+    image_store.maybe_collect_garbage(_referenced_images)
+
+
+@app.on_event("shutdown")
+def _stop_model_watcher():
+    stop_model_watcher()
+
 
 # ====================================================
 # PREDICTION ENDPOINT
@@ -106,6 +201,9 @@ async def predict(
     fresh_dried: str = Form("fresh"),
     measured_weight: float = Form(None),
     scale_feat: float = Form(0.0),
+    tier: str = Form(DEFAULT_TIER),
+    check_quality: bool = Form(True),
+    crop: str = Form(None),
 ):
     """
     Multipart/form-data:
@@ -113,25 +211,77 @@ async def predict(
       - fresh_dried: optional (string)
       - measured_weight: optional float (if provided it is used as mass_kg)
       - scale_feat: optional numeric (for future use)
+      - tier: optional "fast" (default, single view), "accurate" (4 TTA views in one
+        batch) or "ensemble" (2 views x active + outputs/ensemble/*.pth checkpoints)
+      - check_quality: optional bool (default true); blurry, badly exposed or
+        non-residue photos are rejected with 422 and retake advice before inference
+      - crop: optional crop key from data/yield_params.json (default: its default_crop)
 
     Returns predicted moisture & VS (from the model) and derived biogas & revenue
     computed using the measured_weight supplied by farmer (measured takes precedence).
     """
+    if tier not in TIERS:
+        return JSONResponse(status_code=400, content={"error": f"Unknown tier '{tier}'. Use one of: {', '.join(TIERS)}"})
+    try:
+        yield_engine.table().crop_ids([crop])
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
     # 1) read image bytes
     try:
+        t0 = time.perf_counter()
         contents = await image.read()
+        metrics.INFERENCE_STAGE_SECONDS.observe(time.perf_counter() - t0, "read")
     except Exception as e:
         return JSONResponse(status_code=400, content={"error": f"Failed to read uploaded image: {e}"})
 
+    # 1b) cheap quality gate on a tiny copy, before the heavy model
+    gate = None
+    if quality.ENABLED and check_quality:
+        try:
+            t0 = time.perf_counter()
+            gate = await run_in_threadpool(quality.assess, contents)
+            metrics.INFERENCE_STAGE_SECONDS.observe(time.perf_counter() - t0, "quality")
+        except Exception as e:
+            return JSONResponse(status_code=400, content={"error": f"Uploaded file is not a readable image: {e}"})
+        if not gate["ok"]:
+            for r in gate["reasons"]:
+                metrics.QUALITY_REJECTIONS.inc(r)
+            return JSONResponse(status_code=422, content={
+                "error": "Image rejected by quality check: " + ", ".join(gate["reasons"]),
+                "reasons": gate["reasons"],
+                "feedback": gate["feedback"],
+                "quality": gate["scores"],
+            })
+
     # 2) run inference (predict_from_bytes should return {"moisture_percent":..., "vs_fraction":...})
+    #    in the threadpool: accurate / ensemble tiers take hundreds of ms and would stall the
+    #    event loop (every other request and the live stock feed) for that long
     try:
-        preds = predict_from_bytes(contents)
+        preds = await run_in_threadpool(predict_from_bytes, contents, tier)
     except FileNotFoundError as fe:
         # model weights missing / model not loaded
         return JSONResponse(status_code=500, content={"error": f"Inference error: {fe}"})
     except Exception as e:
         return JSONResponse(status_code=500, content={"error": f"Inference error: {e}"})
 
+    # 2b) flag near-duplicates of dataset images / earlier uploads (never blocks the prediction)
+    try:
+        t0 = time.perf_counter()
+        dup = await run_in_threadpool(dedup.UPLOADS.check_and_add, contents)
+        metrics.INFERENCE_STAGE_SECONDS.observe(time.perf_counter() - t0, "dedup")
+    except Exception as e:
+        print("⚠️ Duplicate check failed:", e, file=sys.stderr)
+        dup = {"phash": None, "near_duplicate": None}
+
+    # 2c) keep the upload (content-addressed) so records can show it later
+    try:
+        image_id = await run_in_threadpool(image_store.put, contents)
+        image_store.maybe_collect_garbage(_referenced_images)
+    except Exception as e:
+        print("⚠️ Failed to store uploaded image:", e, file=sys.stderr)
+        image_id = None
+
     # 3) mass: prefer measured_weight entered by farmer (if provided)
     mass_kg = float(measured_weight) if measured_weight is not None else 0.0
 
@@ -139,36 +289,40 @@ async def predict(
     moisture = preds.get("moisture_percent", 0.0)
     vs = preds.get("vs_fraction", 0.0)
 
-    # 5) load current admin-config (so admin edits take effect immediately)
-    cfg = load_config()
-    PRICE_PER_M3 = float(cfg.get("PRICE_PER_M3", FALLBACK_CONFIG["PRICE_PER_M3"]))
-    YIELD_PER_KGVS = float(cfg.get("DEFAULT_YIELD_PER_KGVS", FALLBACK_CONFIG["DEFAULT_YIELD_PER_KGVS"]))
-    METHANE_FRACTION = float(cfg.get("DEFAULT_METHANE_FRACTION", FALLBACK_CONFIG["DEFAULT_METHANE_FRACTION"]))
-
-    # 6) derived computations (use measured weight + ML-predicted VS)
-    biogas_m3 = round(mass_kg * vs * YIELD_PER_KGVS, 3) if (mass_kg and vs) else 0.0
-    methane_m3 = round(biogas_m3 * METHANE_FRACTION, 3)
-    revenue = round(biogas_m3 * PRICE_PER_M3, 2)
+    # 5) biogas / methane / revenue from the current admin config and per-crop yield table
+    est = yield_engine.estimate(mass_kg, vs, moisture, crop)
 
-    # 7) form response
+    # 6) form response
     response = {
-        "crop": "banana",
+        "crop": est["crop"],
         "mass_kg": round(mass_kg, 3),
         "mass_source": "measured" if measured_weight is not None else "none",
         "moisture_percent": moisture,
         "vs_fraction": vs,
-        "predicted_m3_biogas": biogas_m3,
-        "predicted_m3_ch4": methane_m3,
-        "price_per_m3": PRICE_PER_M3,
-        "revenue_estimate": revenue,
+        "moisture_band": est["moisture_band"],
+        "yield_per_kgvs": est["yield_per_kgvs"],
+        "methane_fraction": est["methane_fraction"],
+        "predicted_m3_biogas": est["predicted_m3_biogas"],
+        "predicted_m3_ch4": est["predicted_m3_ch4"],
+        "price_per_m3": est["price_per_m3"],
+        "revenue_estimate": est["revenue_estimate"],
+        "yield_params_version": est["yield_params_version"],
         "recommendation": ("Chop <20mm" if vs and vs > 0.6 else "Dry slightly before feed"),
+        "model_version": preds.get("model_version"),
+        "tier": preds.get("tier"),
+        "confidence": preds.get("confidence"),
+        "prediction_spread": preds.get("spread"),
+        "quality": gate["scores"] if gate else None,
+        "image_phash": dup["phash"],
+        "near_duplicate": dup["near_duplicate"],
+        "image_id": image_id,
     }
 
     return response
 
 
 # --------------------------
-# Include route modules (auth, farmer, admin, orders)
+# Include route modules (auth, farmer, admin, orders, images, stats, search, stream, exports)
 # --------------------------
 # Each router should define paths under /api/v1/...
 try:
@@ -191,6 +345,39 @@ try:
 except Exception as e:
     print("⚠️ Failed to include orders router:", e, file=sys.stderr)
 
+try:
+    app.include_router(images.router)
+except Exception as e:
+    print("⚠️ Failed to include images router:", e, file=sys.stderr)
+
+try:
+    app.include_router(stats_routes.router)
+except Exception as e:
+    print("⚠️ Failed to include stats router:", e, file=sys.stderr)
+
+try:
+    app.include_router(search_routes.router)
+except Exception as e:
+    print("⚠️ Failed to include search router:", e, file=sys.stderr)
+
+try:
+    app.include_router(stream.router)
+except Exception as e:
+    print("⚠️ Failed to include stream router:", e, file=sys.stderr)
+
+try:
+    app.include_router(export_routes.router)
+except Exception as e:
+    print("⚠️ Failed to include export router:", e, file=sys.stderr)
+
+
+# --------------------------
+# Metrics (Prometheus text format)
+# --------------------------
+@app.get("/metrics", include_in_schema=False)
+def metrics_endpoint():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
 
 # --------------------------
 # Root / health check
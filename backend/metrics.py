@@ -0,0 +1,265 @@
+# backend/metrics.py
+"""
+Small in-process metrics registry rendered in the Prometheus text format.
+
+Kept dependency-free and cheap enough to leave on in production: every
+observation is a bisect over a fixed bucket list plus a few additions under
+a per-metric lock. Labels are passed positionally in `labelnames` order.
+
+    from metrics import INFERENCE_STAGE_SECONDS
+    INFERENCE_STAGE_SECONDS.observe(0.012, "decode")
+"""
+import bisect
+import threading
+import time
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# seconds; covers sub-millisecond DB queries up to slow multi-second uploads
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, doc: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount: float = 1.0):
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0.0) + amount
+
+    def get(self, *labelvalues) -> float:
+        return self._values.get(labelvalues, 0.0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, v in items:
+            lines.append(f"{self.name}{_labels(self.labelnames, key)} {v}")
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, value: float, *labelvalues):
+        with self._lock:
+            self._values[labelvalues] = value
+
+    def dec(self, *labelvalues, amount: float = 1.0):
+        self.inc(*labelvalues, amount=-amount)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, doc: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # key -> [per-bucket counts..., +Inf count, sum]
+        self._series: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(labelvalues)
+            if s is None:
+                s = self._series[labelvalues] = [0] * (len(self.buckets) + 1) + [0.0]
+            s[i] += 1
+            s[-1] += value
+
+    def time(self, *labelvalues):
+        return _Timer(self, labelvalues)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.doc}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._series.items())
+        for key, s in items:
+            cum = 0
+            for b, c in zip(self.buckets, s):
+                cum += c
+                le = 'le="%s"' % b
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cum}")
+            cum += s[len(self.buckets)]
+            le = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_labels(self.labelnames, key, le)} {cum}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {s[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cum}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("hist", "labels", "t0")
+
+    def __init__(self, hist: Histogram, labels: Tuple):
+        self.hist = hist
+        self.labels = labels
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.t0, *self.labels)
+        return False
+
+
+# --------------------------
+# Registry
+# --------------------------
+REGISTRY: List = []
+
+
+def _register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+
+HTTP_REQUESTS = _register(Counter(
+    "agrogas_http_requests_total", "HTTP requests by route template and status.", ("method", "route", "status")))
+HTTP_LATENCY = _register(Histogram(
+    "agrogas_http_request_duration_seconds", "HTTP request latency by route template.", ("method", "route")))
+INFERENCE_STAGE_SECONDS = _register(Histogram(
+    "agrogas_inference_stage_seconds", "Time spent per prediction stage.", ("stage",)))
+DB_QUERY_SECONDS = _register(Histogram(
+    "agrogas_db_query_duration_seconds", "Duration of individual SQL statements.", ("statement",)))
+DB_QUERIES_PER_REQUEST = _register(Histogram(
+    "agrogas_db_queries_per_request", "Number of SQL statements issued per HTTP request.", ("route",),
+    buckets=COUNT_BUCKETS))
+DB_TIME_PER_REQUEST = _register(Histogram(
+    "agrogas_db_time_per_request_seconds", "Total SQL time per HTTP request.", ("route",)))
+DB_POOL_CHECKOUT_SECONDS = _register(Histogram(
+    "agrogas_db_pool_checkout_seconds", "Time waiting to check a connection out of the pool."))
+QUALITY_REJECTIONS = _register(Counter(
+    "agrogas_quality_rejections_total", "Uploads rejected by the input-quality gate, by reason.", ("reason",)))
+STREAM_SUBSCRIBERS = _register(Gauge(
+    "agrogas_stream_subscribers", "Open live-feed (SSE) connections."))
+STREAM_EVENTS = _register(Counter(
+    "agrogas_stream_events_total", "Live-feed events by outcome (published/coalesced/overflow).", ("outcome",)))
+IDEMPOTENCY_REQUESTS = _register(Counter(
+    "agrogas_idempotency_requests_total", "Keyed POSTs by scope and outcome (new/replayed/conflict).",
+    ("scope", "outcome")))
+CACHE_REQUESTS = _register(Counter(
+    "agrogas_cache_requests_total", "Cache lookups by cache name and result (hit/miss).", ("cache", "result")))
+
+
+def cache_hit(name: str):
+    CACHE_REQUESTS.inc(name, "hit")
+
+
+def cache_miss(name: str):
+    CACHE_REQUESTS.inc(name, "miss")
+
+
+def render() -> str:
+    lines: List[str] = []
+    for m in REGISTRY:
+        lines.extend(m.render())
+
+    # derived gauge so dashboards don't need PromQL for the ratio
+    caches = sorted({k[0] for k in list(CACHE_REQUESTS._values)})
+    if caches:
+        lines.append("# HELP agrogas_cache_hit_ratio Hits / lookups since process start.")
+        lines.append("# TYPE agrogas_cache_hit_ratio gauge")
+        for c in caches:
+            hits, misses = CACHE_REQUESTS.get(c, "hit"), CACHE_REQUESTS.get(c, "miss")
+            total = hits + misses
+            lines.append(f'agrogas_cache_hit_ratio{{cache="{_escape(c)}"}} {hits / total if total else 0.0}')
+    return "\n".join(lines) + "\n"
+
+
+# --------------------------
+# Per-request DB accounting
+# --------------------------
+# [query count, query seconds] for the current HTTP request; the list is shared
+# with the threadpool that runs sync endpoints because contextvars are copied.
+_REQUEST_DB: ContextVar[Optional[list]] = ContextVar("agrogas_request_db", default=None)
+
+
+def instrument_engine(engine):
+    """Attach SQLAlchemy event hooks for query timing and pool checkout waits."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        dt = time.perf_counter() - conn.info["query_start_time"].pop()
+        verb = statement.lstrip()[:6].upper()
+        DB_QUERY_SECONDS.observe(dt, verb if verb in ("SELECT", "INSERT", "UPDATE", "DELETE") else "OTHER")
+        acc = _REQUEST_DB.get()
+        if acc is not None:
+            acc[0] += 1
+            acc[1] += dt
+
+    # Pool events fire only after a connection was obtained, so time the
+    # pool's connect() call itself to capture waits on an exhausted pool.
+    pool = engine.pool
+    pool_connect = pool.connect
+
+    def timed_connect():
+        t0 = time.perf_counter()
+        try:
+            return pool_connect()
+        finally:
+            DB_POOL_CHECKOUT_SECONDS.observe(time.perf_counter() - t0)
+
+    pool.connect = timed_connect
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware (no BaseHTTPMiddleware overhead) recording per-route metrics."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = [500]
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            await send(message)
+
+        acc = [0, 0.0]
+        token = _REQUEST_DB.set(acc)
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            dt = time.perf_counter() - t0
+            _REQUEST_DB.reset(token)
+            # use the matched route template, never the raw path (unbounded cardinality)
+            route = getattr(scope.get("route"), "path", "<unmatched>")
+            method = scope.get("method", "")
+            HTTP_REQUESTS.inc(method, route, status[0])
+            HTTP_LATENCY.observe(dt, method, route)
+            DB_QUERIES_PER_REQUEST.observe(acc[0], route)
+            DB_TIME_PER_REQUEST.observe(acc[1], route)
@@ -0,0 +1,119 @@
+# backend/ordering.py
+"""
+Stock reservation and order creation, shared by POST /api/v1/orders and the
+allocation engine (allocation.py).
+
+reserve() takes stock with one conditional UPDATE,
+
+    UPDATE records SET available_kg = COALESCE(available_kg, mass_kg) - :qty
+    WHERE id = :id AND COALESCE(available_kg, mass_kg) >= :qty
+
+so the check and the decrement are a single statement and two buyers can
+never both take the last kilos. This holds on SQLite too, where the
+SELECT ... FOR UPDATE the order route used to rely on is a no-op.
+
+Callers commit; everything here runs in the caller's transaction:
+
+    order, recs = ordering.create_order(db, "Plant A", "98..", "Town", [(12, 1.5), (15, 2.0)])
+    db.commit()
+"""
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+
+from database import Order, OrderItem, Record
+import stats
+
+_R = Record.__table__
+AVAILABLE = func.coalesce(_R.c.available_kg, _R.c.mass_kg, 0.0)   # NULL available_kg predates stock tracking
+
+
+class RecordNotFound(LookupError):
+    pass
+
+
+class OutOfStock(ValueError):
+    def __init__(self, record_id: int, available: float, requested: float):
+        super().__init__(f"Not enough available quantity for record {record_id} "
+                         f"(avail={available}, requested={requested})")
+        self.record_id = record_id
+        self.available = available
+        self.requested = requested
+
+
+def unit_price(rec) -> float:
+    """₹ per kg: the record's revenue estimate spread over its mass."""
+    if not rec.mass_kg or not rec.revenue_estimate:
+        return 0.0
+    return float(rec.revenue_estimate) / float(rec.mass_kg)
+
+
+def available(db: Session, record_id: int) -> float:
+    """Current stock straight from the database (not the session's copy)."""
+    return float(db.execute(select(AVAILABLE).where(_R.c.id == record_id)).scalar() or 0.0)
+
+
+def reserve(db: Session, rec: Record, qty_kg: float, partial: bool = False) -> float:
+    """
+    Take qty_kg from rec. Returns the kg taken: qty_kg, or with partial=True as
+    much as is left (possibly 0). Without partial, a shortfall raises OutOfStock.
+    """
+    qty = float(qty_kg)
+    for _ in range(3):          # partial: retry with what is left if another buyer got in between
+        if qty <= 0:
+            return 0.0
+        res = db.execute(update(_R).where((_R.c.id == rec.id) & (AVAILABLE >= qty))
+                         .values(available_kg=AVAILABLE - qty))
+        if res.rowcount == 1:
+            db.expire(rec, ["available_kg"])        # reloaded on next access
+            return qty
+        left = available(db, rec.id)
+        if not partial:
+            raise OutOfStock(rec.id, left, qty)
+        qty = min(qty, left)
+    return 0.0
+
+
+def record_order(db: Session, buyer_name: str, buyer_phone: Optional[str], buyer_location: Optional[str],
+                 taken: Sequence[Tuple[Record, float]], status: str = "placed") -> Order:
+    """Order + items + market_stats for stock already taken with reserve()."""
+    lines = []
+    for rec, qty in taken:
+        price = unit_price(rec)
+        lines.append((rec, qty, price, round(price * qty, 2)))
+    order = Order(
+        buyer_name=buyer_name,
+        buyer_phone=buyer_phone,
+        buyer_location=buyer_location,
+        total_price=round(sum(line[3] for line in lines), 2),
+        status=status,
+        created_at=datetime.utcnow(),
+    )
+    db.add(order)
+    db.flush()      # order.id for the items
+    db.add_all([OrderItem(order_id=order.id, record_id=rec.id, qty_kg=qty, unit_price=price, line_total=total)
+                for rec, qty, price, total in lines])
+    for rec, qty, _, total in lines:
+        stats.sale(db, rec, qty, total)
+    stats.order_placed(db)
+    return order
+
+
+def create_order(db: Session, buyer_name: str, buyer_phone: Optional[str], buyer_location: Optional[str],
+                 lines: Sequence[Tuple[int, float]]) -> Tuple[Order, List[Record]]:
+    """
+    Reserve every (record_id, qty_kg) line in full and record the order.
+    Raises RecordNotFound / OutOfStock; the caller rolls back.
+    """
+    ids = {rid for rid, _ in lines}
+    recs: Dict[int, Record] = {r.id: r for r in db.query(Record).filter(Record.id.in_(ids))}
+    taken = []
+    for rid, qty in lines:
+        rec = recs.get(rid)
+        if rec is None:
+            raise RecordNotFound(f"Record {rid} not found")
+        reserve(db, rec, qty)
+        taken.append((rec, qty))
+    return record_order(db, buyer_name, buyer_phone, buyer_location, taken), list(recs.values())
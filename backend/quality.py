@@ -0,0 +1,170 @@
+# backend/quality.py
+"""
+Cheap input-quality gate that runs before the regression model.
+
+Works on a <=256 px copy (JPEG draft-mode decode), so a check costs a few
+milliseconds instead of a full EfficientNet forward:
+
+  - blur:      variance of the 4-neighbour Laplacian of the gray image
+  - exposure:  mean brightness, clipped shadows/highlights, contrast
+  - content:   residue / leaf / other from a softmax head over HSV color
+               histograms; weights come from outputs/quality_head.json
+               (train with train_quality_head.py). Without that file only the
+               blur and exposure checks run.
+
+Thresholds are env-configurable; QUALITY_GATE=0 turns the gate off.
+"""
+import io
+import json
+import os
+import sys
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+from PIL import Image
+
+ROOT = Path(__file__).resolve().parent
+HEAD_PATH = ROOT / "outputs" / "quality_head.json"
+
+ENABLED = os.getenv("QUALITY_GATE", "1") != "0"
+GATE_SIZE = 256
+MIN_BLUR = float(os.getenv("QUALITY_MIN_BLUR", "15"))           # Laplacian variance at GATE_SIZE
+MIN_BRIGHTNESS = float(os.getenv("QUALITY_MIN_BRIGHTNESS", "35"))
+MAX_BRIGHTNESS = float(os.getenv("QUALITY_MAX_BRIGHTNESS", "225"))
+MAX_CLIPPED = float(os.getenv("QUALITY_MAX_CLIPPED", "0.4"))     # fraction of pixels at 0-5 / 250-255
+MIN_CONTRAST = float(os.getenv("QUALITY_MIN_CONTRAST", "8"))     # gray std; blank screens and walls
+MIN_RESIDUE_PROB = float(os.getenv("QUALITY_MIN_RESIDUE_PROB", "0.35"))
+
+FEATURE_VERSION = "hsv_v1"
+HUE_BINS, SAT_BINS, VAL_BINS = 12, 4, 4
+
+FEEDBACK = {
+    "blurry": "Photo is blurry. Hold the phone steady, tap to focus on the residue and retake.",
+    "too_dark": "Photo is too dark. Take it in daylight or turn on more light.",
+    "too_bright": "Photo is overexposed. Avoid direct sun or flash glare on the residue.",
+    "low_contrast": "Photo looks blank or uniform. Point the camera at the residue pile.",
+    "not_residue": "This does not look like crop residue. Photograph the chopped residue itself, filling most of the frame.",
+}
+
+
+# --------------------------
+# Features
+# --------------------------
+def load_small(src) -> Image.Image:
+    """RGB copy no larger than GATE_SIZE from a path or raw bytes."""
+    im = Image.open(io.BytesIO(src) if isinstance(src, (bytes, bytearray)) else src)
+    im.draft("RGB", (GATE_SIZE, GATE_SIZE))
+    im = im.convert("RGB")
+    im.thumbnail((GATE_SIZE, GATE_SIZE))
+    return im
+
+
+def laplacian_variance(gray: np.ndarray) -> float:
+    lap = (gray[1:-1, :-2] + gray[1:-1, 2:] + gray[:-2, 1:-1] + gray[2:, 1:-1] - 4.0 * gray[1:-1, 1:-1])
+    return float(lap.var())
+
+
+def exposure(gray: np.ndarray) -> Dict[str, float]:
+    n = gray.size
+    return {
+        "brightness": float(gray.mean()),
+        "contrast": float(gray.std()),
+        "clipped_dark": float((gray <= 5).sum() / n),
+        "clipped_bright": float((gray >= 250).sum() / n),
+    }
+
+
+def color_features(im: Image.Image) -> np.ndarray:
+    """Normalized hue (saturation-weighted), saturation and value histograms."""
+    hsv = np.asarray(im.convert("HSV"), dtype=np.float32)
+    h, s, v = hsv[..., 0], hsv[..., 1], hsv[..., 2]
+    w = s / 255.0
+    hue = np.histogram(h, bins=HUE_BINS, range=(0, 256), weights=w)[0]
+    hue = hue / max(hue.sum(), 1e-6)
+    sat = np.histogram(s, bins=SAT_BINS, range=(0, 256))[0] / s.size
+    val = np.histogram(v, bins=VAL_BINS, range=(0, 256))[0] / v.size
+    return np.concatenate([hue, sat, val, [w.mean()]]).astype(np.float32)
+
+
+# --------------------------
+# Content head
+# --------------------------
+class ContentHead:
+    """Softmax regression over color_features(); weights saved by train_quality_head.py."""
+
+    def __init__(self, spec: Dict):
+        if spec.get("feature") != FEATURE_VERSION:
+            raise ValueError(f"quality head was trained on {spec.get('feature')!r}, expected {FEATURE_VERSION!r}")
+        self.classes = list(spec["classes"])
+        self.W = np.asarray(spec["W"], dtype=np.float32)          # (n_classes, n_features)
+        self.b = np.asarray(spec["b"], dtype=np.float32)
+        self.mean = np.asarray(spec["mean"], dtype=np.float32)
+        self.std = np.asarray(spec["std"], dtype=np.float32)
+
+    def predict_proba(self, feats: np.ndarray) -> Dict[str, float]:
+        z = self.W @ ((feats - self.mean) / self.std) + self.b
+        z = np.exp(z - z.max())
+        p = z / z.sum()
+        return {c: round(float(v), 4) for c, v in zip(self.classes, p)}
+
+
+_HEAD = None                # (file signature, ContentHead or None)
+_HEAD_LOCK = threading.Lock()
+
+
+def content_head() -> Optional[ContentHead]:
+    """The head from HEAD_PATH, reloaded when the file changes; None if absent/invalid."""
+    global _HEAD
+    try:
+        st = HEAD_PATH.stat()
+        sig = (st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
+        return None
+    cached = _HEAD
+    if cached is not None and cached[0] == sig:
+        return cached[1]
+    with _HEAD_LOCK:
+        try:
+            head = ContentHead(json.loads(HEAD_PATH.read_text(encoding="utf-8")))
+        except Exception as e:
+            print("⚠️ Ignoring invalid quality head:", e, file=sys.stderr)
+            head = None
+        _HEAD = (sig, head)
+        return head
+
+
+# --------------------------
+# Gate
+# --------------------------
+def assess(image_bytes: bytes) -> Dict:
+    """
+    Returns {"ok": bool, "reasons": [...], "feedback": [...], "scores": {...}}.
+    Raises if the bytes are not a decodable image.
+    """
+    im = load_small(image_bytes)
+    gray = np.asarray(im.convert("L"), dtype=np.float32)
+    scores = {"blur": round(laplacian_variance(gray), 2)}
+    scores.update({k: round(v, 4) for k, v in exposure(gray).items()})
+
+    reasons = []
+    if scores["brightness"] < MIN_BRIGHTNESS or scores["clipped_dark"] > MAX_CLIPPED:
+        reasons.append("too_dark")
+    elif scores["brightness"] > MAX_BRIGHTNESS or scores["clipped_bright"] > MAX_CLIPPED:
+        reasons.append("too_bright")
+    elif scores["contrast"] < MIN_CONTRAST:
+        reasons.append("low_contrast")
+    # a uniform frame has no edges either; "blurry" would only repeat low_contrast
+    if scores["blur"] < MIN_BLUR and "low_contrast" not in reasons:
+        reasons.append("blurry")
+
+    head = content_head()
+    if head is not None:
+        probs = head.predict_proba(color_features(im))
+        scores["content"] = probs
+        if probs.get("residue", 1.0) < MIN_RESIDUE_PROB:
+            reasons.append("not_residue")
+
+    return {"ok": not reasons, "reasons": reasons,
+            "feedback": [FEEDBACK[r] for r in reasons], "scores": scores}
@@ -0,0 +1,237 @@
+# backend/repricing.py
+"""
+Background recomputation of predicted_m3_biogas / revenue_estimate for open
+records (available stock left) after the admin changes the price or yield,
+or after data/yield_params.json is edited (POST /api/v1/admin/reprice).
+
+orders.place_order prices stock as revenue_estimate / mass_kg, so without this
+a config change only affects records saved afterwards. A job walks the table
+in id order, CHUNK rows at a time (bounded memory), computes the new values
+for the chunk with the vectorized yield_engine.compute, writes only the rows
+that changed with one executemany UPDATE, and commits them together with the
+market_stats deltas and the job's cursor (last_record_id). Progress is the
+job row itself.
+
+Resume is idempotent: a chunk either committed with its cursor or not at all,
+so a job whose runner died (stale heartbeat) restarts from its cursor, and
+recomputing a row that already has the new values changes nothing.
+
+    job_id = repricing.start(price_per_m3=60.0, yield_per_kgvs=0.2)
+    repricing.job_dict(db.get(RepriceJob, job_id))   # progress
+"""
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import numpy as np
+from sqlalchemy import bindparam, func, or_, update
+from sqlalchemy.orm import Session
+
+from database import SessionLocal, Record, RepriceJob
+import events
+import stats
+import yield_engine
+
+CHUNK = int(os.getenv("REPRICE_CHUNK", "2000"))
+HEARTBEAT_STALE = timedelta(seconds=float(os.getenv("REPRICE_HEARTBEAT_STALE_S", "120")))
+ACTIVE = ("queued", "running")
+
+_R = Record.__table__
+_J = RepriceJob.__table__
+_UPDATE_RECORD = (update(_R).where(_R.c.id == bindparam("_id"))
+                  .values(predicted_m3_biogas=bindparam("_biogas"), revenue_estimate=bindparam("_revenue"),
+                          yield_version=bindparam("_version")))
+
+
+def _open_records():
+    # available_kg NULL predates stock tracking and means "all of mass_kg"
+    return or_(Record.available_kg > 0, Record.available_kg.is_(None))
+
+
+# --------------------------
+# Batch computation
+# --------------------------
+_COLUMNS = (Record.id, Record.mass_kg, Record.vs_fraction, Record.moisture_percent, Record.crop,
+            Record.predicted_m3_biogas, Record.revenue_estimate,
+            Record.location, Record.phone, Record.farmer_name, Record.timestamp)   # last four: stats buckets
+
+
+def _col(rows, i) -> np.ndarray:
+    return np.array([np.nan if r[i] is None else r[i] for r in rows], dtype=np.float64)
+
+
+def recompute(rows, price_per_m3: float, yield_per_kgvs: float, tbl: yield_engine.YieldTable):
+    """
+    New (biogas, revenue) arrays via yield_engine.compute. Records without VS keep
+    their stored biogas and are only re-priced; crops no longer in the table fall
+    back to the default crop.
+    """
+    cfg = dict(yield_engine.FALLBACK_CONFIG, PRICE_PER_M3=price_per_m3, DEFAULT_YIELD_PER_KGVS=yield_per_kgvs)
+    vs, old_biogas = _col(rows, 2), _col(rows, 5)
+    crops = [r[4] if r[4] in tbl.crop_index else None for r in rows]
+    est = yield_engine.compute(_col(rows, 1), vs, _col(rows, 3), crops, cfg=cfg, tbl=tbl)
+    new_biogas = np.where(np.isfinite(vs), est["biogas_m3"], np.nan_to_num(old_biogas))
+    new_revenue = np.round(new_biogas * price_per_m3, 2)
+    return new_biogas, new_revenue
+
+
+def _apply_chunk(db: Session, rows, price_per_m3: float, yield_per_kgvs: float) -> int:
+    """Update one chunk of _COLUMNS rows; returns how many records changed."""
+    tbl = yield_engine.table()
+    old_biogas, old_revenue = _col(rows, 5), _col(rows, 6)
+    new_biogas, new_revenue = recompute(rows, price_per_m3, yield_per_kgvs, tbl)
+    changed = ~(np.isclose(new_biogas, old_biogas, rtol=0, atol=1e-9)
+                & np.isclose(new_revenue, old_revenue, rtol=0, atol=1e-9))
+    idx = np.flatnonzero(changed)
+    if not len(idx):
+        return 0
+    db.execute(_UPDATE_RECORD, [
+        {"_id": rows[i][0], "_biogas": float(new_biogas[i]), "_revenue": float(new_revenue[i]),
+         "_version": tbl.version} for i in idx
+    ])
+    d_biogas = new_biogas[idx] - np.nan_to_num(old_biogas[idx])
+    d_revenue = new_revenue[idx] - np.nan_to_num(old_revenue[idx])
+    stats.repriced_many(db, ((rows[i], float(b), float(r)) for i, b, r in zip(idx, d_biogas, d_revenue)))
+    return len(idx)
+
+
+# --------------------------
+# Runner
+# --------------------------
+def _claim(db: Session, job_id: int) -> bool:
+    """Atomically take ownership of a queued job, or of a running one whose runner stopped heartbeating."""
+    now = datetime.utcnow()
+    res = db.execute(
+        update(_J)
+        .where((_J.c.id == job_id) & _J.c.status.in_(ACTIVE)
+               & (_J.c.heartbeat_at.is_(None) | (_J.c.heartbeat_at < now - HEARTBEAT_STALE)))
+        .values(status="running", heartbeat_at=now, started_at=func.coalesce(_J.c.started_at, now))
+    )
+    db.commit()
+    return res.rowcount == 1
+
+
+def _is_active(db: Session, job_id: int) -> bool:
+    status = db.query(RepriceJob.status).filter(RepriceJob.id == job_id).scalar()
+    return status in ACTIVE
+
+
+def _run(job_id: int):
+    db = SessionLocal()
+    try:
+        while not _claim(db, job_id):
+            if not _is_active(db, job_id):
+                return
+            time.sleep(min(10.0, HEARTBEAT_STALE.total_seconds() / 4))   # previous runner may still be alive
+
+        job = db.get(RepriceJob, job_id)
+        price, yld, cursor = job.price_per_m3, job.yield_per_kgvs, job.last_record_id
+        print(f"🔁 Repricing job {job_id}: price={price} yield={yld} from record {cursor}", file=sys.stderr)
+        t0 = time.perf_counter()
+        while True:
+            rows = (db.query(*_COLUMNS)
+                    .filter(Record.id > cursor, _open_records())
+                    .order_by(Record.id).limit(CHUNK).all())
+            if not rows:
+                break
+            n_changed = _apply_chunk(db, rows, price, yld)
+            cursor = rows[-1][0]
+            # commit the chunk only if the job was not cancelled / superseded meanwhile
+            res = db.execute(
+                update(_J).where((_J.c.id == job_id) & (_J.c.status == "running"))
+                .values(last_record_id=cursor, processed=_J.c.processed + len(rows),
+                        changed=_J.c.changed + n_changed, heartbeat_at=datetime.utcnow())
+            )
+            if res.rowcount != 1:
+                db.rollback()
+                print(f"ℹ️ Repricing job {job_id} stopped ({db.get(RepriceJob, job_id).status}).", file=sys.stderr)
+                return
+            db.commit()
+
+        db.execute(update(_J).where((_J.c.id == job_id) & (_J.c.status == "running"))
+                   .values(status="done", finished_at=datetime.utcnow()))
+        db.commit()
+        print(f"✅ Repricing job {job_id} done in {time.perf_counter() - t0:.1f}s", file=sys.stderr)
+        events.publish("resync", {"reason": "repriced"})     # unit prices changed across the board
+    except Exception as e:
+        db.rollback()
+        print(f"⚠️ Repricing job {job_id} failed:", e, file=sys.stderr)
+        db.execute(update(_J).where(_J.c.id == job_id)
+                   .values(status="failed", error=str(e)[:500], finished_at=datetime.utcnow()))
+        db.commit()
+    finally:
+        db.close()
+
+
+def _spawn(job_id: int):
+    threading.Thread(target=_run, args=(job_id,), name=f"reprice-{job_id}", daemon=True).start()
+
+
+# --------------------------
+# API
+# --------------------------
+def start(price_per_m3: float, yield_per_kgvs: float) -> int:
+    """Queue a job for these settings (superseding any active one) and run it in the background."""
+    db = SessionLocal()
+    try:
+        db.execute(update(_J).where(_J.c.status.in_(ACTIVE))
+                   .values(status="superseded", finished_at=datetime.utcnow()))
+        total = db.query(Record.id).filter(_open_records()).count()
+        job = RepriceJob(status="queued", price_per_m3=price_per_m3, yield_per_kgvs=yield_per_kgvs, total=total)
+        db.add(job)
+        db.commit()
+        job_id = job.id
+    finally:
+        db.close()
+    _spawn(job_id)
+    return job_id
+
+
+def cancel(db: Session, job_id: int) -> bool:
+    res = db.execute(update(_J).where((_J.c.id == job_id) & _J.c.status.in_(ACTIVE))
+                     .values(status="cancelled", finished_at=datetime.utcnow()))
+    db.commit()
+    return res.rowcount == 1
+
+
+def resume_pending():
+    """Restart the newest unfinished job after a restart / crash; older ones are superseded by it."""
+    db = SessionLocal()
+    try:
+        pending: List[int] = [j for (j,) in db.query(RepriceJob.id).filter(RepriceJob.status.in_(ACTIVE))
+                              .order_by(RepriceJob.id.desc())]
+        if not pending:
+            return None
+        if len(pending) > 1:
+            db.execute(update(_J).where(_J.c.id.in_(pending[1:]))
+                       .values(status="superseded", finished_at=datetime.utcnow()))
+            db.commit()
+    finally:
+        db.close()
+    print(f"🔁 Resuming repricing job {pending[0]}", file=sys.stderr)
+    _spawn(pending[0])
+    return pending[0]
+
+
+def job_dict(job: Optional[RepriceJob]) -> Optional[Dict]:
+    if job is None:
+        return None
+    return {
+        "id": job.id,
+        "status": job.status,
+        "price_per_m3": job.price_per_m3,
+        "yield_per_kgvs": job.yield_per_kgvs,
+        "total": job.total,
+        "processed": job.processed,
+        "changed": job.changed,
+        "percent": round(100.0 * min(job.processed, job.total) / job.total, 1) if job.total else 100.0,
+        "last_record_id": job.last_record_id,
+        "error": job.error,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "heartbeat_at": job.heartbeat_at,
+        "finished_at": job.finished_at,
+    }
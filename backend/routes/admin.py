@@ -5,7 +5,11 @@ from pydantic import BaseModel
 from pathlib import Path
 import json
 
-from database import get_db, Config
+from database import get_db, Config, RepriceJob
+import infer
+import repricing
+import stats
+import yield_engine
 
 router = APIRouter(prefix="/api/v1/admin", tags=["Admin"])
 
@@ -40,15 +44,79 @@ def get_config(db: Session = Depends(get_db)):
 @router.post("/config")
 def update_config(payload: ConfigIn, db: Session = Depends(get_db)):
     # update DB config if exists otherwise update JSON file
+    # records' biogas / revenue depend on price and yield; reprice open stock when they change
+    before = get_config(db)
+    repricing_needed = (before.get("PRICE_PER_M3") != payload.PRICE_PER_M3
+                        or before.get("DEFAULT_YIELD_PER_KGVS") != payload.DEFAULT_YIELD_PER_KGVS)
+
     cfg = db.query(Config).first()
     if cfg:
         cfg.price_per_m3 = payload.PRICE_PER_M3
         cfg.default_yield_per_kgvs = payload.DEFAULT_YIELD_PER_KGVS
         cfg.default_methane_fraction = payload.DEFAULT_METHANE_FRACTION
         db.commit()
-        return {"message": "Config updated (DB)"}
+    # /predict and /records price through yield_engine, which reads config.json; keep it in sync
+    yield_engine.save_config(payload.dict())
+    result = {"message": "Config updated (DB)" if cfg else "Config updated (config.json)"}
+
+    if repricing_needed:
+        result["reprice_job_id"] = repricing.start(payload.PRICE_PER_M3, payload.DEFAULT_YIELD_PER_KGVS)
+    return result
+
+
+@router.get("/yield-params")
+def get_yield_params():
+    """Per-crop / moisture-band table from data/yield_params.json as currently loaded."""
+    return yield_engine.table().describe()
+
+
+@router.get("/model")
+def get_model_info():
+    """Active model version and watcher settings."""
+    return infer.model_info()
+
+@router.post("/model/reload")
+def reload_model(force: bool = False):
+    """
+    Load backend/outputs/best_regressor.pth if it changed (or always with ?force=true),
+    warm it up and swap it in. Requests already running finish on the previous model.
+    """
+    result = infer.reload_model(force=force)
+    if result.get("error") and not infer.model_info()["loaded"]:
+        raise HTTPException(status_code=500, detail=result["error"])
+    return result
+
+
+@router.post("/stats/rebuild")
+def rebuild_stats(db: Session = Depends(get_db)):
+    """Recompute market_stats from records and orders (repairs drift after manual SQL edits)."""
+    return {"message": "market_stats rebuilt", "rows": stats.rebuild(db)}
+
+
+@router.post("/reprice")
+def start_reprice(db: Session = Depends(get_db)):
+    """Recompute biogas / revenue of all open records with the current config (runs in the background)."""
+    cfg = get_config(db)
+    job_id = repricing.start(float(cfg["PRICE_PER_M3"]), float(cfg["DEFAULT_YIELD_PER_KGVS"]))
+    return repricing.job_dict(db.get(RepriceJob, job_id))
+
+
+@router.get("/reprice/jobs")
+def list_reprice_jobs(limit: int = 20, db: Session = Depends(get_db)):
+    jobs = db.query(RepriceJob).order_by(RepriceJob.id.desc()).limit(max(1, min(limit, 200))).all()
+    return [repricing.job_dict(j) for j in jobs]
+
+
+@router.get("/reprice/jobs/{job_id}")
+def get_reprice_job(job_id: int, db: Session = Depends(get_db)):
+    job = db.get(RepriceJob, job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return repricing.job_dict(job)
+
 
-    # ensure data dir exists
-    DATA_JSON.parent.mkdir(parents=True, exist_ok=True)
-    DATA_JSON.write_text(json.dumps(payload.dict(), indent=2), encoding="utf-8")
-    return {"message": "Config updated (config.json)"}
+@router.post("/reprice/jobs/{job_id}/cancel")
+def cancel_reprice_job(job_id: int, db: Session = Depends(get_db)):
+    if not repricing.cancel(db, job_id):
+        raise HTTPException(status_code=409, detail="Job is not queued or running")
+    return repricing.job_dict(db.get(RepriceJob, job_id))
@@ -7,6 +7,8 @@ import random
 
 # import DB session & models
 from database import get_db, User
+import geo
+import search
 
 router = APIRouter(prefix="/api/v1/auth", tags=["Auth"])
 
@@ -35,7 +37,8 @@ async def register(user: dict, db: Session = Depends(get_db)):
       "role": "farmer" | "buyer" | "admin",
       "phone": "9876543210",
       "location": "Village",
-      "password": "mypassword"
+      "password": "mypassword",
+      "latitude": 12.97, "longitude": 77.59      (optional)
     }
     """
     required = ("name", "role", "phone", "password")
@@ -47,6 +50,10 @@ async def register(user: dict, db: Session = Depends(get_db)):
     existing = db.query(User).filter(User.phone == phone).first()
     if existing:
         raise HTTPException(status_code=400, detail="User with this phone already exists")
+    try:
+        coords = geo.parse_coords(user.get("latitude"), user.get("longitude"))
+    except (TypeError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid coordinates: {e}")
 
     new_user = User(
         name=str(user["name"]).strip(),
@@ -54,12 +61,15 @@ async def register(user: dict, db: Session = Depends(get_db)):
         phone=phone,
         location=str(user.get("location", "")).strip(),
         password_hash=hash_password(user["password"]),
+        latitude=coords[0] if coords else None,
+        longitude=coords[1] if coords else None,
         created_at=datetime.utcnow(),
     )
 
     db.add(new_user)
     db.commit()
     db.refresh(new_user)
+    search.note(new_user.phone, new_user.location)
 
     return {
         "message": "✅ User registered successfully",
@@ -110,6 +120,8 @@ async def list_users(db: Session = Depends(get_db)):
             "role": u.role,
             "phone": u.phone,
             "location": u.location,
+            "latitude": u.latitude,
+            "longitude": u.longitude,
             "created_at": u.created_at,
         }
         for u in users
@@ -0,0 +1,47 @@
+# backend/routes/exports.py
+from datetime import datetime
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+
+import exports
+
+router = APIRouter(prefix="/api/v1/export", tags=["Export"])
+
+
+def _export(dataset: str, format: str, start: Optional[str], end: Optional[str]) -> StreamingResponse:
+    if format not in exports.FORMATS:
+        raise HTTPException(400, f"format must be one of {', '.join(exports.FORMATS)}")
+    if format == "parquet" and exports.pa is None:
+        raise HTTPException(501, "Parquet export needs pyarrow on the server; use format=csv")
+    try:
+        lo, hi = exports.parse_range(start, end)
+    except ValueError as e:
+        raise HTTPException(400, str(e))
+    filename = f"agrogas_{dataset}_{datetime.utcnow():%Y%m%d_%H%M%S}.{format}"
+    return StreamingResponse(
+        exports.stream(exports.DATASETS[dataset], format, lo, hi),
+        media_type=exports.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"', "Cache-Control": "no-store"},
+    )
+
+
+@router.get("/records")
+def export_records(
+    format: str = Query("csv", description="csv or parquet"),
+    start: Optional[str] = Query(None, description="ISO date/datetime, inclusive (record timestamp)"),
+    end: Optional[str] = Query(None, description="ISO date/datetime; a date includes that whole day"),
+):
+    """Every record in the range, oldest first, streamed (no size limit)."""
+    return _export("records", format, start, end)
+
+
+@router.get("/orders")
+def export_orders(
+    format: str = Query("csv", description="csv or parquet"),
+    start: Optional[str] = Query(None, description="ISO date/datetime, inclusive (order created_at)"),
+    end: Optional[str] = Query(None, description="ISO date/datetime; a date includes that whole day"),
+):
+    """One line per order item (orders without items get one line), oldest first, streamed."""
+    return _export("orders", format, start, end)
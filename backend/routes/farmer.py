@@ -1,48 +1,157 @@
 # backend/routes/farmer.py
 
-from fastapi import APIRouter, HTTPException, Depends
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Depends, File, Header, Query, Response, UploadFile
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from datetime import datetime
-from database import get_db, Record
+from database import get_db, Record, User
+import bulk_import
+import events
+import geo
+import idempotency
+import image_store
+import search
+import stats
+import yield_engine
 
 router = APIRouter(prefix="/api/v1", tags=["Farmer"])
 
+
+def _optional_float(v):
+    return None if v is None or v == "" else float(v)
+
+
 # ------------------------------------------------------
 # SAVE RECORD (POST)
 # ------------------------------------------------------
 @router.post("/records")
-async def save_record(payload: dict, db: Session = Depends(get_db)):
+def save_record(payload: dict, response: Response, db: Session = Depends(get_db),
+                idempotency_key: Optional[str] = Header(None)):
 
-    required = [
-        "farmer_name", "location", "phone",
-        "mass_kg", "predicted_m3_biogas", "revenue_estimate"
-    ]
+    # a retried submission (same Idempotency-Key) gets the first response back instead of a second record
+    try:
+        idem = idempotency.Request("records", idempotency_key, payload)
+        stored = idem.lookup(db)
+    except ValueError as e:
+        raise HTTPException(422, str(e))
+    if stored is not None:
+        response.headers[idempotency.REPLAY_HEADER] = "true"
+        return stored
+
+    required = ["farmer_name", "location", "phone", "mass_kg"]
     for field in required:
         if field not in payload:
             raise HTTPException(400, f"Missing: {field}")
+    try:
+        coords = geo.parse_coords(payload.get("latitude"), payload.get("longitude"))
+    except (TypeError, ValueError) as e:
+        raise HTTPException(400, f"Invalid coordinates: {e}")
+
+    # biogas / revenue are derived here; client-sent predicted_m3_biogas / revenue_estimate are ignored
+    try:
+        mass_kg = float(payload["mass_kg"])
+        vs = _optional_float(payload.get("vs_fraction"))
+        moisture = _optional_float(payload.get("moisture_percent"))
+    except (TypeError, ValueError):
+        raise HTTPException(400, "mass_kg, vs_fraction and moisture_percent must be numbers")
+    if not mass_kg > 0:
+        raise HTTPException(400, "mass_kg must be greater than 0")
+    if vs is not None and not 0.0 <= vs <= 1.0:
+        raise HTTPException(400, "vs_fraction must be between 0 and 1")
+    if moisture is not None and not 0.0 <= moisture <= 100.0:
+        raise HTTPException(400, "moisture_percent must be between 0 and 100")
+    try:
+        est = yield_engine.estimate(mass_kg, vs, moisture, payload.get("crop"))
+    except ValueError as e:
+        raise HTTPException(400, str(e))
 
     rec = Record(
         farmer_name=payload["farmer_name"],
         location=payload["location"],
         phone=payload["phone"],
 
-        mass_kg=payload["mass_kg"],
-        available_kg=payload["mass_kg"],        # NEW ✔
+        mass_kg=mass_kg,
+        available_kg=mass_kg,        # NEW ✔
 
-        moisture_percent=payload.get("moisture_percent"),
-        vs_fraction=payload.get("vs_fraction"),
+        crop=est["crop"],
+        moisture_percent=moisture,
+        vs_fraction=vs,
 
-        predicted_m3_biogas=payload["predicted_m3_biogas"],
-        revenue_estimate=payload["revenue_estimate"],
+        predicted_m3_biogas=est["predicted_m3_biogas"],
+        revenue_estimate=est["revenue_estimate"],
+        yield_version=est["yield_params_version"],
+
+        image_id=payload.get("image_id") if image_store.is_valid_id(payload.get("image_id")) else None,
+
+        latitude=coords[0] if coords else None,
+        longitude=coords[1] if coords else None,
+        geohash=geo.encode(*coords) if coords else None,
 
         timestamp=datetime.utcnow()
     )
 
     db.add(rec)
-    db.commit()
+    try:
+        db.flush()
+        stats.record_added(db, rec)     # aggregates commit together with the record
+        body = {
+            "message": "Record saved",
+            "id": rec.id,
+            "predicted_m3_biogas": rec.predicted_m3_biogas,
+            "revenue_estimate": rec.revenue_estimate,
+        }
+        idem.remember(db, body)
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        try:
+            stored = idem.lookup(db)    # a concurrent copy of this request committed first
+        except ValueError as e:         # ... or the key was reused with a different body
+            raise HTTPException(422, str(e))
+        if stored is None:
+            raise
+        response.headers[idempotency.REPLAY_HEADER] = "true"
+        return stored
+    except Exception:
+        db.rollback()
+        raise
     db.refresh(rec)
+    search.note(rec.phone, rec.location)
+    events.publish("record", {
+        **events.stock_event(rec),
+        "farmer_name": rec.farmer_name,
+        "location": rec.location,
+        "phone": rec.phone,
+        "crop": rec.crop,
+        "mass_kg": rec.mass_kg,
+        "predicted_m3_biogas": rec.predicted_m3_biogas,
+        "revenue_estimate": rec.revenue_estimate,
+        "image_url": f"/api/v1/images/{rec.image_id}" if rec.image_id else None,
+        "timestamp": rec.timestamp,
+    })
+    idem.committed(db)
 
-    return {"message": "Record saved", "id": rec.id}
+    return body
+
+# ------------------------------------------------------
+# BULK IMPORT (POST)
+# ------------------------------------------------------
+@router.post("/records/import")
+def import_records(
+    file: UploadFile = File(..., description="CSV with a header row, or NDJSON (one object per line)"),
+    format: Optional[str] = Query(None, description="csv or ndjson; guessed from the file name if omitted"),
+    dry_run: bool = Query(False, description="Validate and price every row without saving"),
+    db: Session = Depends(get_db),
+):
+    """
+    Load many lots at once. Rows are validated like POST /records and saved in
+    chunks; invalid rows are listed by line number and skipped.
+    """
+    fmt = (format or bulk_import.detect_format(file.filename, file.content_type)).lower()
+    if fmt not in bulk_import.FORMATS:
+        raise HTTPException(400, f"format must be one of {', '.join(bulk_import.FORMATS)}")
+    return bulk_import.import_stream(db, file.file, fmt, dry_run=dry_run)
 
 
 # ------------------------------------------------------
@@ -61,11 +170,54 @@ async def list_records(db: Session = Depends(get_db)):
             "phone": r.phone,
             "mass_kg": r.mass_kg,
             "available_kg": r.available_kg,      # ✔ NEW
+            "crop": r.crop,
             "moisture_percent": r.moisture_percent,
             "vs_fraction": r.vs_fraction,
             "predicted_m3_biogas": r.predicted_m3_biogas,
             "revenue_estimate": r.revenue_estimate,
+            "image_id": r.image_id,
+            "image_url": f"/api/v1/images/{r.image_id}" if r.image_id else None,
+            "latitude": r.latitude,
+            "longitude": r.longitude,
             "timestamp": r.timestamp,
         }
         for r in records
     ]
+
+
+# ------------------------------------------------------
+# CROPS (GET)
+# ------------------------------------------------------
+@router.get("/crops")
+async def list_crops():
+    """Crops and moisture bands the yield engine knows, with the parameter table version."""
+    return yield_engine.table().describe()
+
+
+# ------------------------------------------------------
+# NEAREST SUPPLY (GET)
+# ------------------------------------------------------
+@router.get("/records/nearby")
+async def nearby_records(
+    lat: Optional[float] = Query(None, ge=-90, le=90),
+    lon: Optional[float] = Query(None, ge=-180, le=180),
+    phone: Optional[str] = Query(None, description="Use this registered user's saved location"),
+    k: int = Query(10, ge=1, le=200),
+    min_kg: float = Query(0.0, ge=0),
+    max_km: Optional[float] = Query(None, gt=0),
+    sort: str = Query("landed"),
+    freight: float = Query(geo.FREIGHT_PER_KG_KM, ge=0, description="₹ per kg per km, for sort=landed"),
+    db: Session = Depends(get_db),
+):
+    if sort not in geo.SORTS:
+        raise HTTPException(400, f"sort must be one of {', '.join(geo.SORTS)}")
+    if (lat is None) != (lon is None):
+        raise HTTPException(400, "Provide both lat and lon")
+    if lat is None:
+        user = db.query(User).filter(User.phone == phone).first() if phone else None
+        if user is None or user.latitude is None or user.longitude is None:
+            raise HTTPException(400, "Provide lat/lon or the phone of a user with a saved location")
+        lat, lon = user.latitude, user.longitude
+
+    results = geo.nearby(db, lat, lon, k=k, min_kg=min_kg, max_km=max_km, sort=sort, freight=freight)
+    return {"lat": lat, "lon": lon, "sort": sort, "count": len(results), "results": results}
@@ -0,0 +1,39 @@
+# backend/routes/images.py
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import FileResponse
+
+import image_store
+
+router = APIRouter(prefix="/api/v1/images", tags=["Images"])
+
+# ids are content hashes, so a given URL never changes content
+CACHE_HEADERS = {"Cache-Control": "public, max-age=31536000, immutable"}
+
+_MEDIA = {"jpg": "image/jpeg", "png": "image/png", "webp": "image/webp", "bmp": "image/bmp", "tif": "image/tiff"}
+
+
+@router.get("/{image_id}")
+def get_image(image_id: str, size: str = Query("480", description="160, 480, 1024 or 'original'")):
+    """
+    Serve a stored upload. FileResponse streams from disk, answers Range
+    requests and sets ETag / Last-Modified.
+    """
+    if not image_store.is_valid_id(image_id):
+        raise HTTPException(404, "Image not found")
+
+    if size == "original":
+        path = image_store.original_path(image_id)
+        media = _MEDIA.get(path.suffix.lstrip("."), "application/octet-stream") if path else None
+    else:
+        try:
+            px = int(size)
+        except ValueError:
+            raise HTTPException(400, f"size must be one of {list(image_store.THUMB_SIZES)} or 'original'")
+        if px not in image_store.THUMB_SIZES:
+            raise HTTPException(400, f"size must be one of {list(image_store.THUMB_SIZES)} or 'original'")
+        path = image_store.thumbnail(image_id, px)
+        media = "image/webp"
+
+    if path is None:
+        raise HTTPException(404, "Image not found")
+    return FileResponse(path, media_type=media, headers=CACHE_HEADERS)
@@ -1,10 +1,16 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Header, Response
+from pydantic import BaseModel
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from typing import List, Dict, Any
-from datetime import datetime
+from typing import List, Dict, Any, Optional
 
 # import DB models + session dependency
-from database import get_db, Record, Order, OrderItem
+from database import get_db, Order, OrderItem
+import allocation
+import events
+import geo
+import idempotency
+import ordering
 
 router = APIRouter(prefix="/api/v1", tags=["Orders"])
 
@@ -20,11 +26,22 @@ router = APIRouter(prefix="/api/v1", tags=["Orders"])
 #   ]
 # }
 @router.post("/orders")
-def place_order(payload: Dict[str, Any], db: Session = Depends(get_db)):
+def place_order(payload: Dict[str, Any], response: Response, db: Session = Depends(get_db),
+                idempotency_key: Optional[str] = Header(None)):
     # Basic validation
     if not isinstance(payload, dict):
         raise HTTPException(status_code=400, detail="Payload must be a JSON object")
 
+    # A retried order (same Idempotency-Key) returns the original result and never decrements stock twice
+    try:
+        idem = idempotency.Request("orders", idempotency_key, payload)
+        stored = idem.lookup(db)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if stored is not None:
+        response.headers[idempotency.REPLAY_HEADER] = "true"
+        return stored
+
     if "buyer_name" not in payload or not payload["buyer_name"]:
         raise HTTPException(status_code=400, detail="Missing field: buyer_name")
     if "items" not in payload or not isinstance(payload["items"], list) or len(payload["items"]) == 0:
@@ -33,96 +50,162 @@ def place_order(payload: Dict[str, Any], db: Session = Depends(get_db)):
     buyer_name = payload.get("buyer_name")
     buyer_phone = payload.get("buyer_phone")
     buyer_location = payload.get("buyer_location")
-    items = payload["items"]
 
-    total_price = 0.0
-    order_items_to_insert = []
+    lines = []
+    for it in payload["items"]:
+        if not isinstance(it, dict):
+            raise HTTPException(status_code=400, detail="Each item must be an object with record_id and qty_kg")
+        try:
+            record_id = int(it.get("record_id"))
+            qty = float(it.get("qty_kg", 0.0))
+        except Exception:
+            raise HTTPException(status_code=400, detail="record_id must be integer and qty_kg must be numeric")
+        if qty <= 0:
+            raise HTTPException(status_code=400, detail=f"qty_kg must be > 0 for record {record_id}")
+        lines.append((record_id, qty))
 
     try:
-        # Validate each requested item and compute totals
-        for it in items:
-            if not isinstance(it, dict):
-                raise HTTPException(status_code=400, detail="Each item must be an object with record_id and qty_kg")
-
-            try:
-                record_id = int(it.get("record_id"))
-                qty = float(it.get("qty_kg", 0.0))
-            except Exception:
-                raise HTTPException(status_code=400, detail="record_id must be integer and qty_kg must be numeric")
-
-            if qty <= 0:
-                raise HTTPException(status_code=400, detail=f"qty_kg must be > 0 for record {record_id}")
-
-            # Lock the row for update to avoid race (DB must support SELECT ... FOR UPDATE)
-            rec = db.query(Record).filter(Record.id == record_id).with_for_update().first()
-            if not rec:
-                raise HTTPException(status_code=404, detail=f"Record {record_id} not found")
-
-            # Determine available quantity: prefer available_kg column if present, otherwise mass_kg
-            avail = rec.available_kg if getattr(rec, "available_kg", None) is not None else (rec.mass_kg or 0.0)
-            if qty > avail:
-                raise HTTPException(status_code=400,
-                                    detail=f"Not enough available quantity for record {record_id} (avail={avail}, requested={qty})")
-
-            # Compute unit price (safe): revenue_estimate / mass_kg if available
-            if not rec.mass_kg or rec.mass_kg == 0 or not rec.revenue_estimate:
-                unit_price = 0.0
-            else:
-                unit_price = float(rec.revenue_estimate) / float(rec.mass_kg)
-
-            line_total = round(unit_price * qty, 2)
-            total_price += line_total
-
-            order_items_to_insert.append({
-                "record_obj": rec,
-                "record_id": record_id,
-                "qty": qty,
-                "unit_price": unit_price,
-                "line_total": line_total
-            })
-
-        # All checks passed — create Order
-        new_order = Order(
-            buyer_name=buyer_name,
-            buyer_phone=buyer_phone,
-            buyer_location=buyer_location,
-            total_price=round(total_price, 2),
-            status="placed",
-            created_at=datetime.utcnow()
-        )
-        db.add(new_order)
-        db.flush()  # ensure new_order.id is available
-
-        # Insert OrderItem rows and decrement available_kg on the related Record
-        for oi in order_items_to_insert:
-            item = OrderItem(
-                order_id=new_order.id,
-                record_id=oi["record_id"],
-                qty_kg=oi["qty"],
-                unit_price=oi["unit_price"],
-                line_total=oi["line_total"]
-            )
-            db.add(item)
-
-            # decrement available quantity on the record
-            rec = oi["record_obj"]
-            current_avail = rec.available_kg if getattr(rec, "available_kg", None) is not None else (rec.mass_kg or 0.0)
-            new_avail = max(0.0, current_avail - oi["qty"])
-            # ensure attribute exists; set available_kg on the model
-            rec.available_kg = new_avail
-            db.add(rec)
-
+        # stock is checked and decremented atomically per line (see ordering.reserve)
+        try:
+            new_order, recs = ordering.create_order(db, buyer_name, buyer_phone, buyer_location, lines)
+        except ordering.RecordNotFound as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        except ordering.OutOfStock as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        stock_updates = [events.stock_event(rec) for rec in recs]
+        body = {"message": "Order placed", "order_id": new_order.id, "total_price": new_order.total_price}
+        idem.remember(db, body)
         db.commit()
-        db.refresh(new_order)
 
-    except HTTPException:
+    except (HTTPException, IntegrityError) as e:
         db.rollback()
-        raise
+        # a concurrent copy of this request may have committed first (and taken the stock)
+        try:
+            stored = idem.lookup(db)
+        except ValueError as conflict:       # ... or the key was reused with a different body
+            raise HTTPException(status_code=422, detail=str(conflict))
+        if stored is not None:
+            response.headers[idempotency.REPLAY_HEADER] = "true"
+            return stored
+        if isinstance(e, HTTPException):
+            raise
+        raise HTTPException(status_code=500, detail=f"Internal error placing order: {e}")
     except Exception as e:
         db.rollback()
         raise HTTPException(status_code=500, detail=f"Internal error placing order: {e}")
 
-    return {"message": "Order placed", "order_id": new_order.id, "total_price": new_order.total_price}
+    # push the new stock levels to live buyer dashboards (after commit, so they never see rolled-back state)
+    for ev in stock_updates:
+        events.publish("stock", ev)
+    idem.committed(db)
+
+    return body
+
+
+class DemandIn(BaseModel):
+    buyer_name: str
+    buyer_phone: Optional[str] = None
+    buyer_location: Optional[str] = None
+    qty_kg: float
+    min_vs: float = 0.0
+    crop: Optional[str] = None
+    location: Optional[str] = None          # exact district / village match
+    lat: Optional[float] = None             # buyer's site, for distance limits and freight
+    lon: Optional[float] = None
+    max_km: Optional[float] = None
+    max_unit_price: Optional[float] = None
+    min_lot_kg: float = 0.0
+    max_lots: Optional[int] = None
+    strategy: str = "score"                 # "score" (price + VS + freshness) or "cheapest"
+    weights: Optional[Dict[str, float]] = None
+    freight: float = geo.FREIGHT_PER_KG_KM
+    allow_partial: bool = False
+    dry_run: bool = False                   # preview the fill without reserving anything
+
+
+# Expected payload:
+# { "buyer_name": "Plant A", "qty_kg": 500, "min_vs": 0.7, "location": "Rampur" }
+# Fills the demand from the best-ranked open lots as one order (see allocation.py).
+@router.post("/orders/allocate")
+def allocate_order(payload: DemandIn, response: Response, db: Session = Depends(get_db),
+                   idempotency_key: Optional[str] = Header(None)):
+    demand = payload.dict()
+    if not payload.buyer_name.strip():
+        raise HTTPException(status_code=400, detail="Missing field: buyer_name")
+    if not payload.qty_kg > 0:
+        raise HTTPException(status_code=400, detail="qty_kg must be > 0")
+    if not 0.0 <= payload.min_vs <= 1.0:
+        raise HTTPException(status_code=400, detail="min_vs must be between 0 and 1")
+    if payload.strategy not in allocation.STRATEGIES:
+        raise HTTPException(status_code=400, detail=f"strategy must be one of {', '.join(allocation.STRATEGIES)}")
+    unknown = set(payload.weights or {}) - set(allocation.DEFAULT_WEIGHTS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown weights: {', '.join(sorted(unknown))}")
+    if payload.max_lots is not None and payload.max_lots < 1:
+        raise HTTPException(status_code=400, detail="max_lots must be >= 1")
+    try:
+        coords = geo.parse_coords(payload.lat, payload.lon)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if payload.max_km is not None and coords is None:
+        raise HTTPException(status_code=400, detail="max_km needs lat and lon")
+
+    # previews take no stock, so only real allocations are made idempotent
+    try:
+        idem = idempotency.Request("allocate", None if payload.dry_run else idempotency_key, demand)
+        stored = idem.lookup(db)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    if stored is not None:
+        response.headers[idempotency.REPLAY_HEADER] = "true"
+        return stored
+
+    try:
+        try:
+            body, order, recs = allocation.allocate(
+                db, payload.qty_kg, min_vs=payload.min_vs, crop=payload.crop, location=payload.location,
+                lat=coords[0] if coords else None, lon=coords[1] if coords else None, max_km=payload.max_km,
+                min_lot_kg=payload.min_lot_kg, max_unit_price=payload.max_unit_price, max_lots=payload.max_lots,
+                strategy=payload.strategy, weights=payload.weights, freight=payload.freight,
+                allow_partial=payload.allow_partial, dry_run=payload.dry_run,
+                buyer_name=payload.buyer_name, buyer_phone=payload.buyer_phone,
+                buyer_location=payload.buyer_location)
+        except allocation.Unfillable as e:
+            raise HTTPException(status_code=409, detail={"message": str(e), "requested_kg": e.requested,
+                                                         "available_kg": round(e.available, 3)})
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+        if payload.dry_run:
+            db.rollback()
+            return body
+        stock_updates = [events.stock_event(rec) for rec in recs]
+        body["message"] = "Order placed" if order is not None else "No matching stock"
+        idem.remember(db, body)
+        db.commit()
+
+    except (HTTPException, IntegrityError) as e:
+        db.rollback()
+        try:
+            stored = idem.lookup(db)
+        except ValueError as conflict:
+            raise HTTPException(status_code=422, detail=str(conflict))
+        if stored is not None:
+            response.headers[idempotency.REPLAY_HEADER] = "true"
+            return stored
+        if isinstance(e, HTTPException):
+            raise
+        raise HTTPException(status_code=500, detail=f"Internal error allocating order: {e}")
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(status_code=500, detail=f"Internal error allocating order: {e}")
+
+    for ev in stock_updates:
+        events.publish("stock", ev)
+    idem.committed(db)
+
+    return body
 
 
 @router.get("/orders")
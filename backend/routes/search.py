@@ -0,0 +1,36 @@
+# backend/routes/search.py
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+
+from database import get_db
+import search
+
+router = APIRouter(prefix="/api/v1/search", tags=["Search"])
+
+
+@router.get("")
+def search_all(
+    q: str = Query(..., min_length=1, max_length=100, description="Words or prefixes of farmer name, phone, village"),
+    kind: str = Query("records,users", description="Comma-separated: records, users"),
+    limit: int = Query(20, ge=1, le=100),
+    db: Session = Depends(get_db),
+):
+    """Full-text search (every word matches as a prefix), best matches first."""
+    kinds = tuple(k.strip() for k in kind.split(",") if k.strip())
+    unknown = [k for k in kinds if k not in ("records", "users")]
+    if unknown or not kinds:
+        raise HTTPException(400, "kind must be records, users or both")
+    return search.search(db, q, kinds, limit)
+
+
+@router.get("/autocomplete")
+def autocomplete(
+    field: str = Query(..., description="phone or location"),
+    prefix: str = Query(..., min_length=1, max_length=50),
+    limit: int = Query(10, ge=1, le=search.TOP_K),
+    db: Session = Depends(get_db),
+):
+    """Most common phone numbers / locations starting with `prefix`."""
+    if field not in search.FIELDS:
+        raise HTTPException(400, f"field must be one of: {', '.join(search.FIELDS)}")
+    return {"field": field, "prefix": prefix, "suggestions": search.autocomplete(db, field, prefix, limit)}
@@ -0,0 +1,28 @@
+# backend/routes/stats.py
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+
+from database import get_db
+import stats
+
+router = APIRouter(prefix="/api/v1", tags=["Stats"])
+
+
+@router.get("/stats")
+def get_stats(
+    by: str = Query("location", description="Comma-separated breakdowns: location, day, farmer (or empty)"),
+    limit: int = Query(20, ge=1, le=500),
+    db: Session = Depends(get_db),
+):
+    """
+    Marketplace totals plus per-location / per-day / per-farmer breakdowns,
+    read from the precomputed market_stats table (no scan of records).
+    """
+    scopes = [s.strip() for s in by.split(",") if s.strip()]
+    unknown = [s for s in scopes if s not in stats.SCOPES]
+    if unknown:
+        raise HTTPException(400, f"Unknown breakdown(s): {', '.join(unknown)}. Use: {', '.join(stats.SCOPES)}")
+    out = {"totals": stats.totals(db)}
+    for s in scopes:
+        out[f"by_{s}"] = stats.breakdown(db, s, limit)
+    return out
@@ -0,0 +1,30 @@
+# backend/routes/stream.py
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+
+import events
+
+router = APIRouter(prefix="/api/v1/stream", tags=["Stream"])
+
+
+@router.get("/stock")
+async def stock_feed(
+    request: Request,
+    last_event_id: Optional[str] = Header(None),
+    since: Optional[str] = Query(None, description="Replay events after this id (same as Last-Event-ID)"),
+):
+    """
+    Server-Sent Events: `record` (new listing), `stock` (available_kg / price changed)
+    and `resync` (state changed too much; refetch /api/v1/records).
+    """
+    try:
+        sub = events.BROKER.subscribe(since or last_event_id)
+    except OverflowError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "30"})
+    return StreamingResponse(
+        events.BROKER.stream(sub, request.is_disconnected),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
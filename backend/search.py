@@ -0,0 +1,295 @@
+# backend/search.py
+"""
+Search over records and users (farmer name, phone, village).
+
+Full text uses the database's own index so it stays correct for every writer:
+  - SQLite: FTS5 tables records_fts / users_fts (external content), kept in
+    sync by triggers on the base tables; prefix queries hit FTS5 prefix indexes.
+  - MySQL:  FULLTEXT indexes on the base tables, queried in BOOLEAN MODE.
+  - other:  LIKE fallback.
+
+Autocomplete for phone numbers and locations is served from in-memory prefix
+tries whose nodes cache their top completions, so a lookup is one walk down
+the prefix. save_record / register add to the tries directly; the tries are
+rebuilt in the background every TRIE_TTL_S so other workers' writes show up.
+
+    search.ensure_index(engine)        # startup
+    search.search(db, "ram 98")        # full text
+    search.autocomplete(db, "phone", "98")  # prefix
+"""
+import heapq
+import os
+import re
+import sys
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import func, or_, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from database import Record, User
+
+TRIE_TTL_S = float(os.getenv("SEARCH_TRIE_TTL_S", "300"))
+TOP_K = 20                  # completions cached per trie node (max autocomplete limit)
+BUCKET_DEPTH = 4            # trie depth; longer keys are bucketed under their 4-character prefix
+FIELDS = ("phone", "location")
+
+_FTS = {
+    "records": ("records_fts", ("farmer_name", "location", "phone")),
+    "users": ("users_fts", ("name", "location", "phone")),
+}
+_MODE = None                # "fts5" | "fulltext" | "like", set by ensure_index()
+
+
+# --------------------------
+# Index setup
+# --------------------------
+def _sqlite_ddl(base: str, fts: str, cols: Tuple[str, ...]) -> List[str]:
+    c = ", ".join(cols)
+    new = ", ".join(f"new.{x}" for x in cols)
+    old = ", ".join(f"old.{x}" for x in cols)
+    return [
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({c}, content='{base}', content_rowid='id', "
+        f"tokenize='unicode61', prefix='2 3 4')",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {base} BEGIN "
+        f"INSERT INTO {fts}(rowid, {c}) VALUES (new.id, {new}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {base} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {c}) VALUES ('delete', old.id, {old}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {c} ON {base} BEGIN "
+        f"INSERT INTO {fts}({fts}, rowid, {c}) VALUES ('delete', old.id, {old}); "
+        f"INSERT INTO {fts}(rowid, {c}) VALUES (new.id, {new}); END",
+    ]
+
+
+def ensure_index(engine: Engine):
+    """Create the full-text index for this database (idempotent) and backfill it if it is new."""
+    global _MODE
+    dialect = engine.dialect.name
+    try:
+        if dialect == "sqlite":
+            with engine.begin() as conn:
+                for base, (fts, cols) in _FTS.items():
+                    existed = conn.execute(text("SELECT 1 FROM sqlite_master WHERE name = :n"), {"n": fts}).first()
+                    for ddl in _sqlite_ddl(base, fts, cols):
+                        conn.execute(text(ddl))
+                    if not existed:
+                        conn.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+                        print(f"✅ Built full-text index {fts}")
+            _MODE = "fts5"
+        elif dialect == "mysql":
+            with engine.begin() as conn:
+                for base, (fts, cols) in _FTS.items():
+                    have = conn.execute(text(f"SHOW INDEX FROM {base} WHERE Key_name = :n"), {"n": fts}).first()
+                    if not have:
+                        conn.execute(text(f"ALTER TABLE {base} ADD FULLTEXT INDEX {fts} ({', '.join(cols)})"))
+                        print(f"✅ Built full-text index {base}.{fts}")
+            _MODE = "fulltext"
+        else:
+            _MODE = "like"
+    except Exception as e:
+        print("⚠️ Full-text index unavailable, falling back to LIKE:", e, file=sys.stderr)
+        _MODE = "like"
+
+
+# --------------------------
+# Full-text search
+# --------------------------
+def tokens(q: str) -> List[str]:
+    return re.findall(r"\w+", (q or "").lower())[:8]
+
+
+def _match_ids(db: Session, kind: str, toks: List[str], limit: int) -> List[int]:
+    base, (fts, cols) = kind, _FTS[kind]
+    if _MODE == "fts5":
+        expr = " ".join(f'"{t}"*' for t in toks)         # every token, as a prefix
+        rows = db.execute(text(f"SELECT rowid FROM {fts} WHERE {fts} MATCH :q ORDER BY rank LIMIT :n"),
+                          {"q": expr, "n": limit})
+        return [r[0] for r in rows]
+    if _MODE == "fulltext":
+        expr = " ".join(f"+{t}*" for t in toks)
+        rows = db.execute(text(f"SELECT id FROM {base} WHERE MATCH({', '.join(cols)}) AGAINST (:q IN BOOLEAN MODE) "
+                               f"ORDER BY MATCH({', '.join(cols)}) AGAINST (:q IN BOOLEAN MODE) DESC LIMIT :n"),
+                          {"q": expr, "n": limit})
+        return [r[0] for r in rows]
+    model = Record if kind == "records" else User
+    conds = [or_(*[func.lower(getattr(model, c)).like(f"%{t}%") for c in cols]) for t in toks]
+    return [r[0] for r in db.query(model.id).filter(*conds).order_by(model.id.desc()).limit(limit)]
+
+
+def search(db: Session, q: str, kinds=("records", "users"), limit: int = 20) -> Dict[str, List[Dict]]:
+    toks = tokens(q)
+    out: Dict[str, List[Dict]] = {k: [] for k in kinds}
+    if not toks:
+        return out
+    if "records" in kinds:
+        ids = _match_ids(db, "records", toks, limit)
+        by_id = {r.id: r for r in db.query(Record).filter(Record.id.in_(ids))} if ids else {}
+        out["records"] = [{
+            "id": r.id, "farmer_name": r.farmer_name, "location": r.location, "phone": r.phone,
+            "crop": r.crop, "mass_kg": r.mass_kg, "available_kg": r.available_kg,
+            "revenue_estimate": r.revenue_estimate, "timestamp": r.timestamp,
+        } for r in (by_id.get(i) for i in ids) if r is not None]
+    if "users" in kinds:
+        ids = _match_ids(db, "users", toks, limit)
+        by_id = {u.id: u for u in db.query(User).filter(User.id.in_(ids))} if ids else {}
+        out["users"] = [{"id": u.id, "name": u.name, "role": u.role, "phone": u.phone, "location": u.location}
+                        for u in (by_id.get(i) for i in ids) if u is not None]
+    return out
+
+
+# --------------------------
+# Prefix tries (autocomplete)
+# --------------------------
+class _Node:
+    __slots__ = ("children", "top", "bucket")
+
+    def __init__(self):
+        self.children: Dict[str, "_Node"] = {}
+        self.top: List[Tuple[int, str]] = []     # best (count, key) completions, best first
+        self.bucket: List[str] = []              # keys longer than BUCKET_DEPTH below this node
+
+
+class PrefixTrie:
+    """
+    Counted keys (lowercase; phones as digits) with their display values.
+    Nodes exist for the first BUCKET_DEPTH characters and cache their top-K
+    completions, so short prefixes are answered by one walk; longer keys hang
+    in the bucket of their deepest node and are filtered on demand.
+    """
+    __slots__ = ("root", "counts")
+
+    def __init__(self, counts: Optional[Dict[str, List]] = None):
+        self.root = _Node()
+        self.counts: Dict[str, List] = {}        # key -> [count, display value]
+        if counts:
+            self._bulk_load(counts)
+
+    def _path(self, key: str) -> List[_Node]:
+        node, path = self.root, [self.root]
+        for ch in key[:BUCKET_DEPTH]:
+            nxt = node.children.get(ch)
+            if nxt is None:
+                nxt = node.children[ch] = _Node()
+            node = nxt
+            path.append(node)
+        return path
+
+    def _bulk_load(self, counts: Dict[str, List]):
+        heaps: Dict[int, Tuple[_Node, List]] = {}
+        for key, (n, value) in counts.items():
+            self.counts[key] = [n, value]
+            path = self._path(key)
+            if len(key) > BUCKET_DEPTH:
+                path[-1].bucket.append(key)
+            for node in path:
+                h = heaps.setdefault(id(node), (node, []))[1]
+                if len(h) < TOP_K:
+                    heapq.heappush(h, (n, key))
+                elif (n, key) > h[0]:
+                    heapq.heapreplace(h, (n, key))
+        for node, h in heaps.values():
+            node.top = sorted(h, reverse=True)
+
+    def add(self, key: str, value: str, n: int = 1):
+        entry = self.counts.get(key)
+        if entry is None:
+            entry = self.counts[key] = [0, value]
+            if len(key) > BUCKET_DEPTH:
+                self._path(key)[-1].bucket.append(key)
+        entry[0] += n
+        for node in self._path(key):
+            top = [t for t in node.top if t[1] != key]
+            top.append((entry[0], key))
+            top.sort(reverse=True)
+            node.top = top[:TOP_K]
+
+    def complete(self, prefix: str, k: int = TOP_K) -> List[Dict]:
+        node = self.root
+        for ch in prefix[:BUCKET_DEPTH]:
+            node = node.children.get(ch)
+            if node is None:
+                return []
+        if len(prefix) <= BUCKET_DEPTH:
+            best = node.top[:k]
+        else:
+            best = heapq.nlargest(k, ((self.counts[key][0], key) for key in node.bucket if key.startswith(prefix)))
+        return [{"value": self.counts[key][1], "count": c} for c, key in best]
+
+
+def normalize(field: str, value: Optional[str]) -> str:
+    if not value:
+        return ""
+    if field == "phone":
+        return re.sub(r"\D", "", value)
+    return " ".join(value.lower().split())
+
+
+def _display(field: str, value: str) -> str:
+    return value.strip() if field == "phone" else " ".join(value.split())
+
+
+_TRIES: Dict[str, PrefixTrie] = {}
+_BUILT_AT = 0.0
+_TRIE_LOCK = threading.Lock()
+_REFRESHING = threading.Event()
+
+
+def build_tries(db: Session) -> Dict[str, PrefixTrie]:
+    """Phone / location counts over records and users, grouped in the database."""
+    tries = {}
+    for field in FIELDS:
+        counts: Dict[str, List] = {}
+        for model in (Record, User):
+            col = getattr(model, field)
+            for value, n in db.query(col, func.count()).filter(col.isnot(None)).group_by(col):
+                key = normalize(field, value)
+                if not key:
+                    continue
+                entry = counts.setdefault(key, [0, _display(field, value)])
+                entry[0] += n
+        tries[field] = PrefixTrie(counts)
+    return tries
+
+
+def _install(tries: Dict[str, PrefixTrie]):
+    global _TRIES, _BUILT_AT
+    with _TRIE_LOCK:
+        _TRIES, _BUILT_AT = tries, time.monotonic()
+
+
+def _refresh_in_background():
+    from database import SessionLocal
+    db = SessionLocal()
+    try:
+        _install(build_tries(db))
+    except Exception as e:
+        print("⚠️ Autocomplete refresh failed:", e, file=sys.stderr)
+    finally:
+        db.close()
+        _REFRESHING.clear()
+
+
+def autocomplete(db: Session, field: str, prefix: str, limit: int = TOP_K) -> List[Dict]:
+    if not _TRIES:
+        _install(build_tries(db))
+    elif time.monotonic() - _BUILT_AT > TRIE_TTL_S and not _REFRESHING.is_set():
+        # serve the current tries while a fresh copy is built
+        _REFRESHING.set()
+        threading.Thread(target=_refresh_in_background, name="search-tries", daemon=True).start()
+    key = normalize(field, prefix)
+    if not key:
+        return []
+    return _TRIES[field].complete(key, limit)
+
+
+def note(phone: Optional[str], location: Optional[str]):
+    """Count a just-committed record / user in the tries (full text is synced by the database)."""
+    if not _TRIES:
+        return
+    with _TRIE_LOCK:
+        for field, value in (("phone", phone), ("location", location)):
+            key = normalize(field, value)
+            if key:
+                _TRIES[field].add(key, _display(field, value))
@@ -0,0 +1,306 @@
+# backend/stats.py
+"""
+Incrementally maintained marketplace aggregates (table market_stats).
+
+Every write path that changes totals calls one of the hooks below inside its
+own transaction, so the aggregates commit or roll back together with the
+record / order. Increments are issued as upserts (`INSERT ... ON DUPLICATE
+KEY UPDATE x = x + VALUES(x)` on MySQL, `ON CONFLICT ... DO UPDATE` on
+SQLite), which the database applies atomically, so concurrent requests cannot
+lose updates. Dashboards then read a handful of rows instead of scanning records.
+
+    stats.record_added(db, rec)          # save_record
+    stats.records_added_many(db, recs)   # bulk import, once per chunk
+    stats.sale(db, rec, qty, line_total) # per order item
+    stats.order_placed(db)               # once per order
+    stats.repriced_many(db, changes)     # repricing job, once per chunk
+    stats.rebuild(db)                    # recompute from scratch (admin / migration)
+"""
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import DateTime, bindparam, case, func, insert, update
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from database import MarketStat, Record, Order, OrderItem
+
+SCOPES = ("location", "day", "farmer")
+_SUM_COLUMNS = ("records", "farmers", "orders", "mass_kg", "available_kg",
+                "biogas_m3", "revenue", "sold_kg", "sales_value")
+_T = MarketStat.__table__
+
+
+# --------------------------
+# Bucketing
+# --------------------------
+def location_key(location: Optional[str]) -> str:
+    return (location or "").strip().lower()[:120] or "(unknown)"
+
+
+def farmer_key(phone: Optional[str], name: Optional[str]) -> str:
+    return ((phone or "").strip() or (name or "").strip().lower())[:120] or "(unknown)"
+
+
+def day_key(ts) -> str:
+    return ts.date().isoformat() if ts is not None else "(unknown)"
+
+
+def buckets_for(rec: Record) -> List[Tuple[str, str]]:
+    return [
+        ("all", ""),
+        ("location", location_key(rec.location)),
+        ("day", day_key(rec.timestamp)),
+        ("farmer", farmer_key(rec.phone, rec.farmer_name)),
+    ]
+
+
+# --------------------------
+# Increments
+# --------------------------
+def _bump(db: Session, scope: str, bucket: str, deltas: Dict[str, float], last_at=None) -> bool:
+    """
+    Add `deltas` to one aggregate row, creating it if needed, in one upsert
+    statement. Returns True if the row was created.
+
+    A separate UPDATE then INSERT would deadlock on MySQL (InnoDB): an UPDATE
+    that matches nothing takes a gap lock, so two first writes to the same new
+    bucket block each other's INSERT.
+    """
+    row = {k: 0 for k in _SUM_COLUMNS}
+    row.update(deltas)
+    dialect = db.get_bind().dialect.name
+    if dialect == "mysql":
+        stmt = mysql_insert(_T).values(scope=scope, bucket=bucket, last_record_at=last_at, **row)
+        new = stmt.inserted                                  # VALUES(col)
+    elif dialect == "sqlite":
+        stmt = sqlite_insert(_T).values(scope=scope, bucket=bucket, last_record_at=last_at, **row)
+        new = stmt.excluded
+    else:
+        return _bump_portable(db, scope, bucket, deltas, last_at)
+
+    values = {k: _T.c[k] + new[k] for k in deltas}
+    if last_at is not None:
+        values["last_record_at"] = case(
+            ((_T.c.last_record_at.is_(None)) | (_T.c.last_record_at < new.last_record_at), new.last_record_at),
+            else_=_T.c.last_record_at)
+    if dialect == "mysql":
+        # affected rows: 1 = inserted, 2 = updated
+        return db.execute(stmt.on_duplicate_key_update(**values)).rowcount == 1
+    # SQLite cannot say which branch ran; a bucket is new when it holds only this increment's records
+    records = db.execute(stmt.on_conflict_do_update(index_elements=[_T.c.scope, _T.c.bucket], set_=values)
+                         .returning(_T.c.records)).scalar()
+    return "records" in deltas and records == deltas["records"]
+
+
+def _bump_portable(db: Session, scope: str, bucket: str, deltas: Dict[str, float], last_at=None) -> bool:
+    """_bump for databases without an upsert dialect here: UPDATE, else INSERT in a savepoint."""
+    values = {k: _T.c[k] + v for k, v in deltas.items()}
+    if last_at is not None:
+        values["last_record_at"] = case(
+            ((_T.c.last_record_at.is_(None)) | (_T.c.last_record_at < last_at), last_at),
+            else_=_T.c.last_record_at)
+    where = (_T.c.scope == scope) & (_T.c.bucket == bucket)
+    if db.execute(update(_T).where(where).values(**values)).rowcount:
+        return False
+    row = {k: 0 for k in _SUM_COLUMNS}
+    row.update(deltas)
+    try:
+        with db.begin_nested():
+            db.execute(insert(_T).values(scope=scope, bucket=bucket, last_record_at=last_at, **row))
+        return True
+    except IntegrityError:
+        # another transaction created the row first; fall back to the increment
+        db.execute(update(_T).where(where).values(**values))
+        return False
+
+
+def record_added(db: Session, rec: Record):
+    deltas = {
+        "records": 1,
+        "mass_kg": rec.mass_kg or 0.0,
+        "available_kg": rec.available_kg if rec.available_kg is not None else (rec.mass_kg or 0.0),
+        "biogas_m3": rec.predicted_m3_biogas or 0.0,
+        "revenue": rec.revenue_estimate or 0.0,
+    }
+    for scope, bucket in buckets_for(rec):
+        created = _bump(db, scope, bucket, deltas, last_at=rec.timestamp)
+        if created and scope == "farmer":
+            _bump(db, "all", "", {"farmers": 1})
+
+
+_ADDED = ("records", "mass_kg", "available_kg", "biogas_m3", "revenue")
+_LAST = bindparam("_last", type_=DateTime)
+_UPDATE_ADDED = (
+    update(_T)
+    .where((_T.c.scope == bindparam("_scope")) & (_T.c.bucket == bindparam("_bucket")))
+    .values(**{k: _T.c[k] + bindparam(f"_{k}") for k in _ADDED},
+            last_record_at=case(((_LAST.isnot(None)) & ((_T.c.last_record_at.is_(None))
+                                                       | (_T.c.last_record_at < _LAST)), _LAST),
+                                else_=_T.c.last_record_at))
+)
+
+
+def records_added_many(db: Session, recs: Iterable[Record]):
+    """
+    record_added for a batch (bulk import). Deltas are summed per bucket, then
+    existing rows get one executemany UPDATE and new rows one executemany INSERT,
+    instead of a statement or two per bucket.
+    """
+    acc: Dict[Tuple[str, str], List] = {}
+    for rec in recs:
+        d = (1, rec.mass_kg or 0.0, rec.available_kg if rec.available_kg is not None else (rec.mass_kg or 0.0),
+             rec.predicted_m3_biogas or 0.0, rec.revenue_estimate or 0.0)
+        for key in buckets_for(rec):
+            a = acc.get(key)
+            if a is None:
+                a = acc[key] = [0, 0.0, 0.0, 0.0, 0.0, None]
+            for i, v in enumerate(d):
+                a[i] += v
+            if rec.timestamp is not None and (a[5] is None or rec.timestamp > a[5]):
+                a[5] = rec.timestamp
+    if not acc:
+        return
+
+    existing = set()
+    by_scope: Dict[str, List[str]] = {}
+    for scope, bucket in acc:
+        by_scope.setdefault(scope, []).append(bucket)
+    for scope, buckets in by_scope.items():
+        for i in range(0, len(buckets), 500):
+            existing.update(db.query(MarketStat.scope, MarketStat.bucket)
+                            .filter(MarketStat.scope == scope, MarketStat.bucket.in_(buckets[i:i + 500])))
+
+    def params(key):
+        a = acc[key]
+        return {"_scope": key[0], "_bucket": key[1], "_last": a[5], **{f"_{k}": v for k, v in zip(_ADDED, a)}}
+
+    old = [k for k in acc if k in existing]
+    new = [k for k in acc if k not in existing]
+    if old:
+        db.execute(_UPDATE_ADDED, [params(k) for k in old])
+    created_farmers = 0
+    if new:
+        rows = [{**{k: 0 for k in _SUM_COLUMNS}, "scope": s, "bucket": b, "last_record_at": acc[(s, b)][5],
+                 **dict(zip(_ADDED, acc[(s, b)]))} for s, b in new]
+        try:
+            with db.begin_nested():
+                db.execute(insert(_T), rows)
+            created_farmers = sum(1 for s, _ in new if s == "farmer")
+        except IntegrityError:
+            # another writer created some of these rows meanwhile; go row by row
+            for scope, bucket in new:
+                a = acc[(scope, bucket)]
+                if _bump(db, scope, bucket, dict(zip(_ADDED, a)), last_at=a[5]) and scope == "farmer":
+                    created_farmers += 1
+    if created_farmers:
+        _bump(db, "all", "", {"farmers": created_farmers})
+
+
+def sale(db: Session, rec: Record, qty_kg: float, line_total: float):
+    deltas = {"available_kg": -qty_kg, "sold_kg": qty_kg, "sales_value": line_total}
+    for scope, bucket in buckets_for(rec):
+        _bump(db, scope, bucket, deltas)
+
+
+def order_placed(db: Session):
+    _bump(db, "all", "", {"orders": 1})
+
+
+def record_repriced(db: Session, rec: Record, d_biogas: float, d_revenue: float):
+    if not d_biogas and not d_revenue:
+        return
+    for scope, bucket in buckets_for(rec):
+        _bump(db, scope, bucket, {"biogas_m3": d_biogas, "revenue": d_revenue})
+
+
+def repriced_many(db: Session, changes: Iterable[Tuple[Record, float, float]]):
+    """record_repriced for a batch: deltas are summed per bucket so each row is bumped once."""
+    acc: Dict[Tuple[str, str], List[float]] = {}
+    for rec, d_biogas, d_revenue in changes:
+        for key in buckets_for(rec):
+            a = acc.setdefault(key, [0.0, 0.0])
+            a[0] += d_biogas
+            a[1] += d_revenue
+    for (scope, bucket), (d_biogas, d_revenue) in acc.items():
+        if d_biogas or d_revenue:
+            _bump(db, scope, bucket, {"biogas_m3": d_biogas, "revenue": d_revenue})
+
+
+# --------------------------
+# Full rebuild
+# --------------------------
+def rebuild(db: Session, chunk: int = 5000) -> int:
+    """Recompute every aggregate from records / orders, streaming records in chunks. Commits."""
+    acc: Dict[Tuple[str, str], Dict] = {}
+
+    def row(key):
+        r = acc.get(key)
+        if r is None:
+            r = acc[key] = {k: 0 for k in _SUM_COLUMNS}
+            r["last_record_at"] = None
+        return r
+
+    sold = dict(db.query(OrderItem.record_id, func.sum(OrderItem.qty_kg)).group_by(OrderItem.record_id).all())
+    value = dict(db.query(OrderItem.record_id, func.sum(OrderItem.line_total)).group_by(OrderItem.record_id).all())
+    q = db.query(Record.id, Record.location, Record.phone, Record.farmer_name, Record.timestamp,
+                 Record.mass_kg, Record.available_kg, Record.predicted_m3_biogas, Record.revenue_estimate)
+    for rid, loc, phone, name, ts, mass, avail, biogas, revenue in q.yield_per(chunk):
+        keys = [("all", ""), ("location", location_key(loc)), ("day", day_key(ts)), ("farmer", farmer_key(phone, name))]
+        for key in keys:
+            r = row(key)
+            r["records"] += 1
+            r["mass_kg"] += mass or 0.0
+            r["available_kg"] += avail if avail is not None else (mass or 0.0)
+            r["biogas_m3"] += biogas or 0.0
+            r["revenue"] += revenue or 0.0
+            r["sold_kg"] += sold.get(rid) or 0.0
+            r["sales_value"] += value.get(rid) or 0.0
+            if ts is not None and (r["last_record_at"] is None or ts > r["last_record_at"]):
+                r["last_record_at"] = ts
+    totals = row(("all", ""))
+    totals["farmers"] = sum(1 for s, _ in acc if s == "farmer")
+    totals["orders"] = db.query(func.count(Order.id)).scalar() or 0
+
+    db.query(MarketStat).delete()
+    rows = [{"scope": s, "bucket": b, **r} for (s, b), r in acc.items()]
+    for i in range(0, len(rows), chunk):
+        db.execute(insert(_T), rows[i:i + chunk])
+    db.commit()
+    return len(rows)
+
+
+def ensure_built(db: Session):
+    """Build the aggregates once for databases that predate market_stats."""
+    if db.query(MarketStat).first() is None and db.query(Record.id).first() is not None:
+        n = rebuild(db)
+        print(f"✅ Built market_stats ({n} rows) from existing records.")
+
+
+# --------------------------
+# Reads
+# --------------------------
+def _as_dict(r: MarketStat, with_bucket: bool = True) -> Dict:
+    out = {"records": r.records, "mass_kg": round(r.mass_kg, 3), "available_kg": round(r.available_kg, 3),
+           "biogas_m3": round(r.biogas_m3, 3), "revenue": round(r.revenue, 2),
+           "sold_kg": round(r.sold_kg, 3), "sales_value": round(r.sales_value, 2),
+           "last_record_at": r.last_record_at}
+    if with_bucket:
+        out = {"key": r.bucket, **out}
+    return out
+
+
+def totals(db: Session) -> Dict:
+    r = db.get(MarketStat, ("all", ""))
+    if r is None:
+        return {"records": 0, "farmers": 0, "orders": 0, "mass_kg": 0.0, "available_kg": 0.0, "biogas_m3": 0.0,
+                "revenue": 0.0, "sold_kg": 0.0, "sales_value": 0.0, "last_record_at": None}
+    return {"farmers": r.farmers, "orders": r.orders, **_as_dict(r, with_bucket=False)}
+
+
+def breakdown(db: Session, scope: str, limit: int = 50) -> List[Dict]:
+    order = MarketStat.bucket.desc() if scope == "day" else MarketStat.revenue.desc()
+    rows: Iterable[MarketStat] = (db.query(MarketStat).filter(MarketStat.scope == scope)
+                                  .order_by(order).limit(limit).all())
+    return [_as_dict(r) for r in rows]
@@ -0,0 +1,271 @@
+# backend/yield_engine.py
+"""
+Server-side biogas / methane / revenue estimation.
+
+Parameters come from two places:
+  - data/config.json (admin page): PRICE_PER_M3, DEFAULT_YIELD_PER_KGVS,
+    DEFAULT_METHANE_FRACTION
+  - data/yield_params.json: per-crop yield (m³ biogas per kg VS) and methane
+    fraction, plus multiplicative factors per moisture band. A crop without its
+    own yield / methane value uses the admin defaults, and the default crop
+    (banana) ships with band factors of 1.0, so it prices exactly as the admin
+    page says whatever the moisture.
+
+The table is compiled into NumPy arrays (crop x band), cached in memory and
+reloaded when the file changes; its version (file "version" + content hash) is
+stored on every record it prices. compute() is vectorized so /predict, record
+saves and the repricing job share exactly one implementation:
+
+    biogas_m3  = round(mass_kg * vs_fraction * yield[crop, band], 3)
+    ch4_m3     = round(biogas_m3 * methane[crop], 3)
+    revenue    = round(biogas_m3 * PRICE_PER_M3, 2)
+"""
+import hashlib
+import json
+import os
+import sys
+import threading
+from pathlib import Path
+from typing import Dict, Optional, Sequence, Union
+
+import numpy as np
+
+import metrics
+from atomic import atomic_write
+
+ROOT = Path(__file__).resolve().parent
+DATA_DIR = ROOT / "data"
+CONFIG_PATH = DATA_DIR / "config.json"
+PARAMS_PATH = DATA_DIR / "yield_params.json"
+
+FALLBACK_CONFIG: Dict[str, float] = {
+    "PRICE_PER_M3": 50.0,
+    "DEFAULT_YIELD_PER_KGVS": 0.20,
+    "DEFAULT_METHANE_FRACTION": 0.55,
+}
+
+# used when data/yield_params.json is missing: the default crop only
+DEFAULT_PARAMS = {
+    "version": "builtin",
+    "default_crop": "banana",
+    "moisture_bands": [
+        {"name": "dry", "max_percent": 50},
+        {"name": "optimal", "max_percent": 85},
+        {"name": "wet", "max_percent": 100},
+    ],
+    "crops": {
+        "banana": {"yield_per_kgvs": None, "methane_fraction": None,
+                   "band_factors": {"dry": 1.0, "optimal": 1.0, "wet": 1.0}},
+    },
+}
+
+
+# --------------------------
+# Admin config (data/config.json)
+# --------------------------
+# (mtime_ns, parsed config) — re-read config.json only when it changes on disk
+_CONFIG_CACHE = None
+
+
+def load_config() -> Dict[str, float]:
+    """
+    Load JSON config from data/config.json. If missing, create default file.
+    Returns a dict with keys PRICE_PER_M3, DEFAULT_YIELD_PER_KGVS, DEFAULT_METHANE_FRACTION.
+    """
+    global _CONFIG_CACHE
+    try:
+        if not CONFIG_PATH.exists():
+            save_config(FALLBACK_CONFIG)
+            return FALLBACK_CONFIG.copy()
+
+        mtime = CONFIG_PATH.stat().st_mtime_ns
+        if _CONFIG_CACHE is not None and _CONFIG_CACHE[0] == mtime:
+            metrics.cache_hit("config")
+            return dict(_CONFIG_CACHE[1])
+        metrics.cache_miss("config")
+
+        raw = CONFIG_PATH.read_text(encoding="utf-8")
+        cfg = json.loads(raw)
+        # ensure keys exist and have sensible defaults
+        for k, v in FALLBACK_CONFIG.items():
+            if k not in cfg:
+                cfg[k] = v
+        _CONFIG_CACHE = (mtime, cfg)
+        return dict(cfg)
+    except Exception:
+        return FALLBACK_CONFIG.copy()
+
+
+def save_config(cfg: Dict[str, float]):
+    """Atomically replace data/config.json (readers never see a half-written file)."""
+    with atomic_write(CONFIG_PATH, "w", encoding="utf-8") as f:
+        json.dump({k: float(cfg[k]) for k in FALLBACK_CONFIG}, f, indent=4)
+
+
+# --------------------------
+# Parameter table
+# --------------------------
+class YieldTable:
+    """yield_params.json compiled to (n_crops, n_bands + 1) arrays; the extra band is "moisture unknown"."""
+
+    def __init__(self, spec: Dict, version: str):
+        self.version = version
+        self.crops = list(spec["crops"])
+        if not self.crops:
+            raise ValueError("yield params define no crops")
+        self.default_crop = spec.get("default_crop") or self.crops[0]
+        if self.default_crop not in spec["crops"]:
+            raise ValueError(f"default_crop {self.default_crop!r} is not in crops")
+        self.crop_index = {c: i for i, c in enumerate(self.crops)}
+
+        bands = spec["moisture_bands"]
+        self.band_names = [b["name"] for b in bands] + ["unknown"]
+        self.band_edges = np.array([float(b["max_percent"]) for b in bands], dtype=np.float64)
+        if np.any(np.diff(self.band_edges) <= 0):
+            raise ValueError("moisture_bands must have increasing max_percent")
+
+        n_c, n_b = len(self.crops), len(self.band_names)
+        # NaN = take the admin default at compute time
+        self.yield_base = np.full(n_c, np.nan)
+        self.methane_base = np.full(n_c, np.nan)
+        self.factors = np.ones((n_c, n_b))
+        for i, crop in enumerate(self.crops):
+            c = spec["crops"][crop] or {}
+            if c.get("yield_per_kgvs") is not None:
+                self.yield_base[i] = float(c["yield_per_kgvs"])
+            if c.get("methane_fraction") is not None:
+                self.methane_base[i] = float(c["methane_fraction"])
+            for band, f in (c.get("band_factors") or {}).items():
+                if band not in self.band_names:
+                    raise ValueError(f"crop {crop!r}: unknown moisture band {band!r}")
+                self.factors[i, self.band_names.index(band)] = float(f)
+
+    def crop_ids(self, crops) -> np.ndarray:
+        """Indices for crop names; None/"" means the default crop. Raises ValueError on unknown crops."""
+        names, inverse = np.unique(np.array([c or "" for c in crops], dtype=str), return_inverse=True)
+        out = []
+        for c in names:         # a chunk usually holds a handful of distinct crops
+            key = normalize_crop(c) or self.default_crop
+            if key not in self.crop_index:
+                raise ValueError(f"Unknown crop '{c}'. Use one of: {', '.join(self.crops)}")
+            out.append(self.crop_index[key])
+        return np.array(out, dtype=np.int64)[inverse.reshape(-1)]
+
+    def band_ids(self, moisture: np.ndarray) -> np.ndarray:
+        idx = np.searchsorted(self.band_edges, moisture, side="left")
+        idx = np.minimum(idx, len(self.band_edges) - 1)          # > last edge stays in the last band
+        return np.where(np.isfinite(moisture), idx, len(self.band_names) - 1)
+
+    def describe(self) -> Dict:
+        return {
+            "version": self.version,
+            "default_crop": self.default_crop,
+            "moisture_bands": self.band_names[:-1],
+            "crops": {c: {"yield_per_kgvs": None if np.isnan(self.yield_base[i]) else float(self.yield_base[i]),
+                          "methane_fraction": None if np.isnan(self.methane_base[i]) else float(self.methane_base[i]),
+                          "band_factors": dict(zip(self.band_names[:-1], self.factors[i, :-1].tolist()))}
+                      for i, c in enumerate(self.crops)},
+        }
+
+
+def normalize_crop(crop: Optional[str]) -> str:
+    return (crop or "").strip().lower().replace(" ", "_")
+
+
+_TABLE = None               # (file signature, YieldTable)
+_TABLE_LOCK = threading.Lock()
+_BUILTIN = YieldTable(DEFAULT_PARAMS, "builtin")
+
+
+def table() -> YieldTable:
+    """Current parameter table, reloaded when yield_params.json changes; invalid files keep the last good table."""
+    global _TABLE
+    try:
+        st = PARAMS_PATH.stat()
+        sig = (st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
+        return _BUILTIN
+    cached = _TABLE
+    if cached is not None and cached[0] == sig:
+        return cached[1]
+    with _TABLE_LOCK:
+        if _TABLE is not None and _TABLE[0] == sig:
+            return _TABLE[1]
+        try:
+            raw = PARAMS_PATH.read_bytes()
+            spec = json.loads(raw)
+            version = f"{spec.get('version', 'v')}+{hashlib.sha256(raw).hexdigest()[:8]}"
+            t = YieldTable(spec, version)
+        except Exception as e:
+            print("⚠️ Ignoring invalid yield params:", e, file=sys.stderr)
+            t = _TABLE[1] if _TABLE is not None else _BUILTIN
+        _TABLE = (sig, t)
+        return t
+
+
+# --------------------------
+# Estimation
+# --------------------------
+ArrayLike = Union[float, Sequence[float], np.ndarray]
+
+
+def _floats(x, n: int) -> np.ndarray:
+    if isinstance(x, np.ndarray) and x.dtype.kind == "f":
+        a = x.astype(np.float64, copy=False).reshape(-1)
+        return np.broadcast_to(a, (n,)) if a.size == 1 else a
+    a = np.array([np.nan if v is None else v for v in np.atleast_1d(np.asarray(x, dtype=object))],
+                 dtype=np.float64)
+    return np.broadcast_to(a, (n,)) if a.size == 1 else a
+
+
+def compute(mass_kg: ArrayLike, vs_fraction: ArrayLike, moisture_percent: ArrayLike = None,
+            crops=None, cfg: Optional[Dict[str, float]] = None, tbl: Optional[YieldTable] = None) -> Dict[str, np.ndarray]:
+    """
+    Vectorized estimate for n records. Scalars broadcast; None/NaN mass or VS give 0 biogas.
+    Returns arrays: biogas_m3, ch4_m3, revenue, yield_per_kgvs, methane_fraction, band (index).
+    """
+    cfg = cfg or load_config()
+    tbl = tbl or table()
+    n = max(np.size(mass_kg), np.size(vs_fraction), np.size(moisture_percent) if moisture_percent is not None else 1,
+            1 if crops is None or isinstance(crops, str) else len(crops))
+    mass = _floats(mass_kg, n)
+    vs = _floats(vs_fraction, n)
+    moisture = _floats(np.nan if moisture_percent is None else moisture_percent, n)
+    crop_list = [crops] * n if crops is None or isinstance(crops, str) else list(crops)
+
+    ci = tbl.crop_ids(crop_list)
+    bi = tbl.band_ids(moisture)
+    y_base = np.where(np.isnan(tbl.yield_base), float(cfg["DEFAULT_YIELD_PER_KGVS"]), tbl.yield_base)
+    m_base = np.where(np.isnan(tbl.methane_base), float(cfg["DEFAULT_METHANE_FRACTION"]), tbl.methane_base)
+    yld = y_base[ci] * tbl.factors[ci, bi]
+    methane = np.clip(m_base[ci], 0.0, 1.0)
+
+    known = np.isfinite(mass) & np.isfinite(vs)
+    biogas = np.where(known, np.round(np.nan_to_num(mass) * np.nan_to_num(vs) * yld, 3), 0.0)
+    return {
+        "biogas_m3": biogas,
+        "ch4_m3": np.round(biogas * methane, 3),
+        "revenue": np.round(biogas * float(cfg["PRICE_PER_M3"]), 2),
+        "yield_per_kgvs": yld,
+        "methane_fraction": methane,
+        "band": bi,
+    }
+
+
+def estimate(mass_kg: Optional[float], vs_fraction: Optional[float], moisture_percent: Optional[float] = None,
+             crop: Optional[str] = None, cfg: Optional[Dict[str, float]] = None) -> Dict:
+    """compute() for one record, as JSON-ready values."""
+    cfg = cfg or load_config()
+    tbl = table()
+    r = compute(mass_kg, vs_fraction, moisture_percent, crop, cfg=cfg, tbl=tbl)
+    return {
+        "crop": normalize_crop(crop) or tbl.default_crop,
+        "moisture_band": tbl.band_names[int(r["band"][0])],
+        "yield_per_kgvs": round(float(r["yield_per_kgvs"][0]), 4),
+        "methane_fraction": round(float(r["methane_fraction"][0]), 4),
+        "predicted_m3_biogas": float(r["biogas_m3"][0]),
+        "predicted_m3_ch4": float(r["ch4_m3"][0]),
+        "price_per_m3": float(cfg["PRICE_PER_M3"]),
+        "revenue_estimate": float(r["revenue"][0]),
+        "yield_params_version": tbl.version,
+    }
@@ -0,0 +1,323 @@
+# benchmarks/bench_predict.py
+"""
+Benchmark the inference hot path.
+
+Drives backend/infer.py's predict_from_bytes directly (with a per-stage
+decode / transform / forward / postprocess breakdown) and the full
+POST /api/v1/predict endpoint through an in-process ASGI client, using
+synthetic JPEGs at several resolutions plus optional sample images.
+
+Results are written as JSON so two versions of backend/infer.py can be compared:
+
+    python benchmarks/bench_predict.py --out bench_old.json
+    (change backend/infer.py)
+    python benchmarks/bench_predict.py --out bench_new.json --baseline bench_old.json
+
+Without trained weights use --random-weights (latency does not depend on the weights).
+The endpoint benchmark needs httpx (pip install httpx).
+"""
+
+import argparse
+import asyncio
+import hashlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+ROOT = Path(__file__).resolve().parent.parent
+BACKEND = ROOT / "backend"
+sys.path.append(str(BACKEND))
+
+# main.py imports database.py; use an in-memory SQLite DB unless told otherwise
+os.environ.setdefault("DATABASE_URL", "sqlite://")
+
+import torch  # noqa: E402
+import infer  # noqa: E402
+
+IMG_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+DEFAULT_SIZES = ["320x320", "1280x960", "1920x1080", "4000x3000"]
+
+
+# --------------------------
+# Inputs
+# --------------------------
+def synthetic_jpeg(width: int, height: int, seed: int = 0) -> bytes:
+    """Deterministic residue-coloured gradient + noise, JPEG encoded like a phone photo."""
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[0:height, 0:width]
+    base = np.stack([
+        90 + 60 * xx / max(width - 1, 1),
+        70 + 40 * yy / max(height - 1, 1),
+        40 + 20 * (xx + yy) / max(width + height - 2, 1),
+    ], axis=-1)
+    noise = rng.normal(0, 12, size=base.shape)
+    arr = np.clip(base + noise, 0, 255).astype(np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(arr, "RGB").save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+
+def build_inputs(sizes, samples_dir, max_samples):
+    inputs = []
+    for s in sizes:
+        w, h = (int(v) for v in s.lower().split("x"))
+        inputs.append((f"synthetic_{w}x{h}", synthetic_jpeg(w, h)))
+    if samples_dir:
+        paths = sorted(p for p in Path(samples_dir).rglob("*") if p.is_file() and p.suffix.lower() in IMG_EXTS)
+        for p in paths[:max_samples]:
+            inputs.append((f"sample_{p.name}", p.read_bytes()))
+    return inputs
+
+
+# --------------------------
+# Stats helpers
+# --------------------------
+def summarize(samples_s):
+    ms = np.asarray(samples_s, dtype=np.float64) * 1000.0
+    return {
+        "p50": round(float(np.percentile(ms, 50)), 3),
+        "p95": round(float(np.percentile(ms, 95)), 3),
+        "p99": round(float(np.percentile(ms, 99)), 3),
+        "mean": round(float(ms.mean()), 3),
+        "n": int(ms.size),
+    }
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS reports bytes
+    return round(rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024, 1)
+
+
+def throughput(n, wall_s):
+    rps = n / wall_s if wall_s > 0 else 0.0
+    return round(rps, 3), round(rps / max(torch.get_num_threads(), 1), 3)
+
+
+# --------------------------
+# Benchmarks
+# --------------------------
+def bench_direct(name, data, iters, warmup, tier="fast"):
+    for _ in range(warmup):
+        infer.predict_from_bytes(data, tier)
+
+    # end-to-end predict_from_bytes latency
+    lat = []
+    t_wall = time.perf_counter()
+    for _ in range(iters):
+        t0 = time.perf_counter()
+        infer.predict_from_bytes(data, tier)
+        lat.append(time.perf_counter() - t0)
+    wall = time.perf_counter() - t_wall
+
+    # same pipeline, one stage at a time
+    spec = infer.TIERS[tier]
+    models_ = [infer.MODEL]
+    if spec["ensemble"]:
+        models_ += [m for m, v in infer.ensemble_members() if v != infer.MODEL_VERSION]
+    single = spec["views"] == 1 and len(models_) == 1
+    stages = {"decode": [], "transform": [], "forward": [], "postprocess": []}
+    for _ in range(iters):
+        t0 = time.perf_counter()
+        img = infer.decode_image(data)
+        t1 = time.perf_counter()
+        x = infer.preprocess(img) if spec["views"] == 1 else infer.preprocess_views(img, spec["views"])
+        t2 = time.perf_counter()
+        out = infer.forward(x) if single else infer.forward_batch(x, models_)
+        t3 = time.perf_counter()
+        infer.postprocess(out) if single else infer.aggregate(out)
+        t4 = time.perf_counter()
+        stages["decode"].append(t1 - t0)
+        stages["transform"].append(t2 - t1)
+        stages["forward"].append(t3 - t2)
+        stages["postprocess"].append(t4 - t3)
+
+    rps, per_core = throughput(iters, wall)
+    return {
+        "target": "predict_from_bytes",
+        "input": _input_key(name, tier),
+        "tier": tier,
+        "views": spec["views"],
+        "models": len(models_),
+        "bytes": len(data),
+        "latency_ms": summarize(lat),
+        "throughput_rps": rps,
+        "throughput_per_core": per_core,
+        "stages_ms": {k: summarize(v) for k, v in stages.items()},
+    }
+
+
+def _input_key(name, tier):
+    # baseline comparison keys on (target, input); keep "fast" keys unchanged
+    return name if tier == "fast" else f"{name}@{tier}"
+
+
+async def _bench_endpoint(app, name, data, iters, warmup, concurrency, tier="fast"):
+    import httpx
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def one():
+            t0 = time.perf_counter()
+            res = await client.post(
+                "/api/v1/predict",
+                files={"image": (f"{name}.jpg", data, "image/jpeg")},
+                data={"measured_weight": "2.5", "tier": tier},
+            )
+            dt = time.perf_counter() - t0
+            return dt, res.status_code
+
+        for _ in range(warmup):
+            await one()
+
+        lat, errors = [], 0
+        sem = asyncio.Semaphore(concurrency)
+
+        async def bounded():
+            nonlocal errors
+            async with sem:
+                dt, status = await one()
+                lat.append(dt)
+                if status != 200:
+                    errors += 1
+
+        t_wall = time.perf_counter()
+        await asyncio.gather(*(bounded() for _ in range(iters)))
+        wall = time.perf_counter() - t_wall
+
+    rps, per_core = throughput(iters, wall)
+    return {
+        "target": "POST /api/v1/predict",
+        "input": _input_key(name, tier),
+        "tier": tier,
+        "bytes": len(data),
+        "concurrency": concurrency,
+        "latency_ms": summarize(lat),
+        "throughput_rps": rps,
+        "throughput_per_core": per_core,
+        "errors": errors,
+    }
+
+
+def bench_endpoint(name, data, iters, warmup, concurrency, tier="fast"):
+    import main  # imported lazily: pulls in FastAPI + routers
+    import dedup
+    import image_store
+    # keep benchmark uploads out of the real near-duplicate log and image store
+    dedup.UPLOADS = dedup.UploadIndex(upload_log=Path(tempfile.gettempdir()) / "agrogas_bench_uploads.jsonl")
+    store = Path(tempfile.mkdtemp(prefix="agrogas_bench_images_"))
+    image_store.STORE_DIR, image_store.ORIGINALS_DIR = store, store / "originals"
+    image_store.THUMBS_DIR = image_store.THUMBS.root = store / "thumbs"
+    return asyncio.run(_bench_endpoint(main.app, name, data, iters, warmup, concurrency, tier))
+
+
+# --------------------------
+# Baseline comparison
+# --------------------------
+def compare(baseline_path, results, max_regression):
+    base = json.loads(Path(baseline_path).read_text(encoding="utf-8"))
+    index = {(r["target"], r["input"]): r for r in base.get("results", [])}
+    regressed = False
+    print(f"\nComparison with {baseline_path} (positive = slower):")
+    for r in results:
+        old = index.get((r["target"], r["input"]))
+        if not old:
+            continue
+        parts = []
+        for q in ("p50", "p95", "p99"):
+            a, b = old["latency_ms"][q], r["latency_ms"][q]
+            pct = (b - a) / a * 100.0 if a else 0.0
+            parts.append(f"{q} {a:.1f}->{b:.1f}ms ({pct:+.1f}%)")
+            if q == "p50" and max_regression is not None and pct > max_regression:
+                regressed = True
+        print(f"  {r['target']:<22} {r['input']:<24} " + " | ".join(parts))
+    return regressed
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark predict_from_bytes and /api/v1/predict")
+    ap.add_argument("--sizes", nargs="*", default=DEFAULT_SIZES, help="Synthetic image sizes, WxH")
+    ap.add_argument("--samples", type=str, default=None, help="Directory with sample images (e.g. dataset/images)")
+    ap.add_argument("--max-samples", type=int, default=5)
+    ap.add_argument("--iters", type=int, default=30)
+    ap.add_argument("--warmup", type=int, default=3)
+    ap.add_argument("--concurrency", type=int, default=1, help="In-flight requests for the endpoint benchmark")
+    ap.add_argument("--threads", type=int, default=None, help="torch.set_num_threads")
+    ap.add_argument("--skip-endpoint", action="store_true")
+    ap.add_argument("--tiers", nargs="*", default=["fast"], choices=sorted(infer.TIERS),
+                    help="Prediction tiers to benchmark (fast / accurate / ensemble)")
+    ap.add_argument("--random-weights", action="store_true",
+                    help="Use an untrained model if best_regressor.pth is missing")
+    ap.add_argument("--out", type=str, default="bench_output.json")
+    ap.add_argument("--baseline", type=str, default=None, help="Previous JSON output to compare against")
+    ap.add_argument("--max-regression", type=float, default=None,
+                    help="Exit non-zero if any p50 is slower than baseline by more than this percent")
+    args = ap.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    if infer.MODEL is None:
+        if not args.random_weights:
+            print(f"Model not loaded ({infer.LOAD_ERR}). Train first or pass --random-weights.")
+            sys.exit(1)
+        infer.set_model(infer.MoistureVSRegressor().to(infer.DEVICE).eval(), "random")
+        print("Using randomly initialised weights.")
+
+    inputs = build_inputs(args.sizes, args.samples, args.max_samples)
+    results = []
+    for name, data in inputs:
+        for tier in args.tiers:
+            label = _input_key(name, tier)
+            r = bench_direct(name, data, args.iters, args.warmup, tier)
+            results.append(r)
+            st = r["stages_ms"]
+            print(f"[direct]   {label:<24} p50 {r['latency_ms']['p50']:8.2f}ms  p95 {r['latency_ms']['p95']:8.2f}ms  "
+                  f"decode {st['decode']['p50']:.1f} / transform {st['transform']['p50']:.1f} / "
+                  f"forward {st['forward']['p50']:.1f} ms  ({r['views']} views x {r['models']} models)")
+            if not args.skip_endpoint:
+                r = bench_endpoint(name, data, args.iters, args.warmup, args.concurrency, tier)
+                results.append(r)
+                print(f"[endpoint] {label:<24} p50 {r['latency_ms']['p50']:8.2f}ms  p95 {r['latency_ms']['p95']:8.2f}ms  "
+                      f"{r['throughput_rps']:.1f} req/s  errors {r['errors']}")
+
+    infer_src = (BACKEND / "infer.py").read_bytes()
+    report = {
+        "meta": {
+            "timestamp": datetime.utcnow().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "torch": torch.__version__,
+            "device": str(infer.DEVICE),
+            "torch_threads": torch.get_num_threads(),
+            "cpu_count": os.cpu_count(),
+            "infer_sha256": hashlib.sha256(infer_src).hexdigest()[:16],
+            "iters": args.iters,
+            "peak_rss_mb": peak_rss_mb(),
+        },
+        "results": results,
+    }
+    Path(args.out).write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"\nPeak RSS: {report['meta']['peak_rss_mb']} MB")
+    print("Wrote", args.out)
+
+    if args.baseline and compare(args.baseline, results, args.max_regression):
+        print(f"p50 regression above {args.max_regression}% detected.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
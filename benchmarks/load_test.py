@@ -0,0 +1,294 @@
+# benchmarks/load_test.py
+"""
+End-to-end load generator for the AgroGas API.
+
+Runs backend/main.py in-process (httpx ASGI client) against a SQLite stand-in
+for MySQL and replays a traffic mix at increasing concurrency levels:
+
+  - farmer: POST /api/v1/predict, then POST /api/v1/records with the result
+  - buyer:  GET /api/v1/records, then POST /api/v1/orders for 1-2 lots in stock
+  - admin:  GET /api/v1/admin/config
+
+For every level it reports per-route latency histograms, error rates, and
+stock-consistency violations (available_kg < 0, or available_kg != mass_kg
+minus the sum of order_items.qty_kg for that record).
+
+    python benchmarks/load_test.py --levels 1 4 16 64 --duration 20 --out load.json
+
+SQLite serializes writers and ignores SELECT ... FOR UPDATE, so absolute
+throughput is not comparable to MySQL; point DATABASE_URL at a MySQL test
+database to measure the real thing. Needs httpx.
+"""
+
+import argparse
+import asyncio
+import bisect
+import json
+import math
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+import numpy as np
+
+ROOT = Path(__file__).resolve().parent.parent
+BACKEND = ROOT / "backend"
+sys.path.append(str(BACKEND))
+
+_TMP_DB = Path(tempfile.gettempdir()) / "agrogas_load_test.db"
+
+# Histogram bucket upper bounds (ms); the last bucket is open ended
+BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000]
+
+
+class RouteStats:
+    def __init__(self):
+        self.latencies = []
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.status = defaultdict(int)
+        self.exceptions = 0
+
+    def observe(self, dt_s, status):
+        ms = dt_s * 1000.0
+        self.latencies.append(ms)
+        self.counts[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+        self.status[status] += 1
+
+    def summary(self):
+        n = len(self.latencies) + self.exceptions
+        errors = self.exceptions + sum(c for s, c in self.status.items() if s >= 500)
+        rejected = sum(c for s, c in self.status.items() if 400 <= s < 500)
+        out = {
+            "requests": n,
+            "errors": errors,
+            "error_rate": round(errors / n, 4) if n else 0.0,
+            "rejected_4xx": rejected,
+            "status": {str(k): v for k, v in sorted(self.status.items())},
+            "histogram_ms": {
+                (f"<={b}" if i < len(BUCKETS_MS) else f">{BUCKETS_MS[-1]}"): c
+                for i, (b, c) in enumerate(zip(BUCKETS_MS + [None], self.counts))
+            },
+        }
+        if self.latencies:
+            a = np.asarray(self.latencies)
+            out["latency_ms"] = {q: round(float(np.percentile(a, int(q[1:]))), 2) for q in ("p50", "p95", "p99")}
+        return out
+
+
+class LoadRun:
+    def __init__(self, client, image_bytes, use_predict, rng):
+        self.client = client
+        self.image_bytes = image_bytes
+        self.use_predict = use_predict
+        self.rng = rng
+        self.routes = defaultdict(RouteStats)
+
+    async def call(self, route, method, url, **kw):
+        t0 = time.perf_counter()
+        try:
+            res = await self.client.request(method, url, **kw)
+        except Exception:
+            self.routes[route].exceptions += 1
+            return None
+        self.routes[route].observe(time.perf_counter() - t0, res.status_code)
+        return res
+
+    async def farmer(self, uid):
+        mass = round(self.rng.uniform(5.0, 50.0), 2)
+        pred = None
+        if self.use_predict:
+            res = await self.call("POST /api/v1/predict", "POST", "/api/v1/predict",
+                                  files={"image": ("residue.jpg", self.image_bytes, "image/jpeg")},
+                                  data={"measured_weight": str(mass)})
+            if res is not None and res.status_code == 200:
+                pred = res.json()
+        if pred is None:
+            vs = round(self.rng.uniform(0.5, 0.9), 3)
+            biogas = round(mass * vs * 0.2, 3)
+            pred = {"mass_kg": mass, "moisture_percent": 60.0, "vs_fraction": vs,
+                    "predicted_m3_biogas": biogas, "revenue_estimate": round(biogas * 50.0, 2)}
+        payload = {
+            "farmer_name": f"load-farmer-{uid}",
+            "location": self.rng.choice(["kyathsandra", "tumkur", "gubbi", "sira"]),
+            "phone": f"90000{uid:05d}",
+            "mass_kg": pred.get("mass_kg") or mass,
+            "moisture_percent": pred.get("moisture_percent"),
+            "vs_fraction": pred.get("vs_fraction"),
+            "predicted_m3_biogas": pred.get("predicted_m3_biogas", 0.0),
+            "revenue_estimate": pred.get("revenue_estimate", 0.0),
+        }
+        await self.call("POST /api/v1/records", "POST", "/api/v1/records", json=payload)
+
+    async def buyer(self, uid):
+        res = await self.call("GET /api/v1/records", "GET", "/api/v1/records")
+        if res is None or res.status_code != 200:
+            return
+        in_stock = [r for r in res.json() if (r.get("available_kg") or 0) >= 0.01]
+        if not in_stock:
+            return
+        picks = self.rng.sample(in_stock, min(len(in_stock), self.rng.randint(1, 2)))
+        items = []
+        for r in picks:
+            # round down: never ask for more than is left, never send 0
+            qty = math.floor(min(r["available_kg"], self.rng.uniform(1.0, 10.0)) * 100) / 100
+            if qty >= 0.01:
+                items.append({"record_id": r["id"], "qty_kg": qty})
+        if not items:
+            return
+        await self.call("POST /api/v1/orders", "POST", "/api/v1/orders",
+                        json={"buyer_name": f"load-buyer-{uid}", "buyer_location": "tumkur", "items": items})
+
+    async def admin(self, uid):
+        await self.call("GET /api/v1/admin/config", "GET", "/api/v1/admin/config")
+
+
+def check_stock_consistency(tol=1e-6):
+    """Return (negative, mismatched) lists of offending record ids."""
+    from sqlalchemy import func
+    from database import SessionLocal, Record, OrderItem
+
+    db = SessionLocal()
+    try:
+        sold = (db.query(OrderItem.record_id, func.sum(OrderItem.qty_kg).label("sold"))
+                .group_by(OrderItem.record_id).subquery())
+        rows = (db.query(Record.id, Record.mass_kg, Record.available_kg, sold.c.sold)
+                .outerjoin(sold, sold.c.record_id == Record.id).all())
+    finally:
+        db.close()
+
+    negative, mismatched = [], []
+    for rid, mass, avail, sold_kg in rows:
+        avail = avail or 0.0
+        if avail < -tol:
+            negative.append(rid)
+        expected = (mass or 0.0) - (sold_kg or 0.0)
+        if abs(expected - avail) > 1e-3:
+            mismatched.append({"record_id": rid, "available_kg": avail, "expected_kg": round(expected, 4)})
+    return negative, mismatched, len(rows)
+
+
+async def run_level(app, concurrency, duration, mix, image_bytes, use_predict, seed):
+    import httpx
+
+    rng = random.Random(seed)
+    scenarios, weights = zip(*mix.items())
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://load", timeout=60.0) as client:
+        run = LoadRun(client, image_bytes, use_predict, rng)
+        deadline = time.perf_counter() + duration
+        iterations = 0
+
+        async def user(uid):
+            nonlocal iterations
+            while time.perf_counter() < deadline:
+                scenario = rng.choices(scenarios, weights=weights)[0]
+                await getattr(run, scenario)(uid)
+                iterations += 1
+
+        t0 = time.perf_counter()
+        await asyncio.gather(*(user(seed * 1000 + i) for i in range(concurrency)))
+        wall = time.perf_counter() - t0
+
+    return run, iterations, wall
+
+
+def parse_mix(s):
+    mix = {}
+    for part in s.split(","):
+        name, _, w = part.partition("=")
+        if name not in ("farmer", "buyer", "admin"):
+            raise SystemExit(f"Unknown scenario in --mix: {name}")
+        mix[name] = float(w or 1)
+    return mix
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Load test the AgroGas API in-process")
+    ap.add_argument("--levels", nargs="*", type=int, default=[1, 4, 16, 64], help="Concurrent virtual users per level")
+    ap.add_argument("--duration", type=float, default=15.0, help="Seconds per level")
+    ap.add_argument("--mix", type=str, default="farmer=3,buyer=6,admin=1", help="Scenario weights")
+    ap.add_argument("--db", type=str, default=None,
+                    help=f"Database URL (default: fresh SQLite file {_TMP_DB})")
+    ap.add_argument("--no-predict", action="store_true",
+                    help="Skip /api/v1/predict; farmers post synthetic predictions")
+    ap.add_argument("--random-weights", action="store_true",
+                    help="Use an untrained model if best_regressor.pth is missing")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--out", type=str, default="load_test.json")
+    args = ap.parse_args()
+
+    if args.db:
+        os.environ["DATABASE_URL"] = args.db
+    else:
+        if _TMP_DB.exists():
+            _TMP_DB.unlink()
+        os.environ["DATABASE_URL"] = f"sqlite:///{_TMP_DB.as_posix()}"
+
+    import main as backend_main
+    import infer
+    import dedup
+    import image_store
+    # keep load-test uploads out of the real near-duplicate log and image store
+    log = Path(tempfile.gettempdir()) / "agrogas_load_test_uploads.jsonl"
+    log.unlink(missing_ok=True)
+    dedup.UPLOADS = dedup.UploadIndex(upload_log=log)
+    store = Path(tempfile.mkdtemp(prefix="agrogas_load_test_images_"))
+    image_store.STORE_DIR, image_store.ORIGINALS_DIR = store, store / "originals"
+    image_store.THUMBS_DIR = image_store.THUMBS.root = store / "thumbs"
+
+    use_predict = not args.no_predict
+    if use_predict and infer.MODEL is None:
+        if args.random_weights:
+            infer.set_model(infer.MoistureVSRegressor().to(infer.DEVICE).eval(), "random")
+        else:
+            print(f"Model not loaded ({infer.LOAD_ERR}); running without /api/v1/predict.")
+            use_predict = False
+
+    from bench_predict import synthetic_jpeg
+    image_bytes = synthetic_jpeg(1280, 960)
+    mix = parse_mix(args.mix)
+
+    report = {"database_url": os.environ["DATABASE_URL"].split("@")[-1], "mix": mix, "levels": []}
+    for i, level in enumerate(args.levels):
+        run, iterations, wall = asyncio.run(
+            run_level(backend_main.app, level, args.duration, mix, image_bytes, use_predict, args.seed + i))
+        negative, mismatched, n_records = check_stock_consistency()
+
+        routes = {name: st.summary() for name, st in sorted(run.routes.items())}
+        total = sum(r["requests"] for r in routes.values())
+        errors = sum(r["errors"] for r in routes.values())
+        entry = {
+            "concurrency": level,
+            "wall_s": round(wall, 2),
+            "scenarios": iterations,
+            "requests": total,
+            "throughput_rps": round(total / wall, 2) if wall else 0.0,
+            "error_rate": round(errors / total, 4) if total else 0.0,
+            "routes": routes,
+            "consistency": {
+                "records": n_records,
+                "negative_available": negative,
+                "mismatched_available": mismatched[:50],
+                "mismatched_count": len(mismatched),
+            },
+        }
+        report["levels"].append(entry)
+
+        print(f"\n=== concurrency {level}: {total} requests in {wall:.1f}s "
+              f"({entry['throughput_rps']} req/s, error rate {entry['error_rate']:.2%})")
+        for name, r in routes.items():
+            lat = r.get("latency_ms", {})
+            print(f"  {name:<28} n={r['requests']:<6} p50={lat.get('p50', '-'):<8} p95={lat.get('p95', '-'):<8} "
+                  f"p99={lat.get('p99', '-'):<8} errors={r['errors']} 4xx={r['rejected_4xx']}")
+        print(f"  stock consistency: {len(negative)} negative, {len(mismatched)} mismatched of {n_records} records")
+
+    Path(args.out).write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print("\nWrote", args.out)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,358 @@
+# dataset_manifest.py
+"""
+Persistent, incremental index of dataset/images (dataset/manifest.sqlite).
+
+One row per image: path (relative to dataset/images, forward slashes), size,
+mtime, content hash, dimensions, category (first folder: leaf/residue) and
+the label columns from labels.csv. Refreshes only re-list directories whose
+mtime changed since the last run, and only hash/probe files whose size or
+mtime changed, so a refresh over a large, mostly unchanged corpus is fast.
+
+Replaces the rescan-and-rewrite flow of create_labels_csv.py,
+utils/resolve_image_paths.py, fix_master_paths.py, fix_seed_paths.py,
+merge_seed_labels.py and utils/prepare_training_csv.py:
+
+    python dataset_manifest.py                                    # refresh index
+    python dataset_manifest.py --import-labels dataset/labels.csv dataset/seed_labels.csv
+    python dataset_manifest.py --emit-labels dataset/labels.csv --emit-train dataset/train.csv
+
+Note: editing a file in place does not change its directory's mtime; use
+--full after such edits to re-stat every file.
+"""
+
+import argparse
+import csv
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from PIL import Image
+
+ROOT = Path(__file__).resolve().parent
+sys.path.append(str(ROOT / "backend"))
+
+from atomic import atomic_write
+
+DATASET_DIR = ROOT / "dataset"
+IMG_ROOT = DATASET_DIR / "images"
+MANIFEST = DATASET_DIR / "manifest.sqlite"
+
+IMG_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp"}
+LABEL_COLUMNS = ["health", "mass_kg", "moisture_percent", "vs_fraction", "notes", "labeled", "synthetic"]
+NUMERIC_COLUMNS = {"mass_kg", "moisture_percent", "vs_fraction"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    path TEXT PRIMARY KEY,
+    dir TEXT NOT NULL,
+    category TEXT,
+    size INTEGER,
+    mtime_ns INTEGER,
+    sha1 TEXT,
+    width INTEGER,
+    height INTEGER,
+    present INTEGER NOT NULL DEFAULT 1,
+    health TEXT,
+    mass_kg REAL,
+    moisture_percent REAL,
+    vs_fraction REAL,
+    notes TEXT,
+    labeled INTEGER NOT NULL DEFAULT 0,
+    synthetic INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS ix_images_dir ON images(dir);
+CREATE INDEX IF NOT EXISTS ix_images_sha1 ON images(sha1);
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    subdirs TEXT NOT NULL
+);
+"""
+
+
+# --------------------------
+# Paths
+# --------------------------
+def normalize_image_path(raw) -> str:
+    """
+    Canonical form used everywhere in the manifest: relative to dataset/images,
+    forward slashes, e.g. "residue/5.jpg". Accepts the variants the older
+    scripts produced ("dataset/images\\residue\\5.jpg", "images/residue/5.jpg",
+    "dataset/seed_images/residue/5.jpg", absolute paths under dataset/images, ...).
+    """
+    p = str(raw or "").strip().replace("\\", "/")
+    img_root = IMG_ROOT.as_posix() + "/"
+    if p.startswith(img_root):
+        p = p[len(img_root):]
+    while p.startswith("./"):
+        p = p[2:]
+    p = p.lstrip("/")
+    while p.startswith("dataset/dataset/"):
+        p = p[len("dataset/"):]
+    for prefix in ("dataset/images/", "dataset/seed_images/", "images/", "seed_images/", "dataset/"):
+        if p.startswith(prefix):
+            p = p[len(prefix):]
+            break
+    return p
+
+
+def _rel(path: str) -> str:
+    rel = os.path.relpath(path, IMG_ROOT)
+    return "" if rel == "." else rel.replace(os.sep, "/")
+
+
+# --------------------------
+# Storage
+# --------------------------
+def connect(path: Path = MANIFEST) -> sqlite3.Connection:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(path))
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def probe_file(abs_path: str):
+    """sha1 of the content plus header-only dimensions (PIL reads size without decoding)."""
+    h = hashlib.sha1()
+    with open(abs_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    try:
+        with Image.open(abs_path) as im:
+            w, hgt = im.size
+    except Exception:
+        w, hgt = None, None
+    return h.hexdigest(), w, hgt
+
+
+def refresh(conn: sqlite3.Connection, full: bool = False, workers: int = 8, verbose: bool = True):
+    """Bring the index in line with dataset/images; returns a dict of counters."""
+    if not IMG_ROOT.exists():
+        raise FileNotFoundError(f"images root not found: {IMG_ROOT}")
+
+    known_dirs = {r["path"]: (r["mtime_ns"], json.loads(r["subdirs"])) for r in conn.execute("SELECT * FROM dirs")}
+    seen_dirs = set()
+    to_probe = []             # (rel, abs, size, mtime_ns)
+    stats = {"dirs_listed": 0, "dirs_skipped": 0, "new_or_changed": 0, "removed": 0}
+
+    stack = [str(IMG_ROOT)]
+    while stack:
+        d = stack.pop()
+        rel_d = _rel(d)
+        seen_dirs.add(rel_d)
+        try:
+            d_mtime = os.stat(d).st_mtime_ns
+        except FileNotFoundError:
+            continue
+
+        known = known_dirs.get(rel_d)
+        if not full and known and known[0] == d_mtime:
+            # no entries added/removed/renamed here: trust the stored rows
+            stats["dirs_skipped"] += 1
+            stack.extend(os.path.join(str(IMG_ROOT), s) for s in known[1])
+            continue
+
+        stats["dirs_listed"] += 1
+        rows = {r["path"]: r for r in conn.execute(
+            "SELECT path, size, mtime_ns, present FROM images WHERE dir = ?", (rel_d,))}
+        on_disk = set()
+        subdirs = []
+        with os.scandir(d) as it:
+            for e in it:
+                if e.is_dir(follow_symlinks=False):
+                    subdirs.append(_rel(e.path))
+                    stack.append(e.path)
+                    continue
+                if os.path.splitext(e.name)[1].lower() not in IMG_EXTS:
+                    continue
+                rel = _rel(e.path)
+                on_disk.add(rel)
+                st = e.stat()
+                old = rows.get(rel)
+                if old is None or old["size"] != st.st_size or old["mtime_ns"] != st.st_mtime_ns or not old["present"]:
+                    to_probe.append((rel, e.path, st.st_size, st.st_mtime_ns))
+
+        gone = [p for p, r in rows.items() if p not in on_disk and r["present"]]
+        if gone:
+            conn.executemany("UPDATE images SET present = 0 WHERE path = ?", [(p,) for p in gone])
+            stats["removed"] += len(gone)
+        conn.execute("INSERT OR REPLACE INTO dirs(path, mtime_ns, subdirs) VALUES (?, ?, ?)",
+                     (rel_d, d_mtime, json.dumps(sorted(subdirs))))
+
+    # directories that disappeared entirely
+    for rel_d in set(known_dirs) - seen_dirs:
+        cur = conn.execute("UPDATE images SET present = 0 WHERE dir = ? AND present = 1", (rel_d,))
+        stats["removed"] += cur.rowcount
+        conn.execute("DELETE FROM dirs WHERE path = ?", (rel_d,))
+
+    # hash + header probe for new/changed files in parallel (I/O bound)
+    stats["new_or_changed"] = len(to_probe)
+    if to_probe:
+        if verbose:
+            print(f"Probing {len(to_probe)} new/changed images with {workers} threads...")
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            probed = pool.map(lambda t: probe_file(t[1]), to_probe, chunksize=32)
+            batch = []
+            for (rel, _, size, mtime_ns), (sha1, w, h) in zip(to_probe, probed):
+                d = rel.rsplit("/", 1)[0] if "/" in rel else ""
+                category = rel.split("/", 1)[0] if "/" in rel else None
+                batch.append((rel, d, category, size, mtime_ns, sha1, w, h))
+                if len(batch) >= 1000:
+                    _upsert_files(conn, batch)
+                    batch = []
+            _upsert_files(conn, batch)
+
+    conn.commit()
+    return stats
+
+
+def _upsert_files(conn, batch):
+    if not batch:
+        return
+    # keep label columns on existing rows; only file facts change
+    conn.executemany("""
+        INSERT INTO images(path, dir, category, size, mtime_ns, sha1, width, height, present)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, 1)
+        ON CONFLICT(path) DO UPDATE SET
+            dir = excluded.dir, size = excluded.size, mtime_ns = excluded.mtime_ns,
+            sha1 = excluded.sha1, width = excluded.width, height = excluded.height,
+            present = 1, category = COALESCE(images.category, excluded.category)
+    """, batch)
+
+
+# --------------------------
+# Labels in / out
+# --------------------------
+def _clean(col, value):
+    v = "" if value is None else str(value).strip()
+    if v == "" or v.lower() in ("nan", "none"):
+        return None
+    if col in NUMERIC_COLUMNS:
+        try:
+            return float(v)
+        except ValueError:
+            return None
+    if col in ("labeled", "synthetic"):
+        return 1 if v.lower() in ("1", "1.0", "true", "yes") else 0
+    return v
+
+
+def import_labels(conn: sqlite3.Connection, csv_path: Path):
+    """
+    Merge a labels CSV (labels.csv / seed_labels.csv layout) into the index.
+    Non-empty CSV values overwrite stored ones; rows are matched by normalized
+    path, or by unique basename for seed CSVs that only carry the file name.
+    """
+    by_name = {}
+    for r in conn.execute("SELECT path FROM images WHERE present = 1"):
+        by_name.setdefault(r["path"].rsplit("/", 1)[-1], []).append(r["path"])
+
+    matched, unmatched = 0, 0
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            raw = row.get("image_path") or row.get("image") or ""
+            path = normalize_image_path(raw)
+            if "/" not in path:
+                hits = by_name.get(path, [])
+                if len(hits) > 1 and row.get("category"):
+                    # same file name in several folders: prefer the row's category folder
+                    hits = [h for h in hits if h.split("/", 1)[0] == row["category"].strip().lower()]
+                path = hits[0] if len(hits) == 1 else None
+            if not path or conn.execute("SELECT 1 FROM images WHERE path = ?", (path,)).fetchone() is None:
+                unmatched += 1
+                continue
+            updates = {c: _clean(c, row.get(c)) for c in LABEL_COLUMNS + ["category"] if c in row}
+            updates = {c: v for c, v in updates.items() if v is not None}
+            if updates:
+                sets = ", ".join(f"{c} = ?" for c in updates)
+                conn.execute(f"UPDATE images SET {sets} WHERE path = ?", (*updates.values(), path))
+            matched += 1
+    conn.commit()
+    return matched, unmatched
+
+
+def _write_csv_atomic(path: Path, fieldnames, rows):
+    n = 0
+    with atomic_write(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(fieldnames)
+        for r in rows:
+            w.writerow(["" if v is None else v for v in r])
+            n += 1
+    return n
+
+
+def emit_labels(conn: sqlite3.Connection, out: Path) -> int:
+    """labels.csv with image_path relative to dataset/ ("images/residue/5.jpg"), as the label tool expects."""
+    cols = ["image_path", "category"] + LABEL_COLUMNS
+    rows = conn.execute(
+        f"SELECT 'images/' || path, category, {', '.join(LABEL_COLUMNS)} FROM images WHERE present = 1 ORDER BY path")
+    return _write_csv_atomic(out, cols, rows)
+
+
+def emit_train(conn: sqlite3.Connection, out: Path, labeled_only: bool = False) -> int:
+    """train.csv for train_regression.py: residue rows with both targets present."""
+    sql = """
+        SELECT 'dataset/images/' || path, moisture_percent, vs_fraction FROM images
+        WHERE present = 1 AND lower(category) = 'residue'
+          AND moisture_percent IS NOT NULL AND vs_fraction IS NOT NULL
+    """
+    if labeled_only:
+        sql += " AND labeled = 1"
+    return _write_csv_atomic(out, ["image_path", "moisture_percent", "vs_fraction"], conn.execute(sql + " ORDER BY path"))
+
+
+def print_stats(conn: sqlite3.Connection):
+    total = conn.execute("SELECT COUNT(*) FROM images WHERE present = 1").fetchone()[0]
+    print("Images indexed:", total)
+    for r in conn.execute("""SELECT category, COUNT(*) n, SUM(labeled) labeled FROM images
+                             WHERE present = 1 GROUP BY category ORDER BY n DESC"""):
+        print(f"  {r['category'] or '(none)':<12} {r['n']:>8}  labeled {r['labeled'] or 0}")
+    dups = conn.execute("""SELECT COUNT(*) FROM (SELECT sha1 FROM images WHERE present = 1
+                           GROUP BY sha1 HAVING COUNT(*) > 1)""").fetchone()[0]
+    print("Byte-identical duplicate groups:", dups)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Incremental dataset manifest for dataset/images")
+    ap.add_argument("--full", action="store_true", help="Re-stat every directory and file")
+    ap.add_argument("--no-refresh", action="store_true", help="Skip the filesystem refresh")
+    ap.add_argument("--workers", type=int, default=8, help="Threads for hashing/probing")
+    ap.add_argument("--import-labels", nargs="*", default=[], help="Label CSVs to merge (in order)")
+    ap.add_argument("--emit-labels", type=str, default=None, help="Write labels.csv from the manifest")
+    ap.add_argument("--emit-train", type=str, default=None, help="Write train.csv from the manifest")
+    ap.add_argument("--labeled-only", action="store_true", help="train.csv: only rows marked labeled")
+    ap.add_argument("--stats", action="store_true")
+    args = ap.parse_args()
+
+    conn = connect()
+    if not args.no_refresh:
+        try:
+            st = refresh(conn, full=args.full, workers=args.workers)
+        except FileNotFoundError as e:
+            print("ERROR:", e)
+            sys.exit(1)
+        print(f"Refreshed: {st['dirs_listed']} dirs listed, {st['dirs_skipped']} unchanged, "
+              f"{st['new_or_changed']} new/changed files, {st['removed']} removed")
+
+    for p in args.import_labels:
+        matched, unmatched = import_labels(conn, Path(p))
+        print(f"Imported labels from {p}: {matched} matched, {unmatched} not in index")
+
+    if args.emit_labels:
+        print("Wrote", args.emit_labels, ":", emit_labels(conn, Path(args.emit_labels)), "rows")
+    if args.emit_train:
+        print("Wrote", args.emit_train, ":", emit_train(conn, Path(args.emit_train), args.labeled_only), "rows")
+    if args.stats:
+        print_stats(conn)
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+# dedupe_dataset.py
+"""
+Find near-duplicate images across dataset/images and dataset/seed_images.
+
+Hashes every image (dHash + pHash on a draft-mode decode, thread pool),
+reusing dataset/image_hashes.csv for files whose mtime/size did not change,
+then links pairs whose pHash differs by <= --radius bits (multi-index
+hashing, see backend/dedup.py) and writes connected components to
+dataset/dup_groups.csv:
+
+    path, group, group_size, keep
+
+`keep` marks one representative per group. train_regression.py uses the
+groups for a group-aware train/val split, and /api/v1/predict seeds its
+upload index from image_hashes.csv.
+
+    python dedupe_dataset.py                 # hash + group
+    python dedupe_dataset.py --radius 4 --show 20
+"""
+
+import argparse
+import csv
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+PROJECT = Path(__file__).resolve().parent
+sys.path.append(str(PROJECT / "backend"))
+
+from dedup import HammingIndex, hash_image, hamming, to_hex, DATASET_HASHES, DEFAULT_RADIUS
+
+ROOTS = [PROJECT / "dataset" / "images", PROJECT / "dataset" / "seed_images"]
+GROUPS_CSV = PROJECT / "dataset" / "dup_groups.csv"
+IMG_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp"}
+
+
+def rel(p: str) -> str:
+    """Project-relative posix path, the form used in train.csv ("dataset/images/...")."""
+    return Path(os.path.relpath(p, PROJECT)).as_posix()
+
+
+def list_images(roots):
+    out = []
+    for root in roots:
+        for d, _, files in os.walk(root):
+            out.extend(os.path.join(d, f) for f in files if os.path.splitext(f)[1].lower() in IMG_EXTS)
+    return sorted(out)
+
+
+def load_hashes(path: Path):
+    if not path.exists():
+        return {}
+    with open(path, newline="", encoding="utf-8") as f:
+        return {r["path"]: r for r in csv.DictReader(f)}
+
+
+def hash_all(paths, workers):
+    """{rel_path: (dhash, phash)}; unchanged files are taken from image_hashes.csv."""
+    cached = load_hashes(DATASET_HASHES)
+
+    def work(p):
+        st = os.stat(p)
+        key = rel(p)
+        c = cached.get(key)
+        if c and c["mtime_ns"] == str(st.st_mtime_ns) and c["size"] == str(st.st_size):
+            return key, st, (int(c["dhash"], 16), int(c["phash"], 16)) if c["phash"] else None
+        try:
+            return key, st, hash_image(p)
+        except Exception:
+            return key, st, None
+
+    rows, hashes, bad = [], {}, 0
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for key, st, h in pool.map(work, paths, chunksize=64):
+            if h is None:
+                bad += 1
+                rows.append((key, st.st_mtime_ns, st.st_size, "", ""))
+                continue
+            hashes[key] = h
+            rows.append((key, st.st_mtime_ns, st.st_size, to_hex(h[0]), to_hex(h[1])))
+
+    tmp = DATASET_HASHES.with_suffix(".tmp")
+    with open(tmp, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["path", "mtime_ns", "size", "dhash", "phash"])
+        w.writerows(rows)
+    os.replace(tmp, DATASET_HASHES)
+    if bad:
+        print(f"Skipped {bad} unreadable images")
+    return hashes
+
+
+def group(hashes, radius):
+    """Union-find over pHash neighbours within `radius` (confirmed by dHash within 2*radius)."""
+    keys = list(hashes)
+    parent = list(range(len(keys)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    idx = HammingIndex(radius)
+    for i, k in enumerate(keys):
+        dh, ph = hashes[k]
+        for _, j in idx.query(ph):
+            if hamming(dh, hashes[keys[j]][0]) <= 2 * radius:
+                a, b = find(i), find(j)
+                if a != b:
+                    parent[max(a, b)] = min(a, b)
+        idx.add(ph, i)
+
+    groups = {}
+    for i, k in enumerate(keys):
+        groups.setdefault(find(i), []).append(k)
+    return list(groups.values())
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Detect near-duplicate images with perceptual hashes")
+    ap.add_argument("--radius", type=int, default=DEFAULT_RADIUS, help="Max pHash Hamming distance")
+    ap.add_argument("--workers", type=int, default=16)
+    ap.add_argument("--show", type=int, default=10, help="Print this many duplicate groups")
+    args = ap.parse_args()
+
+    paths = list_images([r for r in ROOTS if r.exists()])
+    if not paths:
+        print("No images found under", ", ".join(str(r) for r in ROOTS))
+        sys.exit(1)
+
+    hashes = hash_all(paths, args.workers)
+    groups = group(hashes, args.radius)
+    # stable group ids: order by first (sorted) member
+    groups = sorted((sorted(g) for g in groups), key=lambda g: g[0])
+
+    with open(GROUPS_CSV, "w", newline="", encoding="utf-8") as f:
+        w = csv.writer(f)
+        w.writerow(["path", "group", "group_size", "keep"])
+        for gid, members in enumerate(groups):
+            # prefer the copy under dataset/images over seed_images copies
+            keep = min(members, key=lambda p: (not p.startswith("dataset/images/"), p))
+            for p in members:
+                w.writerow([p, gid, len(members), int(p == keep)])
+
+    dups = [g for g in groups if len(g) > 1]
+    redundant = sum(len(g) - 1 for g in dups)
+    print(f"Hashed {len(hashes)} images: {len(dups)} duplicate groups, {redundant} redundant copies")
+    for g in sorted(dups, key=len, reverse=True)[:args.show]:
+        print(f"  [{len(g)}] " + ", ".join(g[:4]) + (" ..." if len(g) > 4 else ""))
+    print("Wrote", GROUPS_CSV, "and", DATASET_HASHES)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# import_records.py
+"""
+Load a cooperative's spreadsheet of weighed residue lots into the records
+table without going through the API (same code path as
+POST /api/v1/records/import, see backend/bulk_import.py).
+
+Rows are validated and priced like POST /api/v1/records and inserted in
+chunks; invalid rows are reported by line number and skipped. Uses the
+database configured for the backend (DB_* / DATABASE_URL).
+
+    python import_records.py lots.csv
+    python import_records.py lots.ndjson --dry-run --errors bad_rows.csv
+    python import_records.py - --format ndjson < lots.ndjson
+"""
+
+import argparse
+import csv
+import json
+import sys
+from pathlib import Path
+
+PROJECT = Path(__file__).resolve().parent
+sys.path.append(str(PROJECT / "backend"))
+
+from database import SessionLocal, engine, init_db
+import bulk_import
+import search
+import stats
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Bulk-import residue lots (CSV / NDJSON) into records")
+    ap.add_argument("path", help="CSV or NDJSON file, or - for stdin")
+    ap.add_argument("--format", choices=bulk_import.FORMATS, default=None,
+                    help="Input format (default: from the file extension)")
+    ap.add_argument("--chunk", type=int, default=bulk_import.CHUNK, help="Rows per INSERT / commit")
+    ap.add_argument("--dry-run", action="store_true", help="Validate and price every row without saving")
+    ap.add_argument("--errors", type=str, default=None, help="Write rejected lines to this CSV")
+    args = ap.parse_args()
+
+    fmt = args.format or bulk_import.detect_format(args.path)
+    init_db()
+    search.ensure_index(engine)      # FTS triggers must exist before rows go in
+
+    db = SessionLocal()
+    try:
+        stats.ensure_built(db)       # aggregates are updated incrementally from here on
+        if args.path == "-":
+            summary = bulk_import.import_stream(db, sys.stdin.buffer, fmt, dry_run=args.dry_run, chunk=args.chunk)
+        else:
+            with open(args.path, "rb") as f:
+                summary = bulk_import.import_stream(db, f, fmt, dry_run=args.dry_run, chunk=args.chunk)
+    finally:
+        db.close()
+
+    errors = summary.pop("errors")
+    print(json.dumps(summary, indent=2))
+    for e in errors[:10]:
+        print(f"  line {e['line']}: {e['error']}")
+    if len(errors) > 10:
+        print(f"  ... {summary['failed'] - 10} more")
+    if args.errors and errors:
+        with open(args.errors, "w", newline="", encoding="utf-8") as f:
+            w = csv.DictWriter(f, fieldnames=["line", "error"])
+            w.writeheader()
+            w.writerows(errors)
+        print(f"📝 Wrote {len(errors)} rejected lines to {args.errors}")
+    verb = "Validated" if args.dry_run else "Imported"
+    print(f"✅ {verb} {summary['valid']} of {summary['rows']} rows in {summary['seconds']}s "
+          f"({summary['rows_per_s']} rows/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,8 @@
 # label_seed.py  (final version — supports all Streamlit versions)
 import streamlit as st
-import pandas as pd
 from pathlib import Path
-from PIL import Image
+
+from utils.label_store import LabelStore, display_image, prefetch_thumbnails
 
 SEED_DIR = Path("dataset/seed_images")
 OUT_CSV = Path("dataset/seed_labels.csv")
@@ -16,11 +16,17 @@ if not imgs:
     st.error("No seed images found in dataset/seed_images. Run sample_seed.py first.")
     st.stop()
 
-# Load existing labels
-if OUT_CSV.exists():
-    df = pd.read_csv(OUT_CSV)
-else:
-    df = pd.DataFrame(columns=["image", "category", "health"])
+# Load existing labels (parsed once per server process; saves append to an event log)
+_cache_resource = getattr(st, "cache_resource", None) or getattr(st, "experimental_singleton")
+
+
+@_cache_resource
+def get_store():
+    return LabelStore(OUT_CSV, key="image", columns=["image", "category", "health"])
+
+
+store = get_store()
+df = store.frame()
 
 # UI index slider
 i = st.number_input("Image Index", min_value=0, max_value=len(imgs)-1, value=0, step=1)
@@ -28,7 +34,8 @@ img_path = imgs[int(i)]
 
 # Show image
 st.subheader(f"Image: {img_path.name}")
-st.image(Image.open(img_path), use_column_width=True)
+st.image(display_image(img_path), use_column_width=True)
+prefetch_thumbnails(imgs[int(i) + 1: int(i) + 4])
 
 # load existing row if exists
 existing = df[df["image"] == img_path.name]
@@ -50,20 +57,8 @@ health = st.selectbox(
 
 # Save button
 if st.button("Save Label"):
-    new_row = pd.DataFrame([{
-        "image": img_path.name,
-        "category": category,
-        "health": health
-    }])
-
-    # Remove old entry before replacing
-    df = df[df["image"] != img_path.name]
-
-    # Append new row
-    df = pd.concat([df, new_row], ignore_index=True)
-
-    # Save CSV
-    df.to_csv(OUT_CSV, index=False)
+    # Replaces any earlier label for this image
+    store.save(img_path.name, {"category": category, "health": health})
     st.success("Saved successfully! ✅")
 
     # ---- RERUN FIX FOR ALL STREAMLIT VERSIONS ----
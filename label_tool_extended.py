@@ -2,7 +2,8 @@
 import streamlit as st
 import pandas as pd
 from pathlib import Path
-from PIL import Image
+
+from utils.label_store import LabelStore, display_image, prefetch_thumbnails
 
 DATASET_DIR = Path("dataset")
 IMAGES_DIR = DATASET_DIR / "images"
@@ -16,7 +17,17 @@ if not CSV_PATH.exists():
     st.error(f"CSV not found: {CSV_PATH}. Run create_labels_csv.py first.")
     st.stop()
 
-df = pd.read_csv(CSV_PATH)
+# one store per server process: the CSV is parsed once, saves append to an event log
+_cache_resource = getattr(st, "cache_resource", None) or getattr(st, "experimental_singleton")
+
+
+@_cache_resource
+def get_store():
+    return LabelStore(CSV_PATH, key="image_path")
+
+
+store = get_store()
+df = store.frame()
 
 mode = st.radio("Mode", ("Unlabeled only", "All images"))
 if mode == "Unlabeled only":
@@ -29,6 +40,9 @@ if len(df_view) == 0:
     st.info("No images to show with current filter.")
     st.stop()
 
+if st.sidebar.button("Write pending labels to labels.csv"):
+    st.sidebar.write(f"Compacted {store.compact()} label events")
+
 idx = st.sidebar.number_input("Index (0-based in filtered set)", min_value=0, max_value=max(0,len(df_view)-1), value=0, step=1)
 
 # locate the real index in the original dataframe
@@ -39,7 +53,9 @@ row = df.loc[orig_index]
 img_path = DATASET_DIR / Path(row["image_path"])
 st.sidebar.write(f"File: {row['image_path']}")
 if img_path.exists():
-    st.image(Image.open(img_path), use_column_width=True)
+    st.image(display_image(img_path), use_column_width=True)
+    nxt = df_view["image_path"].iloc[idx + 1: idx + 4]
+    prefetch_thumbnails([DATASET_DIR / Path(p) for p in nxt])
 else:
     st.warning("Image not found: " + str(img_path))
 
@@ -65,14 +81,15 @@ with st.form("form"):
     save = st.form_submit_button("Save label")
 
 if save:
-    df.at[orig_index,"category"] = category
-    df.at[orig_index,"health"] = health
-    df.at[orig_index,"mass_kg"] = mass
-    df.at[orig_index,"moisture_percent"] = moisture
-    df.at[orig_index,"vs_fraction"] = vs
-    df.at[orig_index,"notes"] = notes
-    df.at[orig_index,"labeled"] = 1
-    df.to_csv(CSV_PATH,index=False)
+    store.save(row["image_path"], {
+        "category": category,
+        "health": health,
+        "mass_kg": mass,
+        "moisture_percent": moisture,
+        "vs_fraction": vs,
+        "notes": notes,
+        "labeled": 1,
+    })
     st.success("Saved ✅")
 
     # Try to rerun programmatically if available; otherwise ask the user to refresh manually.
@@ -0,0 +1,122 @@
+# train_quality_head.py
+"""
+Train the residue / leaf / other content head used by the upload quality gate
+(backend/quality.py) and write it to backend/outputs/quality_head.json.
+
+Features are the gate's HSV color histograms on a 256 px draft decode, so
+training on a few thousand images takes seconds on CPU.
+
+Classes:
+  residue, leaf   from the `category` column of dataset/labels.csv
+  other           every image under --other-dir (people, screens, soil, ...)
+
+    python train_quality_head.py --other-dir dataset/other_images
+"""
+
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import LogisticRegression
+from sklearn.model_selection import train_test_split
+
+PROJECT = Path(__file__).resolve().parent
+sys.path.append(str(PROJECT / "backend"))
+
+import quality  # noqa: E402
+
+LABELS = PROJECT / "dataset" / "labels.csv"
+IMG_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp"}
+
+
+def resolve(raw: str) -> Path:
+    p = str(raw).replace("\\", "/").strip().lstrip("/")
+    for cand in (PROJECT / "dataset" / p, PROJECT / "dataset" / "images" / p, PROJECT / p):
+        if cand.exists():
+            return cand
+    return PROJECT / "dataset" / p
+
+
+def features(path):
+    try:
+        return quality.color_features(quality.load_small(str(path)))
+    except Exception:
+        return None
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Train the quality gate's residue/leaf/other head")
+    ap.add_argument("--labels", type=str, default=str(LABELS))
+    ap.add_argument("--other-dir", type=str, default=str(PROJECT / "dataset" / "other_images"))
+    ap.add_argument("--max-per-class", type=int, default=3000)
+    ap.add_argument("--C", type=float, default=1.0, help="Inverse L2 strength")
+    ap.add_argument("--workers", type=int, default=8)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--out", type=str, default=str(quality.HEAD_PATH))
+    args = ap.parse_args()
+
+    df = pd.read_csv(args.labels)
+    df = df[df["category"].isin(["residue", "leaf"])]
+    items = []
+    for cat, grp in df.groupby("category"):
+        grp = grp.sample(min(len(grp), args.max_per_class), random_state=args.seed)
+        items += [(resolve(p), cat) for p in grp["image_path"]]
+    other = Path(args.other_dir)
+    if other.is_dir():
+        paths = sorted(os.path.join(d, f) for d, _, fs in os.walk(other)
+                       for f in fs if os.path.splitext(f)[1].lower() in IMG_EXTS)
+        rng = np.random.default_rng(args.seed)
+        if len(paths) > args.max_per_class:
+            paths = list(rng.choice(paths, args.max_per_class, replace=False))
+        items += [(Path(p), "other") for p in paths]
+    else:
+        print(f"⚠ No {other}; training residue vs leaf only (non-plant photos won't be caught).")
+
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        feats = list(pool.map(features, [p for p, _ in items], chunksize=16))
+    X = np.stack([f for f in feats if f is not None])
+    y = np.array([c for (_, c), f in zip(items, feats) if f is not None])
+    skipped = sum(f is None for f in feats)
+    classes, counts = np.unique(y, return_counts=True)
+    print(f"{len(y)} images ({', '.join(f'{c}={n}' for c, n in zip(classes, counts))}), {skipped} unreadable")
+    if len(classes) < 2:
+        print("Need at least two classes with images.")
+        sys.exit(1)
+
+    mean, std = X.mean(axis=0), X.std(axis=0) + 1e-6
+    Xs = (X - mean) / std
+    stratify = y if counts.min() >= 2 else None
+    X_tr, X_va, y_tr, y_va = train_test_split(Xs, y, test_size=0.2, random_state=args.seed, stratify=stratify)
+    clf = LogisticRegression(C=args.C, max_iter=2000, class_weight="balanced")
+    clf.fit(X_tr, y_tr)
+    print(f"Validation accuracy: {clf.score(X_va, y_va):.3f}")
+    clf.fit(Xs, y)          # final head on all data
+
+    W, b = clf.coef_, clf.intercept_
+    if len(clf.classes_) == 2:
+        # binary sklearn models keep one row (positive class); expand to softmax form
+        W = np.vstack([-W[0] / 2, W[0] / 2])
+        b = np.array([-b[0] / 2, b[0] / 2])
+    spec = {
+        "feature": quality.FEATURE_VERSION,
+        "classes": [str(c) for c in clf.classes_],
+        "W": W.round(6).tolist(),
+        "b": b.round(6).tolist(),
+        "mean": mean.round(6).tolist(),
+        "std": std.round(6).tolist(),
+    }
+    out = Path(args.out)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out.with_suffix(".tmp")
+    tmp.write_text(json.dumps(spec, indent=2), encoding="utf-8")
+    os.replace(tmp, out)        # the server reloads the head when this file changes
+    print("Wrote", out)
+
+
+if __name__ == "__main__":
+    main()
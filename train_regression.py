@@ -3,22 +3,34 @@
 # Project synopsis (reference): /mnt/data/AgroGas -Synopsis.docx
 
 import argparse
+import os
+import random
+import sys
 from pathlib import Path
+import numpy as np
 import pandas as pd
 from PIL import Image
 import torch
 import torch.nn as nn
 from torch.utils.data import Dataset, DataLoader
-from sklearn.model_selection import train_test_split
+from sklearn.model_selection import train_test_split, GroupShuffleSplit
 import torchvision.transforms as T
 import torchvision.models as models
 from tqdm import tqdm
 
+from utils.image_scanner import scan
+
+sys.path.append(str(Path(__file__).resolve().parent / "backend"))
+from atomic import atomic_write
+
 # Paths (relative to project root)
 DATASET = Path("dataset/train.csv")
 IMG_ROOT = Path("dataset/images")
 OUT_DIR = Path("backend/outputs")
 OUT_DIR.mkdir(parents=True, exist_ok=True)
+BEST_PATH = OUT_DIR / "best_regressor.pth"
+LAST_PATH = OUT_DIR / "last_checkpoint.pth"
+DUP_GROUPS = Path("dataset/dup_groups.csv")   # written by dedupe_dataset.py
 
 # ------------------------------
 # Dataset
@@ -31,7 +43,8 @@ class ResidueDataset(Dataset):
     def __len__(self):
         return len(self.df)
 
-    def _resolve_path(self, raw_path: str) -> Path:
+    @staticmethod
+    def _resolve_path(raw_path: str) -> Path:
         """
         Ensure we produce a valid Path under IMG_ROOT.
         The CSV may store:
@@ -79,6 +92,47 @@ class ResidueDataset(Dataset):
         y = torch.tensor([moisture, vs], dtype=torch.float32)
         return img, y
 
+def drop_unreadable_rows(df):
+    """
+    Check every image referenced by the CSV up front (header-only, cached scan)
+    and drop rows whose file is missing, unreadable or truncated, instead of
+    failing mid-epoch inside the DataLoader.
+    """
+    paths = []
+    for raw in df["image_path"]:
+        p = ResidueDataset._resolve_path(raw)
+        paths.append(p if p.exists() or not Path(raw).exists() else Path(raw))
+    meta = scan(paths)
+    ok = [meta[str(p)].ok for p in paths]
+    bad = [meta[str(p)] for p, good in zip(paths, ok) if not good]
+    if bad:
+        print(f"⚠ Dropping {len(bad)} rows with missing/unreadable images, e.g.:")
+        for m in bad[:5]:
+            print(f"   {m.path}: {m.error}")
+    return df[ok]
+
+
+def split_train_val(df, test_size=0.15, seed=42):
+    """
+    Train/val split that keeps near-duplicate images on the same side, using the
+    groups from dedupe_dataset.py. Falls back to a plain random split without them.
+    """
+    if not DUP_GROUPS.exists():
+        return train_test_split(df, test_size=test_size, random_state=seed)
+    groups_df = pd.read_csv(DUP_GROUPS)
+    group_of = {ResidueDataset._resolve_path(p).resolve(): g for p, g in zip(groups_df["path"], groups_df["group"])}
+    # images without a group (not hashed yet) get their own singleton group
+    groups = [group_of.get(ResidueDataset._resolve_path(raw).resolve(), f"row-{i}")
+              for i, raw in enumerate(df["image_path"])]
+    groups = pd.Series(groups).astype(str).values
+    if len(set(groups)) < 2:
+        return train_test_split(df, test_size=test_size, random_state=seed)
+    gss = GroupShuffleSplit(n_splits=1, test_size=test_size, random_state=seed)
+    train_idx, val_idx = next(gss.split(df, groups=groups))
+    n_dup = len(df) - len(set(groups))
+    print(f"Group split: {len(train_idx)} train / {len(val_idx)} val rows, {n_dup} near-duplicate rows kept together")
+    return df.iloc[train_idx], df.iloc[val_idx]
+
 # ------------------------------
 # Model
 # ------------------------------
@@ -104,19 +158,63 @@ class MoistureVSRegressor(nn.Module):
         x = self.pool(x).view(x.size(0), -1)
         return self.head(x)
 
+# ------------------------------
+# Checkpoint helpers
+# ------------------------------
+def save_atomic(obj, path: Path):
+    """
+    torch.save to a temp file in the same directory, then rename over `path`.
+    os.replace is atomic on the same filesystem, so readers (backend/infer.py)
+    see either the previous checkpoint or the new one, never a partial file.
+    """
+    with atomic_write(path, "wb", fsync=True) as f:
+        torch.save(obj, f)
+
+
+def load_checkpoint(path: Path):
+    # full checkpoints hold python/numpy RNG state, which the weights_only loader rejects
+    try:
+        return torch.load(path, map_location="cpu", weights_only=False)
+    except TypeError:
+        # older torch without the weights_only argument
+        return torch.load(path, map_location="cpu")
+
+
+def rng_state():
+    state = {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+    }
+    if torch.cuda.is_available():
+        state["cuda"] = torch.cuda.get_rng_state_all()
+    return state
+
+
+def restore_rng_state(state):
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if "cuda" in state and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
 # ------------------------------
 # Training Loop
 # ------------------------------
-def train_model(epochs, batch, lr, device, img_size, num_workers):
+def train_model(epochs, batch, lr, device, img_size, num_workers,
+                resume=None, patience=5, lr_factor=0.5, lr_patience=2, min_delta=0.0):
     if not DATASET.exists():
         raise FileNotFoundError(f"Training CSV not found: {DATASET}. Run prepare_training_csv.py first.")
 
     df = pd.read_csv(DATASET)
     if len(df) == 0:
         raise ValueError(f"No training rows found in {DATASET}.")
+    df = drop_unreadable_rows(df)
+    if len(df) == 0:
+        raise ValueError(f"No readable training images for the rows in {DATASET}.")
 
-    # train/val split
-    train_df, val_df = train_test_split(df, test_size=0.15, random_state=42)
+    # train/val split (near-duplicates never straddle it)
+    train_df, val_df = split_train_val(df)
 
     transform = T.Compose([
         T.Resize((img_size, img_size)),
@@ -134,15 +232,32 @@ def train_model(epochs, batch, lr, device, img_size, num_workers):
 
     model = MoistureVSRegressor().to(device)
     optim = torch.optim.Adam(model.parameters(), lr=lr)
+    # lower the LR when val MAE stops improving
+    scheduler = torch.optim.lr_scheduler.ReduceLROnPlateau(optim, mode="min", factor=lr_factor, patience=lr_patience)
     loss_fn = nn.L1Loss()     # MAE for regression
 
     best_loss = float("inf")
-    best_path = OUT_DIR / "best_regressor.pth"
+    bad_epochs = 0            # epochs since last val improvement (early stopping)
+    start_epoch = 1
+
+    if resume:
+        resume = Path(resume)
+        if not resume.exists():
+            raise FileNotFoundError(f"Checkpoint to resume from not found: {resume}")
+        ckpt = load_checkpoint(resume)
+        model.load_state_dict(ckpt["model_state"])
+        optim.load_state_dict(ckpt["optimizer_state"])
+        scheduler.load_state_dict(ckpt["scheduler_state"])
+        best_loss = ckpt["best_loss"]
+        bad_epochs = ckpt.get("bad_epochs", 0)
+        start_epoch = ckpt["epoch"] + 1
+        restore_rng_state(ckpt["rng_state"])
+        print(f"Resumed from {resume} at epoch {ckpt['epoch']} (best val MAE {best_loss:.4f})")
 
     print(f"Training samples: {len(train_ds)} | Validation samples: {len(val_ds)}")
     print(f"Device: {device} | Img size: {img_size} | Batch: {batch} | Num workers: {num_workers}")
 
-    for epoch in range(1, epochs+1):
+    for epoch in range(start_epoch, epochs+1):
         model.train()
         running_loss = 0.0
         pbar = tqdm(train_dl, desc=f"Epoch {epoch}/{epochs}", unit="batch")
@@ -171,15 +286,34 @@ def train_model(epochs, batch, lr, device, img_size, num_workers):
                 val_running += loss_fn(preds, targets).item() * imgs.size(0)
         val_loss = val_running / len(val_dl.dataset)
 
-        print(f"[{epoch}] Train MAE: {train_loss:.4f} | Val MAE: {val_loss:.4f}")
+        print(f"[{epoch}] Train MAE: {train_loss:.4f} | Val MAE: {val_loss:.4f} | LR: {optim.param_groups[0]['lr']:.2e}")
+        scheduler.step(val_loss)
 
-        if val_loss < best_loss:
+        if val_loss < best_loss - min_delta:
             best_loss = val_loss
-            torch.save({"model_state": model.state_dict()}, best_path)
-            print("✔ Saved new best model:", best_path)
+            bad_epochs = 0
+            save_atomic({"model_state": model.state_dict(), "epoch": epoch, "val_loss": val_loss}, BEST_PATH)
+            print("✔ Saved new best model:", BEST_PATH)
+        else:
+            bad_epochs += 1
+
+        # full state every epoch so a crashed/preempted run can continue with --resume
+        save_atomic({
+            "model_state": model.state_dict(),
+            "optimizer_state": optim.state_dict(),
+            "scheduler_state": scheduler.state_dict(),
+            "epoch": epoch,
+            "best_loss": best_loss,
+            "bad_epochs": bad_epochs,
+            "rng_state": rng_state(),
+        }, LAST_PATH)
+
+        if patience and bad_epochs >= patience:
+            print(f"Early stopping: no val improvement for {bad_epochs} epochs.")
+            break
 
     print("\nTraining complete.")
-    print(f"Best model saved to: {best_path}")
+    print(f"Best model saved to: {BEST_PATH}")
 
 # ------------------------------
 # CLI
@@ -192,8 +326,16 @@ if __name__ == "__main__":
     parser.add_argument("--img-size", type=int, default=320)
     parser.add_argument("--device", type=str, default="cpu")
     parser.add_argument("--num-workers", type=int, default=0, help="DataLoader num_workers (0 recommended on Windows)")
+    parser.add_argument("--resume", nargs="?", const=str(LAST_PATH), default=None,
+                        help=f"Resume from a full checkpoint (default: {LAST_PATH})")
+    parser.add_argument("--patience", type=int, default=5, help="Early stopping patience in epochs (0 disables)")
+    parser.add_argument("--min-delta", type=float, default=0.0, help="Minimum val MAE decrease counted as improvement")
+    parser.add_argument("--lr-factor", type=float, default=0.5, help="LR multiplier when val MAE plateaus")
+    parser.add_argument("--lr-patience", type=int, default=2, help="Epochs without improvement before lowering LR")
 
     args = parser.parse_args()
     device = torch.device(args.device if torch.cuda.is_available() or args.device=="cpu" else "cpu")
 
-    train_model(args.epochs, args.batch, args.lr, device, args.img_size, args.num_workers)
+    train_model(args.epochs, args.batch, args.lr, device, args.img_size, args.num_workers,
+                resume=args.resume, patience=args.patience, lr_factor=args.lr_factor,
+                lr_patience=args.lr_patience, min_delta=args.min_delta)
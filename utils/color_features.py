@@ -0,0 +1,141 @@
+# utils/color_features.py
+"""
+Cheap color features for dataset images, computed on a reduced decode.
+
+JPEGs are decoded with PIL's draft mode (DCT scaling to 1/2, 1/4 or 1/8 size)
+and then thumbnailed to at most FEATURE_SIZE px, so a 12 MP photo costs a few
+hundred KB instead of ~150 MB of float32. Channel means and a coarse
+histogram come from PIL's C histogram over the uint8 pixels; no float copy of
+the image is made. Extraction runs in a process pool and results are cached
+in dataset/.color_features.sqlite keyed by (path, mtime, size).
+
+    from utils.color_features import extract_many, green_score
+    feats = extract_many(paths)                # {path_str: ColorFeatures}
+"""
+
+import os
+import sqlite3
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+ROOT = Path(__file__).resolve().parent.parent
+CACHE_PATH = ROOT / "dataset" / ".color_features.sqlite"
+
+FEATURE_SIZE = 128
+HIST_BINS = 16      # per channel
+
+# means: (r, g, b) floats in 0..255; hist: uint32 array of shape (3, HIST_BINS)
+ColorFeatures = namedtuple("ColorFeatures", "path mean_r mean_g mean_b hist")
+
+
+def extract(path, size: int = FEATURE_SIZE):
+    """Features for one file, or None if it can't be decoded."""
+    path = str(path)
+    try:
+        with Image.open(path) as im:
+            im.draft("RGB", (size, size))      # JPEG: decode directly at reduced scale
+            im = im.convert("RGB")
+            im.thumbnail((size, size))
+            h = np.asarray(im.histogram(), dtype=np.uint32).reshape(3, 256)
+    except Exception:
+        return None
+    n = h[0].sum()
+    if n == 0:
+        return None
+    levels = np.arange(256)
+    mean_r, mean_g, mean_b = (float((h[c] * levels).sum() / n) for c in range(3))
+    coarse = h.reshape(3, HIST_BINS, 256 // HIST_BINS).sum(axis=2).astype(np.uint32)
+    return ColorFeatures(path, mean_r, mean_g, mean_b, coarse)
+
+
+def green_score(f: ColorFeatures) -> float:
+    """Green dominance: G relative to the mean of R and B."""
+    return (f.mean_g + 1e-6) / ((f.mean_r + f.mean_b) / 2 + 1e-6)
+
+
+def _extract_with_stat(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return path, None, None, None
+    return path, st.st_mtime_ns, st.st_size, extract(path)
+
+
+class FeatureCache:
+    """sqlite-backed cache of ColorFeatures keyed by (path, mtime_ns, size); None marks undecodable files."""
+
+    def __init__(self, path: Path = CACHE_PATH):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(path))
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS features (
+                path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER,
+                mean_r REAL, mean_g REAL, mean_b REAL, hist BLOB
+            )""")
+
+    def load(self):
+        out = {}
+        for p, mt, sz, r, g, b, hist in self.conn.execute("SELECT * FROM features"):
+            feats = None
+            if hist is not None:
+                feats = ColorFeatures(p, r, g, b, np.frombuffer(hist, dtype=np.uint32).reshape(3, HIST_BINS))
+            out[p] = (mt, sz, feats)
+        return out
+
+    def store(self, rows):
+        """rows: iterable of (path, mtime_ns, size, ColorFeatures or None)."""
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO features VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(p, mt, sz,
+              f.mean_r if f else None, f.mean_g if f else None, f.mean_b if f else None,
+              f.hist.tobytes() if f else None)
+             for p, mt, sz, f in rows])
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def extract_many(paths, workers: int = None, cache_path: Path = CACHE_PATH, use_cache: bool = True):
+    """
+    {path_str: ColorFeatures} for every decodable path. Cached entries whose
+    (mtime, size) still match are reused; the rest go through a process pool.
+    """
+    paths = [str(p) for p in paths]
+    cache = FeatureCache(cache_path) if use_cache else None
+    cached = cache.load() if cache else {}
+
+    results, todo = {}, []
+    for p in paths:
+        hit = cached.get(p)
+        if hit is not None:
+            try:
+                st = os.stat(p)
+            except OSError:
+                continue
+            if hit[0] == st.st_mtime_ns and hit[1] == st.st_size:
+                if hit[2] is not None:
+                    results[p] = hit[2]
+                continue
+        todo.append(p)
+
+    fresh = []
+    if todo:
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for p, mt, sz, f in pool.map(_extract_with_stat, todo, chunksize=32):
+                if mt is None:
+                    continue
+                fresh.append((p, mt, sz, f))
+                if f is not None:
+                    results[p] = f
+
+    if cache:
+        if fresh:
+            cache.store(fresh)
+        cache.close()
+    return results
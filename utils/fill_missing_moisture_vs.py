@@ -1,5 +1,7 @@
 # utils/fill_missing_moisture_vs.py
-import os, sys, random
+import argparse
+import os
+import numpy as np
 import pandas as pd
 from pathlib import Path
 
@@ -15,11 +17,32 @@ SEED_RESIDUE_VS = 0.7296
 DEFAULT_LEAF_MOIST = 30.0
 DEFAULT_LEAF_VS = 0.15
 
-def is_image_path_ok(p: str):
-    pth = (ROOT / p).resolve()
-    return pth.exists()
+SEED = 42
+
+
+def existing_files(root: Path) -> set:
+    """All files under dataset/, as posix paths relative to the project root (one directory walk)."""
+    out = set()
+    for dirpath, _, files in os.walk(root / "dataset"):
+        rel = Path(dirpath).relative_to(root).as_posix()
+        out.update(f"{rel}/{f}" for f in files)
+    return out
+
+
+def resolve_exists(paths: pd.Series, existing: set) -> pd.Series:
+    """Vectorized version of the old per-row lookups: path as-is, dataset/<path>, or dataset/dataset/ collapsed."""
+    p = paths.astype(str).str.replace("\\", "/", regex=False).str.lstrip("./")
+    ok = p.isin(existing)
+    ok |= ("dataset/" + p).isin(existing)
+    ok |= p.str.replace(r"^dataset/dataset/", "dataset/", regex=True).isin(existing)
+    return ok
+
 
 def main():
+    ap = argparse.ArgumentParser(description="Fill missing moisture_percent / vs_fraction in labels.csv")
+    ap.add_argument("--seed", type=int, default=SEED, help="RNG seed (same seed + CSV => same output)")
+    args = ap.parse_args()
+
     if not LABELS.exists():
         print("labels.csv not found at", LABELS)
         return
@@ -29,63 +52,41 @@ def main():
         return
 
     # normalize column names / ensure columns present
-    for c in ("moisture_percent","vs_fraction","labeled"):
+    for c in ("moisture_percent","vs_fraction","labeled","notes"):
         if c not in df.columns:
             df[c] = pd.NA
 
-    filled = 0
-    missing_images = 0
-    for i, row in df.iterrows():
-        img_path = str(row["image_path"])
-        # normalize path if it is relative incorrectly (some rows have dataset/images/... as prefix already)
-        if not (ROOT / img_path).exists():
-            # try with dataset/images prefix
-            alt = Path("dataset") / img_path
-            if alt.exists():
-                img_path = str(alt)
-            else:
-                # try stripping a duplicated prefix
-                if img_path.startswith("dataset/dataset/"):
-                    cand = img_path.replace("dataset/dataset/","dataset/")
-                    if (ROOT / cand).exists():
-                        img_path = cand
-
-        if not is_image_path_ok(img_path):
-            missing_images += 1
-            continue
-
-        cat = str(row.get("category") or "").strip().lower()
-        # if already present and numeric, skip
-        m = row.get("moisture_percent")
-        v = row.get("vs_fraction")
-        has_m = False
-        try:
-            if m is not None and (str(m).strip() != "" and not pd.isna(m)):
-                float(m)
-                has_m = True
-        except Exception:
-            has_m = False
-
-        if has_m and v is not None and str(v).strip() != "" and not pd.isna(v):
-            continue
-
-        # Fill according to category
-        if cat == "residue":
-            # use seed average + tiny random noise to avoid identical entries
-            noisemoist = SEED_RESIDUE_MOIST + random.uniform(-1.5, 1.5)
-            noisyvs = SEED_RESIDUE_VS + random.uniform(-0.03, 0.03)
-            df.at[i, "moisture_percent"] = round(max(0.0, min(100.0, noisemoist)), 3)
-            df.at[i, "vs_fraction"] = round(max(0.0, min(1.0, noisyvs)), 4)
-            df.at[i, "notes"] = (str(row.get("notes") or "") + " auto-filled-from-seed").strip()
-            filled += 1
-        elif cat == "leaf":
-            df.at[i, "moisture_percent"] = DEFAULT_LEAF_MOIST
-            df.at[i, "vs_fraction"] = DEFAULT_LEAF_VS
-            df.at[i, "notes"] = (str(row.get("notes") or "") + " auto-filled-leaf-default").strip()
-            filled += 1
-        else:
-            # Unknown category: leave as NaN (we don't guess)
-            pass
+    exists = resolve_exists(df["image_path"], existing_files(ROOT))
+    missing_images = int((~exists).sum())
+
+    # rows that already have numeric moisture and VS are left alone
+    has_m = pd.to_numeric(df["moisture_percent"], errors="coerce").notna()
+    has_v = pd.to_numeric(df["vs_fraction"], errors="coerce").notna()
+    need = exists & ~(has_m & has_v)
+
+    cat = df["category"].fillna("").astype(str).str.strip().str.lower()
+    residue = need & (cat == "residue")
+    leaf = need & (cat == "leaf")
+    # Unknown category: leave as NaN (we don't guess)
+
+    for c in ("moisture_percent", "vs_fraction", "notes"):
+        df[c] = df[c].astype(object)
+    notes = df["notes"].fillna("").astype(str)
+
+    # residue: seed average + tiny random noise to avoid identical entries (one batched draw)
+    rng = np.random.default_rng(args.seed)
+    n_res = int(residue.sum())
+    moist = np.clip(SEED_RESIDUE_MOIST + rng.uniform(-1.5, 1.5, n_res), 0.0, 100.0).round(3)
+    vs = np.clip(SEED_RESIDUE_VS + rng.uniform(-0.03, 0.03, n_res), 0.0, 1.0).round(4)
+    df.loc[residue, "moisture_percent"] = moist
+    df.loc[residue, "vs_fraction"] = vs
+    df.loc[residue, "notes"] = (notes[residue] + " auto-filled-from-seed").str.strip()
+
+    df.loc[leaf, "moisture_percent"] = DEFAULT_LEAF_MOIST
+    df.loc[leaf, "vs_fraction"] = DEFAULT_LEAF_VS
+    df.loc[leaf, "notes"] = (notes[leaf] + " auto-filled-leaf-default").str.strip()
+
+    filled = n_res + int(leaf.sum())
 
     df.to_csv(OUT, index=False)
     print("✔ Wrote", OUT)
@@ -0,0 +1,226 @@
+# utils/image_scanner.py
+"""
+Parallel, header-only image metadata scanner with a persistent cache.
+
+Reads size, mode, format and EXIF orientation from image headers only (no
+pixel decode) in a thread pool, flags unreadable / truncated files, and caches
+results in dataset/.image_meta.sqlite keyed by (path, mtime, size), so repeated
+data-quality checks only touch files that changed.
+
+    from utils.image_scanner import scan
+    meta = scan(paths)              # {path_str: ImageMeta}
+    bad = [m for m in meta.values() if not m.ok]
+
+CLI:
+    python utils/image_scanner.py dataset/images --report dataset/bad_images.csv
+"""
+
+import argparse
+import csv
+import mmap
+import os
+import re
+import sqlite3
+import sys
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from PIL import Image
+
+ROOT = Path(__file__).resolve().parent.parent
+CACHE_PATH = ROOT / "dataset" / ".image_meta.sqlite"
+IMG_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp"}
+
+ImageMeta = namedtuple("ImageMeta", "path width height mode format orientation ok error")
+
+EXIF_ORIENTATION = 0x0112
+# how far from the end to look for PNG's IEND chunk (some tools append padding)
+_TAIL_BYTES = 4096
+# bump when probe() results change meaning; cached rows from older versions are dropped
+PROBE_VERSION = 2
+
+_JPEG_NEXT_MARKER = re.compile(rb"\xff[^\x00\xd0-\xd7\xff]")     # skips stuffed FF00, RSTn and fill bytes
+
+
+def _jpeg_has_eoi(path: str) -> bool:
+    """
+    Walk the JPEG segments from SOI to EOI. Phone "motion photos" and other
+    files carry a video or metadata after EOI, so "FFD9 near the end of the
+    file" is not a usable test; an FFD9 inside an EXIF thumbnail is not either.
+    """
+    with open(path, "rb") as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:          # empty file
+            return False
+    with data:
+        n = len(data)
+        if data[:2] != b"\xff\xd8":
+            return False
+        pos = 2
+        while pos + 4 <= n:
+            if data[pos] != 0xFF:
+                return False
+            marker = data[pos + 1]
+            if marker == 0xFF:                  # fill byte
+                pos += 1
+                continue
+            if marker == 0xD9:
+                return True
+            if 0xD0 <= marker <= 0xD7 or marker == 0x01:    # standalone markers
+                pos += 2
+                continue
+            pos += 2 + int.from_bytes(data[pos + 2:pos + 4], "big")
+            if marker == 0xDA:                  # SOS: entropy-coded data runs to the next real marker
+                m = _JPEG_NEXT_MARKER.search(data, pos)
+                if m is None:
+                    return False
+                pos = m.start()
+        return pos + 2 <= n and data[pos:pos + 2] == b"\xff\xd9"
+
+
+def _check_tail(path: str, fmt: str):
+    """Cheap truncation check: JPEG must reach EOI (FFD9), PNG must contain IEND near the end."""
+    if fmt in ("JPEG", "MPO"):
+        return None if _jpeg_has_eoi(path) else f"truncated {fmt} (no end marker)"
+    if fmt != "PNG":
+        return None
+    with open(path, "rb") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - _TAIL_BYTES))
+        tail = f.read()
+    return None if b"IEND" in tail else f"truncated {fmt} (no end marker)"
+
+
+def probe(path) -> ImageMeta:
+    """Header-only probe of one file. Never raises; failures are reported in .ok/.error."""
+    path = str(path)
+    try:
+        with Image.open(path) as im:
+            w, h = im.size
+            mode, fmt = im.mode, im.format
+            try:
+                orientation = int(im.getexif().get(EXIF_ORIENTATION, 1))
+            except Exception:
+                orientation = 1
+        err = _check_tail(path, fmt)
+        return ImageMeta(path, w, h, mode, fmt, orientation, err is None, err)
+    except FileNotFoundError:
+        return ImageMeta(path, None, None, None, None, None, False, "missing")
+    except Exception as e:
+        return ImageMeta(path, None, None, None, None, None, False, f"unreadable: {e}")
+
+
+class MetaCache:
+    """sqlite-backed cache of ImageMeta keyed by (path, mtime_ns, size)."""
+
+    def __init__(self, path: Path = CACHE_PATH):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.conn = sqlite3.connect(str(path))
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS meta (
+                path TEXT PRIMARY KEY, mtime_ns INTEGER, size INTEGER,
+                width INTEGER, height INTEGER, mode TEXT, format TEXT,
+                orientation INTEGER, ok INTEGER, error TEXT
+            )""")
+        if self.conn.execute("PRAGMA user_version").fetchone()[0] != PROBE_VERSION:
+            self.conn.execute("DELETE FROM meta")         # probed by an older scanner
+            self.conn.execute(f"PRAGMA user_version = {PROBE_VERSION}")
+            self.conn.commit()
+
+    def load(self, paths):
+        """{path: (mtime_ns, size, ImageMeta)} for the requested paths that are cached."""
+        out = {}
+        wanted = list(paths)
+        for i in range(0, len(wanted), 900):          # stay under SQLite's variable limit
+            chunk = wanted[i:i + 900]
+            q = f"SELECT * FROM meta WHERE path IN ({','.join('?' * len(chunk))})"
+            for r in self.conn.execute(q, chunk):
+                out[r[0]] = (r[1], r[2], ImageMeta(r[0], r[3], r[4], r[5], r[6], r[7], bool(r[8]), r[9]))
+        return out
+
+    def store(self, entries):
+        """entries: iterable of (mtime_ns, size, ImageMeta)."""
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO meta VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(m.path, mt, sz, m.width, m.height, m.mode, m.format, m.orientation, int(m.ok), m.error)
+             for mt, sz, m in entries])
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+
+def scan(paths, workers: int = 16, cache_path: Path = CACHE_PATH, use_cache: bool = True):
+    """
+    Probe many files in parallel. Returns {path_str: ImageMeta} in input order.
+    Only files whose (mtime, size) changed since the cached probe are re-read.
+    """
+    paths = [str(p) for p in paths]
+    cache = MetaCache(cache_path) if use_cache else None
+    cached = cache.load(set(paths)) if cache else {}
+
+    def work(p):
+        try:
+            st = os.stat(p)
+        except OSError:
+            return None, ImageMeta(p, None, None, None, None, None, False, "missing")
+        hit = cached.get(p)
+        if hit and hit[0] == st.st_mtime_ns and hit[1] == st.st_size:
+            return None, hit[2]
+        m = probe(p)
+        return (st.st_mtime_ns, st.st_size, m), m
+
+    results, fresh = {}, []
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for new_entry, meta in pool.map(work, paths, chunksize=64):
+            results[meta.path] = meta
+            if new_entry is not None:
+                fresh.append(new_entry)
+
+    if cache:
+        if fresh:
+            cache.store(fresh)
+        cache.close()
+    return results
+
+
+def iter_images(root: Path):
+    for dirpath, _, files in os.walk(root):
+        for f in files:
+            if os.path.splitext(f)[1].lower() in IMG_EXTS:
+                yield os.path.join(dirpath, f)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Header-only scan of image folders for corrupt/truncated files")
+    ap.add_argument("roots", nargs="*", default=[str(ROOT / "dataset" / "images")])
+    ap.add_argument("--workers", type=int, default=16)
+    ap.add_argument("--no-cache", action="store_true")
+    ap.add_argument("--report", type=str, default=None, help="Write bad files to this CSV")
+    args = ap.parse_args()
+
+    paths = [p for r in args.roots for p in iter_images(Path(r))]
+    if not paths:
+        print("No images found under", ", ".join(args.roots))
+        sys.exit(1)
+
+    meta = scan(paths, workers=args.workers, use_cache=not args.no_cache)
+    bad = [m for m in meta.values() if not m.ok]
+    rotated = sum(1 for m in meta.values() if m.ok and m.orientation not in (None, 1))
+    print(f"Scanned {len(meta)} images: {len(bad)} bad, {rotated} with EXIF rotation")
+    for m in bad[:20]:
+        print(f"  {m.path}: {m.error}")
+
+    if args.report:
+        with open(args.report, "w", newline="", encoding="utf-8") as f:
+            w = csv.writer(f)
+            w.writerow(["path", "error"])
+            w.writerows((m.path, m.error) for m in bad)
+        print("Wrote", args.report)
+
+
+if __name__ == "__main__":
+    main()
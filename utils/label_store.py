@@ -0,0 +1,258 @@
+# utils/label_store.py
+"""
+Label storage for the Streamlit labeling tools.
+
+Saving a label appends one JSON line to <csv>.events.jsonl (O(1), fsynced)
+instead of rewriting the whole CSV. The CSV stays the source of truth for
+every other script: the event log is folded into it atomically (temp file +
+os.replace) every `compact_every` saves, on process exit, or on demand.
+
+Reads are cached in memory: the CSV is parsed once and re-read only if its
+(mtime, size) changes on disk; new log lines are replayed incrementally.
+Display thumbnails are generated once per image into dataset/.thumbs/.
+
+    store = LabelStore("dataset/labels.csv", key="image_path")
+    df = store.frame()                      # CSV + pending events
+    store.save("images/residue/5.jpg", {"category": "residue", "labeled": 1})
+
+CLI:
+    python utils/label_store.py compact dataset/labels.csv --key image_path
+    python utils/label_store.py thumbs dataset/images dataset/seed_images
+"""
+
+import argparse
+import atexit
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+from PIL import Image, ImageOps
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.append(str(ROOT / "backend"))
+
+from atomic import atomic_write
+
+THUMB_DIR = ROOT / "dataset" / ".thumbs"
+THUMB_SIZE = 768
+IMG_EXTS = {".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp"}
+
+
+def _signature(path: Path):
+    try:
+        st = path.stat()
+        return (st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
+        return None
+
+
+class LabelStore:
+    def __init__(self, csv_path, key: str, columns=None, log_path=None, compact_every: int = 50):
+        self.csv_path = Path(csv_path)
+        self.key = key
+        self.columns = list(columns) if columns else None
+        self.log_path = Path(log_path) if log_path else self.csv_path.with_suffix(".events.jsonl")
+        self.compact_every = compact_every
+        self._lock = threading.RLock()
+        self._df = None
+        self._row_of = {}           # key value -> df index
+        self._csv_sig = None
+        self._log_offset = 0        # bytes of the log already applied
+        self._pending = 0           # events not yet compacted into the CSV
+        atexit.register(self._compact_at_exit)
+
+    # --------------------------
+    # Reads
+    # --------------------------
+    def _load_csv(self):
+        if self.csv_path.exists():
+            df = pd.read_csv(self.csv_path)
+        else:
+            df = pd.DataFrame(columns=self.columns or [self.key])
+        for c in self.columns or []:
+            if c not in df.columns:
+                df[c] = None
+        self._df = df.reset_index(drop=True)
+        self._row_of = {str(v): i for i, v in enumerate(self._df[self.key].astype(str))}
+        self._csv_sig = _signature(self.csv_path)
+        self._log_offset = 0
+        self._pending = 0
+
+    def _apply(self, key_value: str, fields: dict):
+        df = self._df
+        for c in fields:
+            if c not in df.columns:
+                df[c] = None
+        i = self._row_of.get(key_value)
+        if i is None:
+            i = len(df)
+            df.loc[i] = {self.key: key_value, **fields}
+            self._row_of[key_value] = i
+        else:
+            for c, v in fields.items():
+                if df[c].dtype != object and not isinstance(v, (int, float)):
+                    df[c] = df[c].astype(object)
+                df.at[i, c] = v
+
+    def _replay(self):
+        if not self.log_path.exists():
+            return
+        with open(self.log_path, "rb") as f:
+            f.seek(self._log_offset)
+            for raw in f:
+                if not raw.endswith(b"\n"):
+                    break           # partially written last line; pick it up next time
+                self._log_offset += len(raw)
+                try:
+                    e = json.loads(raw)
+                except ValueError:
+                    continue
+                self._apply(str(e["key"]), e["fields"])
+                self._pending += 1
+
+    def frame(self) -> pd.DataFrame:
+        """Current labels (CSV + uncompacted events). Treat the result as read-only."""
+        with self._lock:
+            if self._df is None or _signature(self.csv_path) != self._csv_sig:
+                self._load_csv()
+            self._replay()
+            return self._df
+
+    def get(self, key_value) -> dict:
+        df = self.frame()
+        i = self._row_of.get(str(key_value))
+        return {} if i is None else df.loc[i].to_dict()
+
+    # --------------------------
+    # Writes
+    # --------------------------
+    def save(self, key_value, fields: dict):
+        """Append one label event; compacts into the CSV every `compact_every` events."""
+        key_value = str(key_value)
+        event = {"ts": time.time(), "key": key_value, "fields": fields}
+        line = (json.dumps(event, default=str) + "\n").encode("utf-8")
+        with self._lock:
+            self.frame()
+            self.log_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.log_path, "ab") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self._log_offset += len(line)
+            self._apply(key_value, fields)
+            self._pending += 1
+            if self.compact_every and self._pending >= self.compact_every:
+                self.compact()
+
+    def compact(self):
+        """Fold pending events into the CSV atomically, then truncate the log."""
+        with self._lock:
+            df = self.frame()
+            if self._pending == 0 and self.csv_path.exists():
+                return 0
+            with atomic_write(self.csv_path, "w", newline="", encoding="utf-8") as f:
+                df.to_csv(f, index=False)
+            # a crash between the replace and the truncate only means the same
+            # events are replayed again on top of the new CSV, which is harmless
+            n, self._pending = self._pending, 0
+            if self.log_path.exists():
+                open(self.log_path, "wb").close()
+            self._log_offset = 0
+            self._csv_sig = _signature(self.csv_path)
+            return n
+
+    def _compact_at_exit(self):
+        try:
+            if self._df is not None and self._pending:
+                self.compact()
+        except Exception as e:
+            print("⚠️ Label compaction at exit failed:", e, file=sys.stderr)
+
+
+# --------------------------
+# Display thumbnails
+# --------------------------
+def thumbnail_path(img_path, size: int = THUMB_SIZE) -> Path:
+    p = Path(img_path)
+    st = p.stat()
+    h = hashlib.sha1(f"{p.resolve()}|{st.st_mtime_ns}|{st.st_size}|{size}".encode()).hexdigest()
+    return THUMB_DIR / h[:2] / f"{h}.jpg"
+
+
+def thumbnail(img_path, size: int = THUMB_SIZE) -> Path:
+    """Path to a cached display-size JPEG of `img_path`, creating it on first use."""
+    out = thumbnail_path(img_path, size)
+    if out.exists():
+        return out
+    with Image.open(img_path) as im:
+        im.draft("RGB", (size, size))
+        im = ImageOps.exif_transpose(im).convert("RGB")
+        im.thumbnail((size, size))
+        with atomic_write(out) as f:         # a failed save leaves no temp file behind
+            im.save(f, "JPEG", quality=85)
+    return out
+
+
+def display_image(img_path, size: int = THUMB_SIZE):
+    """Thumbnail path if it can be made, else the original (the UI still shows something)."""
+    try:
+        return str(thumbnail(img_path, size))
+    except Exception:
+        return str(img_path)
+
+
+def prefetch_thumbnails(paths, size: int = THUMB_SIZE):
+    """Warm thumbnails for the next images in a background thread."""
+    def run():
+        for p in paths:
+            try:
+                thumbnail(p, size)
+            except Exception:
+                pass
+    threading.Thread(target=run, daemon=True).start()
+
+
+def pregenerate(roots, size: int = THUMB_SIZE, workers: int = 8):
+    paths = [os.path.join(d, f) for r in roots for d, _, files in os.walk(r)
+             for f in files if os.path.splitext(f)[1].lower() in IMG_EXTS]
+
+    def work(p):
+        try:
+            thumbnail(p, size)
+            return True
+        except Exception:
+            return False
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        ok = sum(pool.map(work, paths, chunksize=32))
+    return ok, len(paths)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Label store maintenance")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    c = sub.add_parser("compact", help="Fold the event log into the CSV")
+    c.add_argument("csv")
+    c.add_argument("--key", default="image_path")
+    t = sub.add_parser("thumbs", help="Pre-generate display thumbnails")
+    t.add_argument("roots", nargs="*", default=[str(ROOT / "dataset" / "images"), str(ROOT / "dataset" / "seed_images")])
+    t.add_argument("--size", type=int, default=THUMB_SIZE)
+    t.add_argument("--workers", type=int, default=8)
+    args = ap.parse_args()
+
+    if args.cmd == "compact":
+        n = LabelStore(args.csv, key=args.key).compact()
+        print(f"Compacted {n} events into {args.csv}")
+    else:
+        ok, total = pregenerate(args.roots, args.size, args.workers)
+        print(f"Thumbnails ready for {ok}/{total} images in {THUMB_DIR}")
+
+
+if __name__ == "__main__":
+    main()